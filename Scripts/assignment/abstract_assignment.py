@@ -26,6 +26,11 @@ class AssignmentModel:
         """
         pass
 
+    @abstractmethod
+    def zone_system(self):
+        """Zone numbering of assignment model (datahandling.ZoneSystem)."""
+        pass
+
     @abstractmethod
     def mapping(self):
         """Dictionary of zone numbers and corresponding indices."""
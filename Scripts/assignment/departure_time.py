@@ -8,31 +8,94 @@ from parameters.assignment import transport_classes, assignment_classes
 class DepartureTimeModel:
     """Container for time period and assignment class specific demand.
 
+    All demand is stored in one contiguous array (`tensor`) of shape
+    (time period, assignment class, zone, zone), allocated once and
+    zero-filled in place when demand is reset. Matrices in `demand`
+    are views to this array.
+
+    In factorized mode, daily demand matrices are kept as they are,
+    together with the demand shares of their purpose and mode, and
+    time period matrices are calculated only when `demand` is
+    accessed (or `materialize` is called). Until then, `tensor`
+    does not include this demand.
+
     Parameters
     ----------
     nr_zones : int
         Number of zones in assignment model
     time_periods : list
         List of time periods to assign (aht, pt, iht)
+    dtype : numpy.dtype (optional)
+        Float type of demand matrices
+    memmap_path : str (optional)
+        If given, demand array is memory-mapped to this file
+        (which is overwritten)
+    factorized : bool (optional)
+        Whether daily demand matrices are split into time periods
+        lazily (only dense matrices for whole purpose)
     """
 
-    def __init__(self, nr_zones, time_periods):
+    def __init__(self, nr_zones, time_periods, dtype=numpy.float64,
+                 memmap_path=None, factorized=False):
         self.nr_zones = nr_zones
-        self.time_periods = time_periods
-        self.init_demand()
+        self.time_periods = tuple(time_periods)
+        self.dtype = dtype
+        self.factorized = factorized
+        self._factors = {}
+        shape = (len(self.time_periods), len(transport_classes),
+                 nr_zones, nr_zones)
+        if memmap_path is None:
+            self.tensor = numpy.zeros(shape, dtype)
+        else:
+            self.tensor = numpy.memmap(memmap_path, dtype, "w+", shape=shape)
+        self._set_views()
+
+    def _set_views(self):
+        self._demand = {}
+        for i, time_period in enumerate(self.time_periods):
+            self._demand[time_period] = {
+                ass_class: self.tensor[i, j]
+                for j, ass_class in enumerate(transport_classes)}
+
+    @property
+    def demand(self):
+        """dict: Demand matrices by time period and assignment class."""
+        if self._factors:
+            self.materialize()
+        return self._demand
+
+    def materialize(self):
+        """Add factorized daily demand to time period matrices.
+
+        Matrices added to same block of same assignment class are
+        multiplied with their shares and summed first, so that
+        each block (and its transpose) is updated only once
+        per time period.
+        """
+        factors, self._factors = self._factors, {}
+        for (ass_class, r_0, c_0, shape), group in sorted(factors.items()):
+            r_n = r_0 + shape[0]
+            c_n = c_0 + shape[1]
+            for time_period in self.time_periods:
+                forward = numpy.zeros(shape, self.dtype)
+                backward = numpy.zeros(shape, self.dtype)
+                for share, mtx in group:
+                    forward += share[time_period][0] * mtx
+                    backward += share[time_period][1] * mtx
+                large_mtx = self._demand[time_period][ass_class]
+                large_mtx[r_0:r_n, c_0:c_n] += forward
+                large_mtx[c_0:c_n, r_0:r_n] += backward.T
 
     def init_demand(self):
-        """Initialize/reset demand for all time periods.
+        """Reset demand for all time periods.
 
         Includes all transport_classes, each being set to zero.
+        Matrices that have been replaced in `demand` are
+        replaced with views to demand array again.
         """
-        self.demand = dict.fromkeys(self.time_periods)
-        for time_period in self.demand:
-            ass_classes = dict.fromkeys(transport_classes)
-            self.demand[time_period] = ass_classes
-            for ass_class in ass_classes:
-                zeros = numpy.zeros((self.nr_zones, self.nr_zones))
-                self.demand[time_period][ass_class] = zeros
+        self._factors = {}
+        self.tensor.fill(0)
+        self._set_views()
 
     def add_demand(self, demand):
         """Add demand matrix for whole day.
@@ -43,12 +106,15 @@ class DepartureTimeModel:
             Travel demand matrix or number of travellers
         """
         if demand.mode not in ("walk", "car_passenger"):
-            if demand.mode in ("car", "transit", "bike"):
-                ass_class = (demand.mode + '_' + assignment_classes[demand.purpose.name])
-            else:
-                ass_class = demand.mode
+            ass_class = self._ass_class(demand.purpose.name, demand.mode)
             if len(demand.position) == 2:
                 share = param.demand_share[demand.purpose.name][demand.mode]
+                if self.factorized and self._is_factorizable(demand, share):
+                    r_0, c_0 = demand.position
+                    key = (ass_class, r_0, c_0, demand.matrix.shape)
+                    self._factors.setdefault(key, []).append(
+                        (share, demand.matrix))
+                    return
                 for time_period in self.time_periods:
                     self._add_2d_demand(
                         share[time_period], ass_class, time_period,
@@ -59,6 +125,177 @@ class DepartureTimeModel:
             else:
                 raise IndexError("Tuple position has wrong dimensions.")
 
+    def add_sec_dest_demand(self, purpose, mode, mtx, return_mtx,
+                            first_origin):
+        """Add secondary destination demand of several origins.
+
+        Parameters
+        ----------
+        purpose : datatypes.purpose.SecDestPurpose
+            Secondary destination purpose
+        mode : str
+            Travel mode (car/transit/bike)
+        mtx : numpy.ndarray
+            Destination -> secondary destination demand,
+            summed over origins
+        return_mtx : numpy.ndarray
+            Secondary destination -> origin demand, with one column
+            for each origin
+        first_origin : int
+            Zone index of origin of first column in `return_mtx`
+        """
+        if mode in ("walk", "car_passenger"):
+            return
+        ass_class = self._ass_class(purpose.name, mode)
+        for tp in self.time_periods:
+            share = param.demand_share[purpose.name][mode][tp]
+            self._add_2d_demand(share[0], ass_class, tp, mtx, (0, 0))
+            self._add_2d_demand(
+                share[1], ass_class, tp, return_mtx, (0, first_origin))
+
+    def _ass_class(self, purpose_name, mode):
+        if mode in ("car", "transit", "bike"):
+            return mode + '_' + assignment_classes[purpose_name]
+        return mode
+
+    def _is_factorizable(self, demand, share):
+        """Check if demand is dense with scalar demand shares."""
+        if not isinstance(demand.matrix, numpy.ndarray):
+            return False
+        return all(numpy.ndim(share[tp][i]) == 0
+                   for tp in self.time_periods for i in (0, 1))
+
+    def add_tours(self, purposes, modes, origins, destinations,
+                  sec_dests=None, sec_dest_purposes=None, weights=None):
+        """Add a batch of agent tours (one person per tour) for whole day.
+
+        Instead of adding tours one-by-one, the demand share of each
+        tour leg is scattered into demand matrices at once.
+        For parameters, see `calc_tour_demand()`.
+        """
+        self.add_tour_demand(self.calc_tour_demand(
+            purposes, modes, origins, destinations, sec_dests,
+            sec_dest_purposes, weights))
+
+    def calc_tour_demand(self, purposes, modes, origins, destinations,
+                         sec_dests=None, sec_dest_purposes=None,
+                         weights=None):
+        """Calculate demand of a batch of agent tours in compact form.
+
+        Parameters
+        ----------
+        purposes : numpy.ndarray
+            Tour purpose name (hw/hs/...) for each tour
+        modes : numpy.ndarray
+            Tour mode (car/transit/bike/...) for each tour
+        origins : numpy.ndarray
+            Origin zone index for each tour
+        destinations : numpy.ndarray
+            Destination zone index for each tour
+        sec_dests : numpy.ndarray (optional)
+            Secondary destination zone index for each tour,
+            negative if tour has no secondary destination
+        sec_dest_purposes : dict (optional)
+            key : str
+                Tour purpose name
+            value : str
+                Name of secondary destination purpose of this purpose,
+                needed if any tour has secondary destination
+        weights : numpy.ndarray (optional)
+            Number of persons making each tour (default is one)
+
+        Returns
+        -------
+        dict
+            key : tuple
+                str
+                    Time period (aht/pt/iht)
+                str
+                    Assignment class (car_work/transit_leisure/...)
+            value : tuple
+                numpy.ndarray
+                    Flat (row-major) matrix indices with demand
+                numpy.ndarray
+                    Demand in these matrix elements
+        """
+        if len(purposes) == 0:
+            return {}
+        purposes = numpy.asarray(purposes)
+        modes = numpy.asarray(modes)
+        origins = numpy.asarray(origins, numpy.intp)
+        destinations = numpy.asarray(destinations, numpy.intp)
+        if sec_dests is None:
+            sec_dests = numpy.full(origins.size, -1, numpy.intp)
+        else:
+            sec_dests = numpy.asarray(sec_dests, numpy.intp)
+        if weights is None:
+            weights = numpy.ones(origins.size)
+        else:
+            weights = numpy.asarray(weights, float)
+        # Sort tours by purpose-mode group, to handle one group at a time
+        purpose_names, purpose_idx = numpy.unique(
+            purposes, return_inverse=True)
+        mode_names, mode_idx = numpy.unique(modes, return_inverse=True)
+        group = purpose_idx*mode_names.size + mode_idx
+        order = numpy.argsort(group, kind="mergesort")
+        group = group[order]
+        bounds = numpy.flatnonzero(numpy.diff(group)) + 1
+        starts = numpy.r_[0, bounds]
+        ends = numpy.r_[bounds, group.size]
+        # Flat matrix indices and weights for each time period and class
+        legs = {}
+        n = self.nr_zones
+        for start, end in zip(starts, ends):
+            purpose = purpose_names[group[start] // mode_names.size]
+            mode = mode_names[group[start] % mode_names.size]
+            if mode in ("walk", "car_passenger"):
+                continue
+            if mode in ("car", "transit", "bike"):
+                ass_class = mode + '_' + assignment_classes[purpose]
+            else:
+                ass_class = mode
+            tours = order[start:end]
+            o = origins[tours]
+            d1 = destinations[tours]
+            d2 = sec_dests[tours]
+            w = weights[tours]
+            has_sec = d2 >= 0
+            pairs = [(o[~has_sec], d1[~has_sec], w[~has_sec])]
+            if has_sec.any():
+                sec_purpose = sec_dest_purposes[purpose]
+                o, d1, d2, w = o[has_sec], d1[has_sec], d2[has_sec], w[has_sec]
+                pairs += [(o, d1, w), (d1, d2, w), (d2, o, w)]
+            for tp in self.time_periods:
+                share = param.demand_share[purpose][mode][tp]
+                shares = (share, share)
+                if has_sec.any():
+                    shares += param.demand_share[sec_purpose][mode][tp]
+                for (r, c, w), leg_share in zip(pairs, shares):
+                    leg = legs.setdefault((tp, ass_class), [])
+                    # Leg is added in given direction and its transpose
+                    leg.append((r*n + c, leg_share[0] * w))
+                    leg.append((c*n + r, leg_share[1] * w))
+        tour_demand = {}
+        for key, leg in legs.items():
+            idx = numpy.concatenate([i for i, _ in leg])
+            values = numpy.concatenate([v for _, v in leg])
+            # Sum duplicate o-d pairs
+            idx, inverse = numpy.unique(idx, return_inverse=True)
+            tour_demand[key] = (idx, numpy.bincount(inverse, values))
+        return tour_demand
+
+    def add_tour_demand(self, tour_demand):
+        """Add demand calculated with `calc_tour_demand()`.
+
+        Parameters
+        ----------
+        tour_demand : dict
+            (time period, assignment class) : (matrix indices, demand)
+        """
+        n = self.nr_zones
+        for (tp, ass_class), (idx, values) in sorted(tour_demand.items()):
+            self._demand[tp][ass_class][idx // n, idx % n] += values
+
     def _add_2d_demand(self, demand_share, ass_class, time_period, mtx, mtx_pos):
         """Slice demand, include transpose and add for one time period."""
         r_0 = mtx_pos[0]
@@ -70,17 +307,24 @@ class DepartureTimeModel:
             r_n = r_0 + 1
             c_n = c_0 + 1
             mtx = numpy.asarray([mtx])
-        large_mtx = self.demand[time_period][ass_class]
+        large_mtx = self._demand[time_period][ass_class]
         try:
-            large_mtx[r_0:r_n, c_0:c_n] += demand_share[0] * mtx
-            large_mtx[c_0:c_n, r_0:r_n] += demand_share[1] * mtx.T
+            self._add_shares(large_mtx, demand_share, mtx, r_0, r_n, c_0, c_n)
         except ValueError:
             share = param.backup_demand_share[time_period]
-            large_mtx[r_0:r_n, c_0:c_n] += share[0] * mtx
-            large_mtx[c_0:c_n, r_0:r_n] += share[1] * mtx.T
+            self._add_shares(large_mtx, share, mtx, r_0, r_n, c_0, c_n)
             log.warn("{} {} matrix not matching {} demand shares. Resorted to backup demand shares.".format(
                 mtx.shape, ass_class, len(demand_share[0])))
 
+    def _add_shares(self, large_mtx, share, mtx, r_0, r_n, c_0, c_n):
+        """Add matrix and its transpose, multiplied with demand shares."""
+        try:  # Sparse matrix, only stored o-d pairs are added
+            mtx.add_to(large_mtx[r_0:r_n, c_0:c_n], share[0])
+            mtx.add_to(large_mtx[c_0:c_n, r_0:r_n], share[1], transpose=True)
+        except AttributeError:  # Dense matrix
+            large_mtx[r_0:r_n, c_0:c_n] += share[0] * mtx
+            large_mtx[c_0:c_n, r_0:r_n] += share[1] * mtx.T
+
     def _add_3d_demand(self, demand, ass_class, time_period):
         """Add three-way demand."""
         mtx = demand.matrix
@@ -7,6 +7,7 @@ import utils.log as log
 import parameters.assignment as param
 import parameters.zone as zone_param
 from assignment.abstract_assignment import AssignmentModel
+from datahandling.zone_system import ZoneSystem
 from assignment.datatypes.car import Car
 from assignment.datatypes.car_specification import CarSpecification
 from assignment.datatypes.transit import TransitSpecification
@@ -61,6 +62,7 @@ class EmmeAssignmentModel(AssignmentModel):
                  save_matrices=False, first_matrix_id=100):
         self.save_matrices = save_matrices
         self.first_matrix_id = first_matrix_id
+        self._zone_system = None
         self.emme_project = emme_context
         self.time_periods = {
             "aht": 0,
@@ -298,24 +300,29 @@ class EmmeAssignmentModel(AssignmentModel):
         emme_id = self.result_mtx[time_period][assignment_result_type][subtype]["id"]
         return self.emme_project.modeller.emmebank.matrix(emme_id).get_numpy_data()
 
+    @property
+    def zone_system(self):
+        """ZoneSystem: Zone numbering, read from Emme once per run."""
+        if self._zone_system is None:
+            self._zone_system = ZoneSystem(
+                self.emme_project.modeller.emmebank.scenario(
+                    self.emme_scenarios["aht"]).zone_numbers)
+        return self._zone_system
+
     @property
     def zone_numbers(self):
         """Numpy array of all zone numbers.""" 
-        return numpy.array(self.emme_project.modeller.emmebank.scenario(
-            self.emme_scenarios["aht"]).zone_numbers)
+        return self.zone_system.zone_numbers
 
     @property
     def mapping(self):
         """dict: Dictionary of zone numbers and corresponding indices."""
-        mapping = {}
-        for idx, zone in enumerate(self.zone_numbers):
-            mapping[zone] = idx
-        return mapping
+        return self.zone_system.mapping
 
     @property
     def nr_zones(self):
         """int: Number of zones in assignment model."""
-        return len(self.zone_numbers)
+        return self.zone_system.nr_zones
 
     def _damp(self, travel_time, fw_mtx_name, time_period):
         """Reduce the impact from first waiting time on total travel time."""
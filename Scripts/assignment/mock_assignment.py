@@ -2,6 +2,7 @@ import logging
 
 import parameters.assignment as param
 from assignment.abstract_assignment import AssignmentModel
+from datahandling.zone_system import ZoneSystem
 
 
 class MockAssignmentModel(AssignmentModel):
@@ -11,6 +12,7 @@ class MockAssignmentModel(AssignmentModel):
         self.logger.info("Reading matrices from " + str(self.matrices.path))
         self.result_mtx=param.emme_result_mtx
         self.emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        self._zone_system = None
     
     def assign(self, time_period, matrices, iteration=None):
         """Assign cars, bikes and transit for one time period.
@@ -32,7 +34,7 @@ class MockAssignmentModel(AssignmentModel):
                 Assignment class (car_work/transit/...) : numpy 2-d matrix
         """
         self.time_period = time_period
-        with self.matrices.open("demand", time_period, self.zone_numbers, 'w') as mtx:
+        with self.matrices.open("demand", time_period, self.zone_system, 'w') as mtx:
             for ass_class in matrices:
                 mtx[ass_class] = matrices[ass_class]
         self.logger.info("Saved demand matrices for " + str(time_period))
@@ -63,24 +65,28 @@ class MockAssignmentModel(AssignmentModel):
                 matrices[mode] = mtx[mode]
         return matrices
     
+    @property
+    def zone_system(self):
+        """ZoneSystem: Zone numbering, read from matrix file once per run."""
+        if self._zone_system is None:
+            with self.matrices.open("time", "aht") as mtx:
+                self._zone_system = ZoneSystem(mtx.zone_numbers)
+        return self._zone_system
+
     @property
     def zone_numbers(self):
         """Numpy array of all zone numbers.""" 
-        with self.matrices.open("time", "aht") as mtx:
-            zone_numbers = mtx.zone_numbers
-        return zone_numbers
+        return self.zone_system.zone_numbers
     
     @property
     def mapping(self):
         """dict: Dictionary of zone numbers and corresponding indices."""
-        with self.matrices.open("time", "aht") as mtx:
-            mapping = mtx.mapping
-        return mapping
+        return self.zone_system.mapping
 
     @property
     def nr_zones(self):
         """int: Number of zones in assignment model."""
-        return len(self.zone_numbers)
+        return self.zone_system.nr_zones
 
     def calc_transit_cost(self, fare, peripheral_cost, default_cost=None):
         pass
@@ -5,7 +5,9 @@ import pandas
 from contextlib import contextmanager
 
 import utils.log as log
+from datahandling.zone_system import ZoneSystem
 from utils.read_csv_file import read_csv_file
+from utils.validation import ValidationReport, format_zones
 from utils.zone_interval import zone_interval
 import parameters.assignment as param
 
@@ -17,9 +19,10 @@ class MatrixData:
             os.makedirs(self.path)
     
     @contextmanager
-    def open(self, mtx_type, time_period, zone_numbers=None, m='r'):
+    def open(self, mtx_type, time_period, zone_numbers=None, m='r',
+             report=None):
         file_name = os.path.join(self.path, mtx_type+'_'+time_period+".omx")
-        mtxfile = MatrixFile(omx.open_file(file_name, m), zone_numbers)
+        mtxfile = MatrixFile(omx.open_file(file_name, m), zone_numbers, report)
         yield mtxfile
         mtxfile.close()
 
@@ -49,29 +52,40 @@ class MatrixData:
 
 
 class MatrixFile(object):
-    def __init__(self, omx_file, zone_numbers):
+    def __init__(self, omx_file, zone_numbers, report=None):
         self._file = omx_file
+        self._report = report
         self.missing_zones = []
         if zone_numbers is None:
             pass
         elif omx_file.mode == 'r':
+            zone_system = zone_numbers
+            if isinstance(zone_system, ZoneSystem):
+                zone_numbers = zone_system.zone_numbers
+            checks = self._checks()
+            nr_violations = len(checks)
             path = omx_file.filename
             mtx_numbers = self.zone_numbers
             if (numpy.diff(mtx_numbers) <= 0).any():
-                msg = "Zone numbers not in strictly ascending order in file {}".format(
-                    path)
-                log.error(msg)
-                raise IndexError(msg)
+                checks.add(
+                    path, "zone_order",
+                    "Zone numbers not in strictly ascending order in file {}".format(
+                        path),
+                    exception=IndexError)
             if mtx_numbers.size != zone_numbers.size or (mtx_numbers != zone_numbers).any():
-                for i in mtx_numbers:
-                    if i not in zone_numbers:
-                        msg = "Zone number {} from file {} not found in network".format(
-                            i, path)
-                        log.error(msg)
-                        raise IndexError(msg)
-                for i in zone_numbers:
-                    if i not in mtx_numbers:
-                        self.missing_zones.append(i)
+                if isinstance(zone_system, ZoneSystem):
+                    is_in_network = zone_system.contains(mtx_numbers)
+                else:
+                    is_in_network = numpy.in1d(mtx_numbers, zone_numbers)
+                if not is_in_network.all():
+                    unknown = mtx_numbers[~is_in_network]
+                    checks.add(
+                        path, "unknown_zone",
+                        "Zone number(s) {} from file {} not found in network".format(
+                            format_zones(unknown), path),
+                        unknown, IndexError)
+                self.missing_zones = list(zone_numbers[
+                    ~numpy.in1d(zone_numbers, mtx_numbers)])
                 log.warn("Zone number(s) {} missing from file {}{}".format(
                              self.missing_zones, path,
                              ", adding zero row(s) and column(s)"))
@@ -80,37 +94,49 @@ class MatrixFile(object):
             transport_classes = (("truck", "trailer_truck") 
                                  if "freight" in path
                                  else param.transport_classes)
-            for ass_class in transport_classes:
-                if ass_class not in ass_classes:
-                    msg = "File {} does not contain {} matrix.".format(
-                        path, ass_class)
-                    log.error(msg)
-                    raise IndexError(msg)
+            missing_classes = [ass_class for ass_class in transport_classes
+                               if ass_class not in ass_classes]
+            if missing_classes:
+                checks.add(
+                    path, "missing_matrix",
+                    "File {} does not contain {} matrix.".format(
+                        path, ", ".join(missing_classes)),
+                    exception=IndexError)
+            if self._report is None:
+                checks.raise_errors(nr_violations)
+        elif isinstance(zone_numbers, ZoneSystem):
+            self.mapping = zone_numbers.zone_numbers
         else:
             self.mapping = zone_numbers
+
+    def _checks(self):
+        """Get report where violations are collected."""
+        if self._report is None:
+            return ValidationReport()
+        return self._report
     
     def close(self):
         self._file.close()
     
     def __getitem__(self, mode):
         mtx = numpy.array(self._file[mode])
-        nr_zones = self.zone_numbers.size
+        zone_numbers = self.zone_numbers
+        nr_zones = zone_numbers.size
         dim = (nr_zones, nr_zones)
+        checks = self._checks()
+        nr_violations = len(checks)
+        source = "Matrix {} in file {}".format(mode, self._file.filename)
         if mtx.shape != dim:
-            msg = "Matrix {} in file {} has dimensions {}, should be {}".format(
-                mode, self._file.filename, mtx.shape, dim)
-            log.error(msg)
-            raise IndexError(msg)
-        if numpy.isnan(mtx).any():
-            msg = "Matrix {} in file {} contains NA values".format(
-                mode, self._file.filename)
-            log.error(msg)
-            raise ValueError(msg)
-        if (mtx < 0).any():
-            msg = "Matrix {} in file {} contains negative values".format(
-                mode, self._file.filename)
-            log.error(msg)
-            raise ValueError(msg)
+            checks.add(
+                source, "dimensions", "{} has dimensions {}, should be {}".format(
+                    source, mtx.shape, dim),
+                exception=IndexError)
+        else:
+            checks.check_matrix(source, zone_numbers, mtx)
+        if self._report is None:
+            checks.raise_errors(nr_violations)
+        elif len(checks) > nr_violations:
+            return mtx
         if self.missing_zones:
             mtx = pandas.DataFrame(mtx, self.zone_numbers, self.zone_numbers)
             mtx = mtx.reindex(
@@ -0,0 +1,118 @@
+import numpy
+
+import parameters.zone as param
+import utils.log as log
+
+
+class ZoneSystem(object):
+    """Zone numbering of model run, with derived lookups.
+
+    Built once per run and shared between zone data, matrix files,
+    assignment models and agents. Attributes must not be modified.
+
+    Parameters
+    ----------
+    zone_numbers : numpy.ndarray
+        All zone numbers of assignment model, in ascending order
+    """
+
+    def __init__(self, zone_numbers):
+        zone_numbers = numpy.array(zone_numbers)
+        if (numpy.diff(zone_numbers) <= 0).any():
+            msg = "Zone numbers not in strictly ascending order"
+            log.error(msg)
+            raise IndexError(msg)
+        self.zone_numbers = zone_numbers
+        self.nr_zones = zone_numbers.size
+        # Dense lookup array from zone number to index
+        self._lookup = numpy.full(zone_numbers[-1] + 1, -1, numpy.int32)
+        self._lookup[zone_numbers] = numpy.arange(zone_numbers.size)
+        self._lookup.flags.writeable = False
+        self._mapping = None
+        surrounding = param.areas["surrounding"]
+        peripheral = param.areas["peripheral"]
+        external = param.areas["external"]
+        self.first_surrounding_zone = self._first(surrounding[0])
+        self.first_peripheral_zone = self._first(peripheral[0])
+        self.first_extra_zone = self._first(peripheral[1] + 1)
+        self.first_external_zone = self._first(external[0])
+        self.municipality_names, self.municipality = self._codes(
+            param.municipalities)
+        self.area_names, self.area = self._codes(param.areas)
+
+    def _first(self, zone_number):
+        """Index of first zone with number at least given number."""
+        return int(numpy.searchsorted(self.zone_numbers, zone_number))
+
+    def _codes(self, intervals):
+        """Get names and integer code of interval for each zone.
+
+        Zones outside all intervals get code -1.
+        """
+        names = tuple(sorted(intervals, key=lambda name: intervals[name][0]))
+        codes = numpy.full(self.zone_numbers.size, -1, numpy.int16)
+        for code, name in enumerate(names):
+            lower, upper = intervals[name]
+            start = self._first(lower)
+            if upper is None:
+                stop = self.zone_numbers.size
+            else:
+                stop = self._first(upper + 1)
+            codes[start:stop] = code
+        codes.flags.writeable = False
+        return names, codes
+
+    def index(self, zone_numbers):
+        """Get indices of given zone numbers.
+
+        Parameters
+        ----------
+        zone_numbers : int or numpy.ndarray
+            Zone number(s) to look up
+
+        Returns
+        -------
+        int or numpy.ndarray
+            Index (indices) of zone number(s)
+
+        Raises
+        ------
+        IndexError
+            If some zone number is not in zone system
+        """
+        numbers = numpy.asarray(zone_numbers)
+        is_valid = (numbers >= 0) & (numbers < self._lookup.size)
+        idx = numpy.where(
+            is_valid, self._lookup[numpy.where(is_valid, numbers, 0)], -1)
+        if (idx < 0).any():
+            msg = "Zone number(s) {} not found in zone system".format(
+                numbers[idx < 0])
+            raise IndexError(msg)
+        if idx.ndim == 0:
+            return int(idx)
+        return idx
+
+    def contains(self, zone_numbers):
+        """Check which of given zone numbers are in zone system.
+
+        Parameters
+        ----------
+        zone_numbers : numpy.ndarray
+            Zone numbers to check
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array, True for zone numbers in zone system
+        """
+        numbers = numpy.asarray(zone_numbers)
+        is_valid = (numbers >= 0) & (numbers < self._lookup.size)
+        return is_valid & (self._lookup[numpy.where(is_valid, numbers, 0)] >= 0)
+
+    @property
+    def mapping(self):
+        """dict: Dictionary of zone numbers and corresponding indices."""
+        if self._mapping is None:
+            self._mapping = {zone: idx
+                             for idx, zone in enumerate(self.zone_numbers)}
+        return self._mapping
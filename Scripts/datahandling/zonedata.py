@@ -1,40 +1,123 @@
+import os
+import sys
+import hashlib
+import inspect
+import pickle
+import tempfile
 import numpy
 import pandas
 
 import parameters.zone as param
+import utils.read_csv_file
+import utils.validation
 from utils.read_csv_file import read_csv_file
-from utils.zone_interval import ZoneIntervals, zone_interval
+from utils.zone_interval import zone_interval
+from utils.validation import ValidationReport, MAX_SHARE
+from datahandling.zone_system import ZoneSystem
 import utils.log as log
 
 
+# Version of snapshot format, to be increased whenever it changes
+# (changes in zone data derivation and checks are detected from
+# source code of modules reading and checking the data)
+SNAPSHOT_VERSION = 4
+
+
 class ZoneData:
+    """Zone data for the model area.
+
+    Zone vectors are kept in a column store: one contiguous float
+    array per variable, over all zones of zone system. Indexing
+    returns read-only numpy views to these arrays, so data can only
+    be changed through `__setitem__` or `set_data`, which keep track
+    of data versions. As arrays are never reallocated when variables
+    are added, views stay valid and show data set later. Pandas
+    objects are only used when reading input files and writing
+    results. Compound data (zone pairs) is kept as `CompoundData`.
+
+    If snapshot directory is given, fully built zone data is saved
+    there as a binary snapshot, and loaded from it (memory-mapped)
+    in subsequent runs, instead of parsing and validating input files.
+    Snapshot is identified by a hash of the contents of input files,
+    zone numbers and zone parameters, so it is not used if any of
+    them has changed.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory where zone data files are found
+    zone_numbers : ZoneSystem or numpy.ndarray
+        Zone system of model run (or all zone numbers,
+        from which a new zone system is created)
+    snapshot_dir : str (optional)
+        Directory where zone data snapshots are stored
+    report : utils.validation.ValidationReport (optional)
+        Report where violations in input files are collected.
+        If not given, exception is raised after reading all files,
+        if any violations were found.
+    """
+
     CAPITAL_REGION = 0
     SURROUNDING_AREA = 1
     
-    def __init__(self, data_dir, zone_numbers):
-        self._values = {}
+    def __init__(self, data_dir, zone_numbers, snapshot_dir=None,
+                 report=None):
         self.share = ShareChecker(self)
-        zone_numbers = numpy.array(zone_numbers)
-        surrounding = param.areas["surrounding"]
-        peripheral = param.areas["peripheral"]
-        external = param.areas["external"]
-        first_extra = numpy.where(zone_numbers > peripheral[1])[0][0]
-        idx = zone_numbers[:first_extra]
+        if isinstance(zone_numbers, ZoneSystem):
+            self.zone_system = zone_numbers
+        else:
+            self.zone_system = ZoneSystem(zone_numbers)
+        if snapshot_dir is not None:
+            path = os.path.join(
+                snapshot_dir, self._snapshot_name(data_dir))
+            if self._load_snapshot(path):
+                return
+        self._versions = {}
+        # Key : (array over all zones of zone system, slice of zones)
+        self._columns = {}
+        self._compounds = {}
+        # Key : Whether data was checked as share
+        self._checked = {}
+        # Checks during reading collect violations in the report,
+        # outside reading they raise immediately
+        if report is None:
+            self._report = ValidationReport()
+        else:
+            self._report = report
+        nr_violations = len(self._report)
+        self._read(data_dir)
+        checks, self._report = self._report, None
+        if report is None:
+            checks.raise_errors(nr_violations)
+        if snapshot_dir is not None and len(checks) == nr_violations:
+            self._save_snapshot(path)
+
+    def _read(self, data_dir):
+        """Read input files and derive variables."""
+        zone_numbers = self.zone_system.zone_numbers
+        idx = zone_numbers[:self.zone_system.first_extra_zone]
         self.zone_numbers = idx
-        first_surrounding = numpy.where(idx >= surrounding[0])[0][0]
+        self.nr_zones = len(self.zone_numbers)
+        first_surrounding = self.zone_system.first_surrounding_zone
         self.first_surrounding_zone = first_surrounding
-        first_peripheral = numpy.where(idx >= peripheral[0])[0][0]
+        first_peripheral = self.zone_system.first_peripheral_zone
         self.first_peripheral_zone = first_peripheral
-        first_external = numpy.where(zone_numbers >= external[0])[0][0]
+        first_external = self.zone_system.first_external_zone
         self.first_external_zone = first_external
         external_zones = zone_numbers[first_external:]
-        popdata = read_csv_file(data_dir, ".pop", self.zone_numbers, float)
-        workdata = read_csv_file(data_dir, ".wrk", self.zone_numbers, float)
-        schooldata = read_csv_file(data_dir, ".edu", self.zone_numbers, float)
-        landdata = read_csv_file(data_dir, ".lnd", self.zone_numbers, float)
-        parkdata = read_csv_file(data_dir, ".prk", self.zone_numbers, float)
-        self.externalgrowth = read_csv_file(data_dir, ".ext", external_zones, float)
-        transit = read_csv_file(data_dir, ".tco")
+        popdata = read_csv_file(
+            data_dir, ".pop", self.zone_numbers, float, report=self._report)
+        workdata = read_csv_file(
+            data_dir, ".wrk", self.zone_numbers, float, report=self._report)
+        schooldata = read_csv_file(
+            data_dir, ".edu", self.zone_numbers, float, report=self._report)
+        landdata = read_csv_file(
+            data_dir, ".lnd", self.zone_numbers, float, report=self._report)
+        parkdata = read_csv_file(
+            data_dir, ".prk", self.zone_numbers, float, report=self._report)
+        self.externalgrowth = read_csv_file(
+            data_dir, ".ext", external_zones, float, report=self._report)
+        transit = read_csv_file(data_dir, ".tco", report=self._report)
         try:
             transit["fare"] = transit["fare"].astype(dtype=float, errors='raise')
         except ValueError:
@@ -50,14 +133,18 @@ class ZoneData:
         transit_zone["dist_fare"] = transit_zone["fare"].pop("dist")
         transit_zone["start_fare"] = transit_zone["fare"].pop("start")
         self.transit_zone = transit_zone
+        # Parking norms are given for a subset of zones
         try:
-            cardata = read_csv_file(data_dir, ".car")
-            self["parking_norm"] = cardata["prknorm"]
+            cardata = read_csv_file(data_dir, ".car", report=self._report)
+            self.parking_norm = cardata["prknorm"]
+            self._check("parking_norm", self.parking_norm)
         except (NameError, KeyError):
-            self._values["parking_norm"] = None
-        car_cost = read_csv_file(data_dir, ".cco", squeeze=False)
+            self.parking_norm = None
+        car_cost = read_csv_file(
+            data_dir, ".cco", squeeze=False, report=self._report)
         self.car_dist_cost = car_cost["dist_cost"][0]
-        truckdata = read_csv_file(data_dir, ".trk", squeeze=True)
+        truckdata = read_csv_file(
+            data_dir, ".trk", squeeze=True, report=self._report)
         self.trailers_prohibited = list(map(int, truckdata.loc[0, :]))
         self.garbage_destination = list(map(int, truckdata.loc[1, :].dropna()))
         pop = popdata["total"]
@@ -74,9 +161,8 @@ class ZoneData:
                                         + self["share_age_65-99"])
         self.share["share_age_18-99"] = (self["share_age_7-99"]
                                          -self["share_age_7-17"])
-        self.share["share_female"] = pandas.Series(0.5, zone_numbers)
-        self.share["share_male"] = pandas.Series(0.5, zone_numbers)
-        self.nr_zones = len(self.zone_numbers)
+        self.share["share_female"] = numpy.full(self.nr_zones, 0.5)
+        self.share["share_male"] = numpy.full(self.nr_zones, 0.5)
         self["population_density"] = pop / landdata["builtar"]
         wp = workdata["total"]
         self["workplaces"] = wp
@@ -93,92 +179,273 @@ class ZoneData:
         self["tertiary_education"] = schooldata["tertiary"]
         self["zone_area"] = landdata["builtar"]
         self.share["share_detached_houses"] = landdata["detach"]
-        self["helsinki"] = pandas.Series(0, self.zone_numbers)
-        self["helsinki"].loc[zone_interval("municipalities", "Helsinki")] = 1
+        self["helsinki"] = self._dummy(
+            self.zone_system.municipality_names,
+            self.zone_system.municipality, "Helsinki")
         self["cbd"] = self._area_dummy("helsinki_cbd")
         self["helsinki_other"] = self._area_dummy("helsinki_other")
         self["espoo_vant_kau"] = self._area_dummy("espoo_vant_kau")
         self["surrounding"] = self._area_dummy("surrounding")
         self["shops_cbd"] = self["cbd"] * self["shops"]
         self["shops_elsewhere"] = (1-self["cbd"]) * self["shops"]
-        # Create diagonal matrix with zone area
-        di = numpy.diag_indices(self.nr_zones)
-        self["own_zone"] = numpy.zeros((self.nr_zones, self.nr_zones))
-        self["own_zone"][di] = 1
-        self["own_zone_area"] = self["own_zone"] * self["zone_area"].values
-        self["own_zone_area_sqrt"] = numpy.sqrt(self["own_zone_area"])
-        # Create matrix where value is 1 if origin and destination is in
-        # same municipality
-        home_municipality = pandas.DataFrame(0, idx, idx)
-        intervals = ZoneIntervals("municipalities")
-        for i in intervals:
-            home_municipality.loc[intervals[i], intervals[i]] = 1
-        self["population_own"] = home_municipality.values * pop.values
-        self["population_other"] = (1-home_municipality.values) * pop.values
-        self["workplaces_own"] = home_municipality.values * wp.values
-        self["workplaces_other"] = (1-home_municipality.values) * wp.values
-        self["service_own"] = home_municipality.values * serv.values
-        self["service_other"] = (1-home_municipality.values) * serv.values
-        self["shops_own"] = home_municipality.values * shop.values
-        self["shops_other"] = (1-home_municipality.values) * shop.values
+        # Compound data (purpose zones -> all zones) is stored compactly,
+        # as zone vectors applied to own zone/municipality or others
+        zone = numpy.arange(self.nr_zones)
+        ones = numpy.ones(self.nr_zones)
+        area = self["zone_area"]
+        self._set_compound("own_zone", CompoundData("zone", zone, ones))
+        self._set_compound(
+            "own_zone_area", CompoundData("zone", zone, area))
+        self._set_compound(
+            "own_zone_area_sqrt", CompoundData("zone", zone, numpy.sqrt(area)))
+        # Value is zone vector if origin and destination is in
+        # same municipality (or in different municipalities)
+        municipality = self.zone_system.municipality[:self.nr_zones]
+        for key in ("population", "workplaces", "service", "shops"):
+            self._set_compound(key + "_own", CompoundData(
+                "municipality", municipality, self[key]))
+            self._set_compound(key + "_other", CompoundData(
+                "municipality", municipality, other=self[key]))
+
+    def _snapshot_name(self, data_dir):
+        """Get file name of snapshot for input files in directory."""
+        key = hashlib.sha1()
+        key.update(str(SNAPSHOT_VERSION).encode())
+        key.update(self.__class__.__name__.encode())
+        key.update(numpy.ascontiguousarray(
+            self.zone_system.zone_numbers, numpy.int64).tobytes())
+        for intervals in (param.areas, param.municipalities):
+            key.update(repr(sorted(intervals.items())).encode())
+        for module in (sys.modules[__name__], utils.read_csv_file,
+                       utils.validation):
+            source = inspect.getsource(module)
+            if not isinstance(source, bytes):
+                source = source.encode("utf-8")
+            key.update(source)
+        for file_name in sorted(os.listdir(data_dir)):
+            path = os.path.join(data_dir, file_name)
+            if os.path.isfile(path):
+                key.update(repr(file_name).encode())
+                with open(path, "rb") as f:
+                    key.update(f.read())
+        return "{}_{}".format(self.__class__.__name__, key.hexdigest())
+
+    def _save_snapshot(self, path):
+        """Save zone data snapshot (.npy array and .pkl attributes).
+
+        Files are written to unique temporary files and renamed, so
+        that runs sharing the snapshot directory never see (or
+        overwrite) partly written files. Array is renamed first,
+        attributes file marks the snapshot complete.
+        """
+        if (os.path.isfile(path + ".pkl")
+                and os.path.isfile(path + ".npy")):
+            # Saved by another run with same input files
+            return
+        state = {k: v for k, v in self.__dict__.items()
+                 if k not in ("_columns", "zone_system", "share")}
+        # Variables are saved as rows of one array
+        keys = sorted(self._columns)
+        state["_rows"] = {key: (row, self._columns[key][1])
+                          for row, key in enumerate(keys)}
+        store = numpy.array([self._columns[key][0] for key in keys])
+        tmp_paths = []
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Directory may have been created by another run
+                    if not os.path.isdir(directory):
+                        raise
+            for ext in (".npy", ".pkl"):
+                fd, tmp_path = tempfile.mkstemp(
+                    ext + ".tmp", os.path.basename(path), directory)
+                tmp_paths.append(tmp_path)
+                with os.fdopen(fd, "wb") as f:
+                    if ext == ".npy":
+                        numpy.save(f, store)
+                    else:
+                        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            for tmp_path, ext in zip(tmp_paths, (".npy", ".pkl")):
+                _replace(tmp_path, path + ext)
+            log.info("Zone data snapshot saved to {}".format(path))
+        except (IOError, OSError) as error:
+            log.warn("Could not save zone data snapshot: {}".format(error))
+        finally:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _load_snapshot(self, path):
+        """Load zone data snapshot, return False if not found or invalid."""
+        if not os.path.isfile(path + ".pkl"):
+            return False
+        try:
+            with open(path + ".pkl", "rb") as f:
+                state = pickle.load(f)
+            # Copy-on-write memory map, so that model results
+            # can be set without changing the file
+            store = numpy.load(path + ".npy", mmap_mode="c")
+        except Exception as error:
+            log.warn("Could not load zone data snapshot {}: {}".format(
+                path, error))
+            return False
+        rows = state.pop("_rows")
+        self.__dict__.update(state)
+        self._columns = {key: (store[row], zones)
+                         for key, (row, zones) in rows.items()}
+        if not self._is_valid():
+            log.warn("Zone data snapshot {} has invalid values, ".format(path)
+                     + "reading input files instead")
+            # Memory map is closed, so that files can be removed
+            # and snapshot is saved again
+            self._columns = {}
+            store = None
+            for ext in (".pkl", ".npy"):
+                try:
+                    os.remove(path + ext)
+                except OSError:
+                    pass
+            return False
+        log.info("Zone data loaded from snapshot {}".format(path))
+        return True
+
+    def _is_valid(self):
+        """Check that all checked data is still finite and non-negative."""
+        for key, is_share in self._checked.items():
+            data = self[key]
+            with numpy.errstate(invalid="ignore"):
+                if not (numpy.isfinite(data).all() and (data >= 0).all()):
+                    return False
+                if is_share and (data > MAX_SHARE).any():
+                    return False
+        return True
+
+    def _set_compound(self, key, data):
+        self._compounds[key] = data
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _dummy(self, names, codes, name):
+        return (codes[:self.nr_zones] == names.index(name)).astype(float)
 
     def _area_dummy(self, name):
-        dummy = pandas.Series(0, self.zone_numbers)
-        dummy.loc[zone_interval("areas", name)] = 1
-        return dummy
+        return self._dummy(
+            self.zone_system.area_names, self.zone_system.area, name)
 
     def __getitem__(self, key):
-        return self._values[key]
+        try:
+            column, zones = self._columns[key]
+        except KeyError:
+            return self._compounds[key]
+        data = column[zones]
+        data.flags.writeable = False
+        return data
 
     def __setitem__(self, key, data):
+        self._check(key, data)
+        self.set_data(key, data)
+
+    def _check(self, key, data, is_share=False):
+        """Check that data is finite and non-negative (and share)."""
+        if self._report is None:
+            checks = ValidationReport()
+        else:
+            checks = self._report
         try:
-            if not numpy.isfinite(data).all():
-                for (i, val) in data.iteritems():
-                    if not numpy.isfinite(val):
-                        msg = "{} for zone {} is not a finite number".format(
-                            key, i).capitalize()
-                        log.error(msg)
-                        raise ValueError(msg)
-        except TypeError:
-            for (i, val) in data.iteritems():
-                try:
-                    float(val)
-                except ValueError:
-                    msg = "{} for zone {} is not a number".format(
-                        key, i).capitalize()
-                    log.error(msg)
-                    raise TypeError(msg)
-            msg = "{} could not be read".format(key).capitalize()
+            zone_numbers = data.index.values
+        except AttributeError:
+            zone_numbers = self.zone_system.zone_numbers[:len(data)]
+        nr_violations = len(checks)
+        checks.check_values(key, zone_numbers, data, is_share)
+        self._checked[key] = is_share
+        if self._report is None:
+            checks.raise_errors(nr_violations)
+
+    def set_data(self, key, data):
+        """Set zone vector without validation.
+
+        Used for model results (e.g., logsums), which may have
+        non-finite values. Data is copied into the column store.
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "car_density")
+        data : pandas.Series or numpy.ndarray
+            Zone vector, for a consecutive subset of zones in zone system
+            (starting from first zone, if not a Series)
+        """
+        try:
+            start = self.zone_system.index(data.index[0])
+        except (AttributeError, IndexError):
+            start = 0
+        zones = slice(start, start + len(data))
+        if zones.stop > self.zone_system.nr_zones:
+            msg = "{} has more values than zones".format(key).capitalize()
             log.error(msg)
-            raise TypeError(msg)
-        if (data < 0).any():
-            for (i, val) in data.iteritems():
-                if val < 0:
-                    msg = "{} ({}) for zone {} is negative".format(
-                        key, val, i).capitalize()
-                    log.error(msg)
-                    raise ValueError(msg)
-        self._values[key] = data
+            raise IndexError(msg)
+        if key in self._columns and self._columns[key][1] == zones:
+            # Data is replaced in place, so earlier views show it
+            column = self._columns[key][0]
+        else:
+            column = numpy.zeros(self.zone_system.nr_zones)
+        column[zones] = data
+        self._columns[key] = (column, zones)
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get_version(self, key):
+        """Get number of times data has been set for given key.
+
+        Used for invalidating cached values derived from zone data.
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "car_density")
+
+        Returns
+        -------
+        int
+            Version number of data
+        """
+        return self._versions.get(key, 0)
 
     def zone_index(self, zone_number):
-        """Get index of given zone number.
+        """Get index of given zone number(s).
 
         Parameters
         ----------
-        zone_number : int
-            The zone number to look up
+        zone_number : int or numpy.ndarray
+            The zone number(s) to look up
         
         Returns
         -------
-        int
-            Index of zone number
+        int or numpy.ndarray
+            Index of zone number(s)
         """
-        match = numpy.where(self.zone_numbers == zone_number)
-        if len(match) == 1 and len(match[0]) == 1:
-            return match[0][0]
-        else:
-            msg = "Found several matching zone numbers {}".format(zone_number)
+        idx = self.zone_system.index(zone_number)
+        if numpy.any(idx >= self.nr_zones):
+            msg = "Zone number(s) {} outside model area".format(zone_number)
             raise IndexError(msg)
+        return idx
+
+    def get_series(self, key):
+        """Get zone vector as pandas Series, for writing results.
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "population")
+
+        Returns
+        -------
+        pandas.Series
+            Zone vector with zone numbers as index
+        """
+        zones = self._columns[key][1]
+        return pandas.Series(self[key], self.zone_system.zone_numbers[zones])
 
     def get_freight_data(self):
         """Get zone data for freight traffic calculation.
@@ -195,8 +462,8 @@ class ZoneData:
             "logistics",
             "industry",
         )
-        data = {k: self._values[k] for k in freight_variables}
-        return pandas.DataFrame(data)
+        data = {k: self[k] for k in freight_variables}
+        return pandas.DataFrame(data, self.zone_numbers)
 
     def get_data(self, key, bounds, generation=False, part=None):
         """Get data of correct shape for zones included in purpose.
@@ -215,7 +482,7 @@ class ZoneData:
         
         Returns
         -------
-        pandas Series or numpy 2-d matrix
+        numpy.ndarray or CompoundData
         """
         l = bounds.start
         u = bounds.stop
@@ -224,19 +491,148 @@ class ZoneData:
                 u = self.first_surrounding_zone
             else:
                 l = self.first_surrounding_zone
-        if self._values[key].ndim == 1: # If not a compound (i.e., matrix)
+        data = self[key]
+        if data.ndim == 1: # If not a compound (i.e., matrix)
             if generation:  # Return values for purpose zones
-                return self._values[key][l:u].values
+                return data[l:u]
             else:  # Return values for all zones
-                return self._values[key].values
+                return data
         else:  # Return matrix (purpose zones -> all zones)
-            return self._values[key][l:u, :]
+            return data.take_rows(slice(l, u))
+
+
+class CompoundData:
+    """Zone pair data, stored as zone vectors instead of a full matrix.
+
+    Zones are divided into groups (e.g., each zone in its own group,
+    or municipalities). Element (i, j) is `own[j]` if origin i and
+    destination j are in same group, and `other[j]` otherwise.
+    Zones with negative group code do not belong to any group.
+
+    Blocks of the matrix are evaluated by broadcasting when indexed,
+    so the full matrix is never created.
+
+    Parameters
+    ----------
+    division : str
+        Name of zone division (zone/municipality), compound data with
+        same division name must have same group codes
+    groups : numpy.ndarray
+        Group code of each destination zone
+    own : numpy.ndarray (optional)
+        Values for destination zones in same group as origin
+    other : numpy.ndarray (optional)
+        Values for destination zones in other groups than origin
+    row_groups : numpy.ndarray (optional)
+        Group code of each origin zone (default is same as `groups`)
+    """
+
+    ndim = 2
+
+    # Number of matrix elements evaluated at a time in `add_to`
+    BLOCK_SIZE = 2**16
+
+    def __init__(self, division, groups, own=None, other=None,
+                 row_groups=None):
+        self.division = division
+        self.groups = groups
+        if own is None:
+            own = numpy.zeros(groups.size)
+        if other is None:
+            other = numpy.zeros(groups.size)
+        self.own = own
+        self.other = other
+        if row_groups is None:
+            row_groups = groups
+        self.row_groups = row_groups
+
+    @property
+    def shape(self):
+        return (self.row_groups.size, self.groups.size)
+
+    def take_rows(self, rows):
+        """Get compound data for subset of origins.
+
+        Parameters
+        ----------
+        rows : slice or numpy.ndarray
+            Origin indices
+
+        Returns
+        -------
+        CompoundData
+        """
+        return CompoundData(
+            self.division, self.groups, self.own, self.other,
+            self.row_groups[rows])
+
+    def is_own(self, rows, cols=None):
+        """Check if origins and destinations are in same group.
+
+        Parameters
+        ----------
+        rows : int or slice or numpy.ndarray
+            Origin indices
+        cols : numpy.ndarray (optional)
+            Destination indices, one for each origin index
+            (default is all destinations for each origin)
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array (rows x destinations, or same shape as cols)
+        """
+        row_groups = self.row_groups[rows]
+        if cols is None:
+            row_groups = numpy.asarray(row_groups)[..., numpy.newaxis]
+            col_groups = self.groups
+        else:
+            col_groups = self.groups[cols]
+        return (row_groups == col_groups) & (row_groups >= 0)
+
+    def __getitem__(self, key):
+        # Origin and destination of each element are found by indexing
+        # broadcast (zero-stride) index arrays with the key
+        rows = numpy.broadcast_to(
+            numpy.arange(self.shape[0])[:, numpy.newaxis], self.shape)[key]
+        cols = numpy.broadcast_to(
+            numpy.arange(self.shape[1]), self.shape)[key]
+        return numpy.where(
+            self.is_own(rows, cols), self.own[cols], self.other[cols])
+
+    def add_to(self, out, coef=1):
+        """Add compound data, multiplied by coefficient, to matrix.
+
+        Parameters
+        ----------
+        out : numpy.ndarray
+            Matrix of same shape, modified in place
+        coef : float or numpy.ndarray (optional)
+            Coefficient (or column vector of coefficients for each row)
+
+        Raises
+        ------
+        ValueError
+            If matrix shape differs from data shape
+        """
+        if out.shape != self.shape:
+            raise ValueError("Shape {} of compound data does not match {}".format(
+                self.shape, out.shape))
+        step = max(self.BLOCK_SIZE // max(self.shape[1], 1), 1)
+        for start in range(0, self.shape[0], step):
+            block = slice(start, min(start + step, self.shape[0]))
+            if numpy.ndim(coef) == 2:
+                out[block] += coef[block] * self[block]
+            else:
+                out[block] += coef * self[block]
+        return out
 
 
 class BaseZoneData(ZoneData):
-    def __init__(self, data_dir, zone_numbers):
-        ZoneData.__init__(self, data_dir, zone_numbers)
-        cardata = read_csv_file(data_dir, ".car", self.zone_numbers)
+    def _read(self, data_dir):
+        ZoneData._read(self, data_dir)
+        cardata = read_csv_file(
+            data_dir, ".car", self.zone_numbers, report=self._report)
         self["car_density"] = cardata["cardens"]
         self["cars_per_1000"] = 1000 * self["car_density"]
 
@@ -246,11 +642,19 @@ class ShareChecker:
         self.data = data
 
     def __setitem__(self, key, data):
-        if (data > 1.005).any():
-            for (i, val) in data.iteritems():
-                if val > 1.005:
-                    msg = "{} ({}) for zone {} is larger than one".format(
-                        key, val, i).capitalize()
-                    log.error(msg)
-                    raise ValueError(msg)
-        self.data[key] = data
+        self.data._check(key, data, is_share=True)
+        self.data.set_data(key, data)
+
+
+def _replace(tmp_path, path):
+    """Rename temporary file to path, unless path exists already.
+
+    On Windows, rename fails if file exists (or is memory-mapped by
+    another run). Snapshot names depend on contents, so existing
+    file is then kept as it is.
+    """
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isfile(path):
+            raise
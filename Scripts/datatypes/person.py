@@ -4,8 +4,10 @@ import random
 from datatypes.tour import Tour
 
 
-class Person:
+class Person(object):
     """Container for person attributes.
+
+    Attributes are stored in slots (no instance dictionary).
     
     Parameters
     ----------
@@ -18,20 +20,34 @@ class Person:
         Model used to create tours
     car_use_model : models.logit.CarUseModel
         Model used to decide if car user
+    zone_index : int (optional)
+        Index of zone where person resides
+
+    Probability tables in `generation_model` and `car_use_model`
+    must have been precomputed before.
     """
 
     FEMALE = 0
     MALE = 1
+    # Number of residents represented by person
+    weight = 1
+
+    __slots__ = ("zone", "zone_index", "age", "age_group", "sex", "tours",
+                 "generation_model", "is_car_user")
     
-    def __init__(self, zone, age_group, generation_model, car_use_model):
+    def __init__(self, zone, age_group, generation_model, car_use_model,
+                 zone_index=None):
         self.zone = zone
+        if zone_index is None:
+            zone_index = car_use_model.zone_data.zone_index(zone)
+        self.zone_index = zone_index
         self.age = random.randint(age_group[0], age_group[1])
         self.age_group = "age_" + str(age_group[0]) + "-" + str(age_group[1])
         self.sex = random.random() < 0.5
         self.tours = []
         self.generation_model = generation_model
-        car_use_prob = car_use_model.calc_individual_prob(
-            self.age_group, self.gender, zone)
+        car_use_prob = car_use_model.get_table_prob(
+            self.age_group, self.gender, zone_index)
         self.is_car_user = random.random() < car_use_prob
     
     @property
@@ -48,7 +64,7 @@ class Person:
         else:
             return "male"
 
-    def add_tours(self, purposes):
+    def add_tours(self, purposes, random_state=numpy.random):
         """Initilize tour list and add new tours.
 
         Parameters
@@ -58,21 +74,31 @@ class Person:
                 Tour purpose name (hw/ho/...)
             value : datatypes.purpose.TourPurpose
                 The tour purpose object
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
         """
         self.tours = []
-        prob = self.generation_model.calc_prob(
-            self.age_group, self.is_car_user, self.zone)
-        tour_combination = numpy.random.choice(a=list(prob.keys()), p=list(prob.values()))
+        tour_combination = self.generation_model.combinations[
+            self._choose_tour_combination(random_state)]
         for key in tour_combination:
-            tour = Tour(purposes[key], self.zone)
+            tour = Tour(
+                purposes[key], self.zone, self.weight, self.zone_index)
             self.tours.append(tour)
             if key == "hw":
                 non_home_prob = purposes["wo"].gen_model.param[key]
-                if random.random() < non_home_prob:
-                    non_home_tour = Tour(purposes["wo"], tour)
+                if random_state.random_sample() < non_home_prob:
+                    non_home_tour = Tour(
+                        purposes["wo"], tour, self.weight)
                     self.tours.append(non_home_tour)
             else:
                 non_home_prob = purposes["oo"].gen_model.param[key]
-                if random.random() < non_home_prob:
-                    non_home_tour = Tour(purposes["oo"], tour)
+                if random_state.random_sample() < non_home_prob:
+                    non_home_tour = Tour(
+                        purposes["oo"], tour, self.weight)
                     self.tours.append(non_home_tour)
+
+    def _choose_tour_combination(self, random_state=numpy.random):
+        """Draw index of tour combination from precomputed probabilities."""
+        prob = self.generation_model.get_table_prob(
+            self.age_group, self.is_car_user, self.zone_index)
+        return random_state.choice(len(prob), p=prob)
@@ -0,0 +1,179 @@
+import numpy
+
+from datatypes.person import Person
+
+
+class Population:
+    """Synthetic population for agent-based simulation.
+
+    Person attributes are stored column-wise, one numpy array per
+    attribute, and they are drawn for all persons at once.
+    Persons are in order of home zone.
+
+    Parameters
+    ----------
+    zone_data : ZoneData
+        Data used for all demand calculations
+    age_groups : tuple
+        tuple
+            int
+                Age intervals
+    generation_model : models.logit.TourCombinationModel
+        Model used to create tours
+    car_use_model : models.logit.CarUseModel
+        Model used to decide if car user,
+        with probability table already calculated
+    keep_tour_combinations : bool (optional)
+        Whether the tour combination drawn for a person is kept
+        when tours are added again in later iterations
+    sampling_rate : float (optional)
+        Share of residents included as agents (0 < rate <= 1),
+        each agent represents 1/rate residents
+    random_state : numpy.random.RandomState (optional)
+        Random number generator (default is the global one)
+    """
+
+    def __init__(self, zone_data, age_groups, generation_model, car_use_model,
+                 keep_tour_combinations=False, sampling_rate=1,
+                 random_state=numpy.random):
+        if not 0 < sampling_rate <= 1:
+            raise ValueError(
+                "Sampling rate {} not in range (0, 1]".format(sampling_rate))
+        self.sampling_rate = sampling_rate
+        self.generation_model = generation_model
+        self.car_use_model = car_use_model
+        self.keep_tour_combinations = keep_tour_combinations
+        self.age_groups = age_groups
+        self.age_group_names = ["age_{}-{}".format(*age_group)
+                                for age_group in age_groups]
+        nr_zones = zone_data.first_peripheral_zone
+        self.zone_numbers = zone_data.zone_numbers[:nr_zones]
+        # Number of persons in each zone and age group,
+        # first column is under-7-year-olds, who are not included
+        counts = numpy.empty((nr_zones, len(age_groups) + 1), int)
+        shares = [zone_data["share_" + age] for age in self.age_group_names]
+        population = zone_data["population"]
+        for i in range(nr_zones):
+            weights = [1]
+            for share in shares:
+                weights.append(share[i])
+                weights[0] -= share[i]
+            counts[i, :] = random_state.multinomial(
+                int(population[i]), weights)
+        counts = counts[:, 1:]
+        if sampling_rate < 1:
+            # Each resident is included independently with sampling rate
+            counts = random_state.binomial(counts, sampling_rate)
+        segment = numpy.repeat(numpy.arange(counts.size), counts.ravel())
+        self.zone_index = (segment // len(age_groups)).astype(numpy.int32)
+        self.age_group = (segment % len(age_groups)).astype(numpy.int8)
+        nr_persons = segment.size
+        # Expansion weight (number of residents represented by agent)
+        self.weight = numpy.full(nr_persons, 1.0 / sampling_rate)
+        lower = numpy.array([age_group[0] for age_group in age_groups])
+        upper = numpy.array([age_group[1] for age_group in age_groups])
+        width = (upper - lower + 1)[self.age_group]
+        self.age = (lower[self.age_group]
+                    + numpy.floor(random_state.random_sample(nr_persons)
+                                  * width)).astype(numpy.int16)
+        self.sex = random_state.random_sample(nr_persons) < 0.5
+        # Random numbers for car use are stored, so that car users can be
+        # updated with new probabilities without drawing them again
+        self._car_use_draw = random_state.random_sample(nr_persons)
+        self.update_car_users()
+        # Index of chosen tour combination, -1 if not chosen yet
+        self.tour_combination = numpy.full(nr_persons, -1, numpy.int16)
+
+    def update_car_users(self):
+        """Update car users with current car use probability table.
+
+        Persons keep their random draws, so only persons whose
+        probability has passed their draw change status.
+        """
+        car_use_prob = numpy.empty(
+            (self.zone_numbers.size, len(self.age_groups), 2))
+        genders = {Person.FEMALE: "female", Person.MALE: "male"}
+        for i, age in enumerate(self.age_group_names):
+            for sex, gender in genders.items():
+                car_use_prob[:, i, sex] = self.car_use_model.prob_table[
+                    (age, gender)]
+        self.is_car_user = (self._car_use_draw
+                            < car_use_prob[self.zone_index, self.age_group,
+                                           self.sex.astype(numpy.int8)])
+
+    def __len__(self):
+        return self.zone_index.size
+
+    def __getitem__(self, index):
+        return PersonView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield PersonView(self, index)
+
+    @property
+    def zone(self):
+        """numpy.ndarray: Home zone number of each person."""
+        return self.zone_numbers[self.zone_index]
+
+
+class PersonView(Person):
+    """Person in columnar population.
+
+    Compatibility view for code handling one person at a time.
+    Attributes are read from population columns, only tours are
+    stored in the view.
+
+    Parameters
+    ----------
+    population : Population
+        Population where the person belongs
+    index : int
+        Index of person in population
+    """
+
+    __slots__ = ("population", "index")
+
+    def __init__(self, population, index):
+        self.population = population
+        self.index = index
+        self.tours = []
+        self.generation_model = population.generation_model
+
+    @property
+    def zone_index(self):
+        return self.population.zone_index[self.index]
+
+    @property
+    def zone(self):
+        return self.population.zone_numbers[self.zone_index]
+
+    @property
+    def age(self):
+        return self.population.age[self.index]
+
+    @property
+    def age_group(self):
+        group = self.population.age_group[self.index]
+        return self.population.age_group_names[group]
+
+    @property
+    def sex(self):
+        return self.population.sex[self.index]
+
+    @property
+    def is_car_user(self):
+        return self.population.is_car_user[self.index]
+
+    @property
+    def weight(self):
+        return self.population.weight[self.index]
+
+    def _choose_tour_combination(self, random_state=numpy.random):
+        if not self.population.keep_tour_combinations:
+            return Person._choose_tour_combination(self, random_state)
+        combinations = self.population.tour_combination
+        if combinations[self.index] < 0:
+            combinations[self.index] = Person._choose_tour_combination(
+                self, random_state)
+        return combinations[self.index]
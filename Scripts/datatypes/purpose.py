@@ -1,10 +1,15 @@
 import numpy
 import pandas
 
-from parameters.destination_choice import secondary_destination_threshold
+from collections import OrderedDict
+from parameters.destination_choice import (
+    secondary_destination_threshold, secondary_destination_block_memory,
+    secondary_destination_sampler_cache_size)
 import models.logit as logit
 import models.generation as generation
 from datatypes.demand import Demand
+from datatypes.sparse import SparseMatrix
+from utils.alias_table import AliasTable
 from utils.zone_interval import zone_interval
 
 
@@ -76,9 +81,12 @@ class TourPurpose(Purpose):
         Writer object for result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of probability and demand matrices
     """
 
-    def __init__(self, specification, zone_data, resultdata, is_agent_model):
+    def __init__(self, specification, zone_data, resultdata, is_agent_model,
+                 dtype=numpy.float64):
         Purpose.__init__(self, specification, zone_data)
         self.resultdata = resultdata
         if self.orig == "source":
@@ -87,20 +95,23 @@ class TourPurpose(Purpose):
             self.gen_model = generation.GenerationModel(self, resultdata)
         if self.name == "sop":
             self.model = logit.OriginModel(
-                zone_data, self, resultdata, is_agent_model)
+                zone_data, self, resultdata, is_agent_model, dtype)
         elif self.name == "so":
             self.model = logit.DestModeModel(
-                zone_data, self, resultdata, is_agent_model)
+                zone_data, self, resultdata, is_agent_model, dtype)
         else:
             self.model = logit.ModeDestModel(
-                zone_data, self, resultdata, is_agent_model)
+                zone_data, self, resultdata, is_agent_model, dtype)
         self.modes = self.model.mode_choice_param.keys()
         self.sec_dest_purpose = None
 
     def init_sums(self):
         for mode in self.modes:
-            self.generated_tours[mode] = numpy.zeros_like(self.zone_numbers)
-            self.attracted_tours[mode] = numpy.zeros_like(self.zone_data.zone_numbers)
+            # Float counts, as sampled agents have expansion weights
+            self.generated_tours[mode] = numpy.zeros_like(
+                self.zone_numbers, float)
+            self.attracted_tours[mode] = numpy.zeros_like(
+                self.zone_data.zone_numbers, float)
 
     def calc_prob(self, impedance):
         """Calculate mode and destination probabilities.
@@ -128,7 +139,11 @@ class TourPurpose(Purpose):
         demsums = {}
         attracted_tours = 0
         for mode in self.model.mode_choice_param:
-            mtx = (self.prob.pop(mode) * tours).T
+            prob = self.prob.pop(mode)
+            if isinstance(prob, SparseMatrix):
+                mtx = prob.multiply(tours)
+            else:
+                mtx = numpy.multiply(prob, tours, dtype=prob.dtype).T
             try:
                 self.sec_dest_purpose.gen_model.add_tours(mtx, mode, self)
             except AttributeError:
@@ -148,8 +163,15 @@ class TourPurpose(Purpose):
             self.resultdata.print_matrix(
                 aggregated_demand, "aggregated_demand",
                 "{}_{}".format(self.name, mode))
-            own_zone = self.zone_data.get_data("own_zone", self.bounds)
-            own_zone_demand = own_zone * mtx
+            if isinstance(mtx, SparseMatrix):
+                own_zone_demand = mtx.like(numpy.where(
+                    mtx.indices == mtx.rows + self.bounds.start,
+                    mtx.data, 0))
+            else:
+                own_zone_demand = numpy.zeros_like(mtx)
+                rows = numpy.arange(mtx.shape[0])
+                cols = rows + self.bounds.start
+                own_zone_demand[rows, cols] = mtx[rows, cols]
             own_zone_aggregated = self._aggregate(own_zone_demand)
             self.resultdata.print_data(
                 numpy.diag(own_zone_aggregated), "own_zone_demand.txt",
@@ -169,7 +191,6 @@ class TourPurpose(Purpose):
         """Aggregate matrix to larger areas."""
         dest = self.zone_data.zone_numbers
         orig = self.zone_numbers
-        mtx = pandas.DataFrame(mtx, orig, dest)
         areas = (
             "helsinki_cbd",
             "helsinki_other",
@@ -177,6 +198,9 @@ class TourPurpose(Purpose):
             "surrounding",
             "peripheral",
         )
+        if isinstance(mtx, SparseMatrix):
+            return self._aggregate_sparse(mtx, areas)
+        mtx = pandas.DataFrame(mtx, orig, dest)
         aggr_mtx = pandas.DataFrame(0, areas, areas)
         tmp_mtx = pandas.DataFrame(0, areas, dest)
         for area in areas:
@@ -187,7 +211,24 @@ class TourPurpose(Purpose):
             aggr_mtx.loc[:, area] = tmp_mtx.loc[:, i].sum(1).values
         return aggr_mtx
 
+    def _aggregate_sparse(self, mtx, areas):
+        """Aggregate sparse matrix to larger areas without densifying."""
+        zone_numbers = numpy.asarray(self.zone_data.zone_numbers)
+        area_idx = numpy.full(zone_numbers.size, -1, int)
+        for j, area in enumerate(areas):
+            i = zone_interval("areas", area)
+            area_idx[(zone_numbers >= i.start) & (zone_numbers <= i.stop)] = j
+        orig = area_idx[self.bounds][mtx.rows]
+        dest = area_idx[mtx.indices]
+        inside = (orig >= 0) & (dest >= 0)
+        aggr_mtx = numpy.zeros((len(areas), len(areas)))
+        numpy.add.at(aggr_mtx, (orig[inside], dest[inside]), mtx.data[inside])
+        return pandas.DataFrame(aggr_mtx, areas, areas)
+
     def _count_trip_lengths(self, trips, dist):
+        if isinstance(trips, SparseMatrix):
+            dist = trips.take(dist)
+            trips = trips.data
         intervals = ("0-1", "1-3", "3-5", "5-10", "10-20", "20-30",
                      "30-40", "40-inf")
         trip_lengths = pandas.Series(index=intervals)
@@ -219,16 +260,22 @@ class SecDestPurpose(Purpose):
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of probability and demand matrices
     """
 
-    def __init__(self, specification, zone_data, resultdata, is_agent_model):
+    def __init__(self, specification, zone_data, resultdata, is_agent_model,
+                 dtype=numpy.float64):
         Purpose.__init__(self, specification, zone_data)
         self.gen_model = generation.SecDestGeneration(self, resultdata)
         self.model = logit.SecDestModel(
-            zone_data, self, resultdata, is_agent_model)
+            zone_data, self, resultdata, is_agent_model, dtype)
         self.modes = self.model.dest_choice_param.keys()
+        self._samplers = OrderedDict()
 
     def init_sums(self):
+        # Impedance changes between iterations, so samplers are rebuilt
+        self.reset_samplers()
         for mode in self.model.dest_choice_param:
             self.generated_tours[mode] = 0
             self.attracted_tours[mode] = numpy.zeros_like(
@@ -241,55 +288,156 @@ class SecDestPurpose(Purpose):
         for mode in self.model.dest_choice_param:
             self.tours[mode] = self.gen_model.get_tours(mode)
 
-    def distribute_tours(self, mode, impedance, origin):
-        """Decide the secondary destinations for all tours (generated 
-        earlier) starting from one specific zone.
-        
+    def distribute_tours(self, mode, impedance, origins):
+        """Decide the secondary destinations for all tours (generated
+        earlier) starting from given zones.
+
+        Origins are evaluated in blocks, as matrices with one row for
+        each (origin, destination) pair and one column for each
+        secondary destination. Only pairs with demand above threshold
+        are included, and number of pairs in a block is limited by
+        memory budget.
+
         Parameters
         ----------
         mode : str
             Mode (car/transit/bike)
         impedance : dict
             Type (time/cost/dist) : numpy 2d matrix
-        origin : int
-            The zone index from which these tours origin
+        origins : numpy.ndarray
+            The zone indices from which these tours origin
 
-        Returns
-        -------
-        Demand
-            Matrix of destination -> secondary_destination pairs
-            The origin zone for all of these tours
+        Yields
+        ------
+        numpy.ndarray
+            Origins in block with some demand
+        numpy.ndarray
+            Destinations in block with some demand
+        numpy.ndarray
+            Destination -> secondary destination demand,
+            summed over origins in block
+        numpy.ndarray
+            Secondary destination -> origin demand, one column per origin
+        numpy.ndarray
+            Tours attracted to each secondary destination (within
+            purpose bounds), not added to `attracted_tours` here, as
+            blocks may be evaluated in several threads
         """
-        generation = self.tours[mode][origin, :]
+        origins = numpy.asarray(origins, int)
+        generation = self.tours[mode][origins, :]
         # All o-d pairs below threshold are neglected,
         # total demand is increased for other pairs.
-        dests = generation > secondary_destination_threshold
-        if not dests.any():
-            # If no o-d pairs have demand above threshold,
-            # the sole destination with largest demand is picked
-            dests = generation.argmax()
-            generation.fill(0)
-            generation[dests] = generation.sum()
+        # If no o-d pairs of an origin have demand above threshold,
+        # the origin has no secondary destination demand.
+        is_active = generation > secondary_destination_threshold
+        has_active = is_active.any(1)
+        is_active[~has_active, :] = False
+        active_sum = numpy.where(is_active, generation, 0).sum(1)
+        scale = generation.sum(1)[has_active] / active_sum[has_active]
+        generation[has_active] *= scale[:, numpy.newaxis]
+        generation[~is_active] = 0
+        self.tours[mode][origins, :] = generation
+        rows, dests = is_active.nonzero()
+        if rows.size == 0:
+            return
+        # Origin blocks are cut so that arrays of pairs fit in budget
+        bytes_per_pair = (impedance["time"].shape[1] * (len(impedance)+5)
+                          * impedance["time"].itemsize)
+        max_pairs = max(secondary_destination_block_memory // bytes_per_pair, 1)
+        pair_ends = numpy.r_[numpy.flatnonzero(numpy.diff(rows)) + 1,
+                             rows.size]
+        cuts = [0]
+        previous = 0
+        for end in pair_ends:
+            if end - cuts[-1] > max_pairs and previous > cuts[-1]:
+                cuts.append(previous)
+            previous = end
+        cuts.append(rows.size)
+        for p0, p1 in zip(cuts[:-1], cuts[1:]):
+            block = slice(p0, p1)
+            orig = origins[rows[block]]
+            dest = dests[block]
+            dest_imp = {}
+            for mtx_type in impedance:
+                dest_imp[mtx_type] = (
+                    impedance[mtx_type][dest, :]
+                    + impedance[mtx_type][:, orig].T
+                    - impedance[mtx_type][dest, orig][:, numpy.newaxis])
+            # TODO Make origin distinction between impedance matrix and lookup
+            # In peripheral area these would not be the same
+            prob = self.model.calc_prob(mode, dest_imp, orig, dest)
+            demand = (prob * generation[rows[block], dest]).T
+            attracted = demand.sum(0)
+            # Car driver share is applied as for other demand
+            demand = Demand(self, mode, demand).matrix
+            origin_starts = numpy.r_[
+                0, numpy.flatnonzero(numpy.diff(rows[block])) + 1]
+            return_demand = numpy.add.reduceat(demand, origin_starts).T
+            order = numpy.argsort(dest, kind="mergesort")
+            dest_starts = numpy.r_[
+                0, numpy.flatnonzero(numpy.diff(dest[order])) + 1]
+            yield (orig[origin_starts], dest[order][dest_starts],
+                   numpy.add.reduceat(demand[order], dest_starts),
+                   return_demand, attracted)
+
+    def reset_samplers(self):
+        """Empty sampler cache of `draw_sec_dest()`.
+
+        Whether a pair is drawn with an alias table depends on cache
+        contents, so cache must be in same state in the beginning of
+        each independently seeded simulation (e.g., agent shard).
+        """
+        self._samplers = OrderedDict()
+
+    def draw_sec_dest(self, mode, impedance, position,
+                      random_state=numpy.random):
+        """Draw secondary destination for agent tour.
+
+        Most (origin, destination) pairs are drawn only once, so the
+        first draw of a pair is done directly from cumulative
+        probabilities. An alias table is built when the pair is drawn
+        again, and kept in a least-recently-used cache of limited
+        size until `init_sums()` is called for next iteration.
+
+        Parameters
+        ----------
+        mode : str
+            Mode (car/transit/bike)
+        impedance : dict
+            Type (time/cost/dist) : numpy 2d matrix
+        position : tuple
+            int
+                Origin zone
+            int
+                Destination zone
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
+
+        Returns
+        -------
+        int
+            Secondary destination zone index (within purpose bounds)
+        """
+        key = (mode, position[0], position[1])
+        try:
+            sampler = self._samplers.pop(key)
+        except KeyError:
+            # Pair not seen (recently), only the key is cached
+            sampler = None
+            cumprob = numpy.cumsum(self.calc_prob(mode, impedance, position))
+            index = min(
+                numpy.searchsorted(
+                    cumprob, random_state.random_sample()*cumprob[-1],
+                    side="right"),
+                cumprob.size - 1)
         else:
-            generation[dests] *= generation.sum() / generation[dests].sum()
-            generation[~dests] = 0
-        dest_imp = {}
-        for mtx_type in impedance:
-            try:
-                dest_imp[mtx_type] = ( impedance[mtx_type][dests, :]
-                                     + impedance[mtx_type][:, origin]
-                                     - impedance[mtx_type][dests, origin][:, numpy.newaxis])
-            except IndexError:
-                dest_imp[mtx_type] = ( impedance[mtx_type][dests, :]
-                                     + impedance[mtx_type][:, origin]
-                                     - impedance[mtx_type][dests, origin])
-        # TODO Make origin distinction between impedance matrix and lookup
-        # In peripheral area these would not be the same
-        prob = self.model.calc_prob(mode, dest_imp, origin, dests)
-        demand = numpy.zeros_like(impedance["time"])
-        demand[dests, :] = (prob * generation[dests]).T
-        self.attracted_tours[mode][self.bounds] += demand.sum(0)
-        return Demand(self, mode, demand, origin)
+            if sampler is None:
+                sampler = AliasTable(self.calc_prob(mode, impedance, position))
+            index = sampler.draw(random_state=random_state)
+        self._samplers[key] = sampler
+        if len(self._samplers) > secondary_destination_sampler_cache_size:
+            self._samplers.popitem(last=False)
+        return int(index)
 
     def calc_prob(self, mode, impedance, position):
         """Calculate secondary destination probabilites for tours
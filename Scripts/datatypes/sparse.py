@@ -0,0 +1,163 @@
+import numpy
+
+
+class SparseMatrix:
+    """Origin-destination matrix in compressed sparse row (CSR) format.
+
+    Only the structure of feasible pairs is stored, all other elements
+    are zero. Operations with vectors are row-wise (i.e., per origin).
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray
+        Start position of each row in `indices` and `data`
+        (length is number of rows + 1)
+    indices : numpy.ndarray
+        Column index of each stored element
+    data : numpy.ndarray
+        Value of each stored element
+    shape : tuple
+        int
+            Number of rows and columns
+    """
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+        self._rows = None
+
+    @classmethod
+    def from_mask(cls, mask, dtype=numpy.float64):
+        """Create zero-valued matrix with structure from boolean mask.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray
+            Boolean 2-d matrix, True for stored elements
+        dtype : numpy.dtype (optional)
+            Float type of values
+
+        Returns
+        -------
+        SparseMatrix
+        """
+        rows, cols = numpy.nonzero(mask)
+        indptr = numpy.zeros(mask.shape[0] + 1, numpy.int64)
+        numpy.cumsum(
+            numpy.bincount(rows, minlength=mask.shape[0]), out=indptr[1:])
+        mtx = cls(indptr, cols, numpy.zeros(cols.size, dtype), mask.shape)
+        mtx._rows = rows
+        return mtx
+
+    @property
+    def rows(self):
+        """numpy.ndarray: Row index of each stored element."""
+        if self._rows is None:
+            self._rows = numpy.repeat(
+                numpy.arange(self.shape[0]), numpy.diff(self.indptr))
+        return self._rows
+
+    @property
+    def nnz(self):
+        """int: Number of stored elements."""
+        return self.data.size
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def like(self, data):
+        """Create matrix with same structure and new values."""
+        mtx = SparseMatrix(self.indptr, self.indices, data, self.shape)
+        mtx._rows = self._rows
+        return mtx
+
+    def take(self, mtx):
+        """Get values of dense matrix at stored positions.
+
+        Parameters
+        ----------
+        mtx : numpy.ndarray
+            Dense 2-d matrix of same shape
+
+        Returns
+        -------
+        numpy.ndarray
+            Values in same order as `data`
+        """
+        return mtx[self.rows, self.indices]
+
+    def multiply(self, vector):
+        """Multiply each row with corresponding vector element."""
+        return self.like(numpy.multiply(
+            self.data, numpy.asarray(vector)[self.rows], dtype=self.dtype))
+
+    def divide(self, vector):
+        """Divide each row with corresponding vector element."""
+        return self.like(numpy.divide(
+            self.data, numpy.asarray(vector)[self.rows], dtype=self.dtype))
+
+    def __mul__(self, scalar):
+        return self.like(numpy.multiply(scalar, self.data, dtype=self.dtype))
+
+    __rmul__ = __mul__
+
+    def __add__(self, other):
+        if other.indices is not self.indices:
+            raise ValueError("Sparse matrices have different structure")
+        return self.like(self.data + other.data)
+
+    def sum(self, axis=None, dtype=numpy.float64):
+        """Sum of elements over given axis.
+
+        Sums are accumulated in double precision by default.
+        """
+        if axis is None:
+            return self.data.sum(dtype=dtype)
+        if axis == 0:
+            sums = numpy.bincount(
+                self.indices, self.data, minlength=self.shape[1])
+        else:
+            sums = numpy.bincount(
+                self.rows, self.data, minlength=self.shape[0])
+        return sums.astype(dtype, copy=False)
+
+    def add_to(self, mtx, factor=1, rows=None, cols=None, transpose=False):
+        """Add (scaled) values to dense matrix.
+
+        Parameters
+        ----------
+        mtx : numpy.ndarray
+            Dense 2-d matrix, where the values are added
+        factor : float (optional)
+            Factor with which the values are multiplied
+        rows : slice (optional)
+            Window of rows in this matrix to add (default is all rows)
+        cols : slice (optional)
+            Window of columns in this matrix to add (default is all columns)
+        transpose : bool (optional)
+            Whether the transpose of this matrix is added
+        """
+        r = self.rows
+        c = self.indices
+        values = self.data
+        if rows is not None or cols is not None:
+            rows = slice(*(rows or slice(None)).indices(self.shape[0]))
+            cols = slice(*(cols or slice(None)).indices(self.shape[1]))
+            inside = ((r >= rows.start) & (r < rows.stop)
+                      & (c >= cols.start) & (c < cols.stop))
+            r = r[inside] - rows.start
+            c = c[inside] - cols.start
+            values = values[inside]
+        if transpose:
+            r, c = c, r
+        # Stored positions are unique, so fancy indexing adds all values
+        mtx[r, c] += factor * values
+
+    def toarray(self):
+        """Get dense 2-d matrix."""
+        mtx = numpy.zeros(self.shape, self.dtype)
+        mtx[self.rows, self.indices] = self.data
+        return mtx
@@ -1,67 +1,134 @@
 import numpy
-import random
 
 import parameters.car as param
 
 
-class Tour:
+class Tour(object):
     """Tour definition for agent-based simulation.
-    
+
+    Tours are created in large numbers, so the class has no instance
+    dictionary. Zones are stored as zone indices and mode as an integer
+    code (index in `Tour.MODES`), zone numbers and mode name are
+    available as properties.
+
     Parameters
     ----------
     purpose : datatypes.purpose.TourPurpose
         Travel purpose (hw/hs/ho/...)
     origin : int or Tour
         Origin zone number or origin tour (if non-home tour)
+    weight : float (optional)
+        Number of persons making the tour
+        (expansion weight of agent in sampled population)
+    origin_index : int (optional)
+        Index of origin zone, if known (only for home-based tours)
     """
 
-    def __init__(self, purpose, origin):
+    MODES = ("car", "transit", "bike", "walk", "car_passenger")
+    MODE_CODES = {mode: i for i, mode in enumerate(MODES)}
+
+    __slots__ = ("purpose", "matrix", "_orig_tour", "_orig_index",
+                 "dest_index", "sec_dest_index", "mode_code")
+
+    def __init__(self, purpose, origin, weight=1, origin_index=None):
         self.purpose = purpose
-        self.orig = origin
-        self.dest = None
-        self.sec_dest = None
-        self.matrix = 1  # So far, one person per tour
+        self.matrix = weight
+        if isinstance(origin, Tour):
+            self._orig_tour = origin
+            self._orig_index = -1
+        else:
+            self._orig_tour = None
+            if origin_index is None:
+                origin_index = purpose.zone_data.zone_index(origin)
+            self._orig_index = origin_index
+        self.dest_index = -1
+        self.sec_dest_index = -1
+        self.mode_code = -1
+
+    @property
+    def orig_index(self):
+        """int: Index of origin zone."""
+        if self._orig_tour is not None:
+            return self._orig_tour.dest_index
+        return self._orig_index
+
+    @property
+    def orig(self):
+        """int or Tour: Origin zone number or origin tour."""
+        if self._orig_tour is not None:
+            return self._orig_tour
+        return self._zone_number(self._orig_index)
+
+    @property
+    def dest(self):
+        """int: Destination zone number (None if not chosen)."""
+        return self._zone_number(self.dest_index)
+
+    @property
+    def sec_dest(self):
+        """int: Secondary destination zone number (None if not chosen)."""
+        return self._zone_number(self.sec_dest_index)
+
+    @property
+    def mode(self):
+        """str: Tour mode (None if not chosen)."""
+        if self.mode_code < 0:
+            return None
+        return Tour.MODES[self.mode_code]
+
+    @mode.setter
+    def mode(self, mode):
+        self.mode_code = Tour.MODE_CODES[mode]
+
+    @property
+    def sec_dest_prob(self):
+        """dict or int: Secondary destination probability for each mode."""
         try:
-            self.sec_dest_prob = purpose.sec_dest_purpose.gen_model.param[purpose.name]
+            gen_model = self.purpose.sec_dest_purpose.gen_model
         except AttributeError:
-            self.sec_dest_prob = 0
-    
+            return 0
+        return gen_model.param[self.purpose.name]
+
     @property
     def position(self):
         """Index position in matrix where to insert the demand.
-        
+
         Returns
         -------
         tuple of ints
             (origin, destination, (secondary destination))
         """
-        zone_data = self.purpose.zone_data
-        try:
-            position = [zone_data.zone_index(self.orig)]
-        except IndexError:
-            position = [zone_data.zone_index(self.orig.dest)]
-        if self.dest is not None:
-            position.append(zone_data.zone_index(self.dest))
-        if self.sec_dest is not None:
-            position.append(zone_data.zone_index(self.sec_dest))
+        position = [self.orig_index]
+        if self.dest_index >= 0:
+            position.append(self.dest_index)
+        if self.sec_dest_index >= 0:
+            position.append(self.sec_dest_index)
         return position
 
-    def choose_mode(self, is_car_user):
+    def _zone_number(self, index):
+        if index < 0:
+            return None
+        return self.purpose.zone_data.zone_numbers[index]
+
+    def choose_mode(self, is_car_user, random_state=numpy.random):
         """Choose tour travel mode.
 
         Assumes tour purpose model has already calculated probability matrices.
-        
+
         Parameters
         ----------
         is_car_user : bool
             Whether the person is car user or not
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
         """
-        model = self.purpose.model
-        probs = model.calc_individual_mode_prob(is_car_user, self.position[0])
-        self.mode = numpy.random.choice(a=list(self.purpose.modes), p=probs)
-        self.purpose.generated_tours[self.mode][self.position[0]] += 1
+        orig = self.orig_index
+        sampler = self.purpose.model.get_mode_sampler(is_car_user, orig)
+        mode_index = sampler.draw(random_state=random_state)
+        self.mode = self.purpose.modes[mode_index]
+        self.purpose.generated_tours[self.mode][orig] += self.matrix
 
-    def choose_destination(self, impedance):
+    def choose_destination(self, impedance, random_state=numpy.random):
         """Choose primary and possibly secondary destinations for the tour.
 
         Assumes tour purpose model has already calculated probability matrices.
@@ -72,33 +139,39 @@ class Tour:
             Mode (car/transit/bike/walk) : dict
                 Type (time/cost/dist) : numpy.ndarray
                     2d matrix with purpose impedance
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
         """
         # Primary destination choice
-        probs = self.purpose.model.dest_prob[self.mode][:, self.position[0]]
-        self.dest = numpy.random.choice(
-            a=self.purpose.zone_data.zone_numbers, p=probs)
-        self.purpose.attracted_tours[self.mode][self.position[1]] += 1
+        mode = self.mode
+        orig = self.orig_index
+        sampler = self.purpose.model.get_dest_sampler(mode, orig)
+        self.dest_index = sampler.draw(random_state=random_state)
+        self.purpose.attracted_tours[mode][self.dest_index] += self.matrix
         # Secondary destination choice
         sec_dest_purpose = self.purpose.sec_dest_purpose
         try:
-            if (self.position[0] < sec_dest_purpose.bounds.stop
-                    and self.position[1] < sec_dest_purpose.bounds.stop):
+            if (orig < sec_dest_purpose.bounds.stop
+                    and self.dest_index < sec_dest_purpose.bounds.stop):
                 is_in_area = True
             else:
                 is_in_area = False
         except AttributeError:
             is_in_area = False
-        if self.mode != "walk" and is_in_area and random.random() < self.sec_dest_prob[self.mode]:
-            probs = sec_dest_purpose.calc_prob(
-                self.mode, impedance[self.mode], self.position)
-            self.sec_dest = numpy.random.choice(
-                a=sec_dest_purpose.zone_numbers, p=probs)
-            sec_dest_purpose.attracted_tours[self.mode][self.position[2]] += 1
+        if (mode != "walk" and is_in_area
+                and random_state.random_sample() < self.sec_dest_prob[mode]):
+            self.sec_dest_index = (
+                sec_dest_purpose.bounds.start
+                + sec_dest_purpose.draw_sec_dest(
+                    mode, impedance[mode], self.position, random_state))
+            sec_dest_purpose.attracted_tours[mode][
+                self.sec_dest_index] += self.matrix
         else:
-            self.sec_dest = None
-    
-    def choose_driver(self):
+            self.sec_dest_index = -1
+
+    def choose_driver(self, random_state=numpy.random):
         """Choose if tour is as car driver or car passenger."""
         # TODO Differentiate car users and others
-        if random.random() > param.car_driver_share[self.purpose.name]:
+        if (random_state.random_sample()
+                > param.car_driver_share[self.purpose.name]):
             self.mode = "car_passenger"
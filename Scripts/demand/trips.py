@@ -4,7 +4,7 @@ import pandas
 import parameters.zone as param
 from datatypes.purpose import TourPurpose, SecDestPurpose
 from models import logit
-from datatypes.person import Person
+from datatypes.population import Population
 
 
 class DemandModel:
@@ -18,9 +18,16 @@ class DemandModel:
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of probability and demand matrices
+    incremental_tolerance : float (optional)
+        If set, destination utilities are recomputed only for origins
+        where impedance has changed (relatively) more than this
+        since previous iteration
     """
     
-    def __init__(self, zone_data, resultdata, is_agent_model=False):
+    def __init__(self, zone_data, resultdata, is_agent_model=False,
+                 dtype=numpy.float64, incremental_tolerance=None):
         self.resultdata = resultdata
         self.zone_data = zone_data
         self.tour_purposes = []
@@ -28,10 +35,13 @@ class DemandModel:
         for purpose_spec in param.tour_purposes:
             if "sec_dest" in purpose_spec:
                 purpose = SecDestPurpose(
-                    purpose_spec, zone_data, resultdata, is_agent_model)
+                    purpose_spec, zone_data, resultdata, is_agent_model,
+                    dtype)
             else:
                 purpose = TourPurpose(
-                    purpose_spec, zone_data, resultdata, is_agent_model)
+                    purpose_spec, zone_data, resultdata, is_agent_model,
+                    dtype)
+            purpose.model.incremental_tolerance = incremental_tolerance
             self.tour_purposes.append(purpose)
             self.purpose_dict[purpose_spec["name"]] = purpose
         for purpose_spec in param.tour_purposes:
@@ -51,7 +61,12 @@ class DemandModel:
         )
         self.cm = logit.CarUseModel(
             zone_data, bounds, self.age_groups, self.resultdata)
+        self.population = None
         self.gm = logit.TourCombinationModel(self.zone_data)
+        self._combination_purposes = sorted(set(
+            purpose for c in self.gm.combinations for purpose in c))
+        self._purpose_counts = self.gm.purpose_counts(
+            self._combination_purposes)
 
     def create_population_segments(self):
         """Create population segments.
@@ -78,32 +93,47 @@ class DemandModel:
             self.segments[age]["car_users"] = car_share * age_share * pop
             self.segments[age]["no_car"] = (1-car_share) * age_share * pop
 
-    def create_population(self):
+    def create_population(self, keep_tour_combinations=False,
+                          sampling_rate=1, random_state=numpy.random):
         """Create population for agent-based simulation.
         
-        Returns
-        -------
-        list
-            Person
+        Result is stored in `self.population`
+        (a `datatypes.population.Population`).
+
+        Parameters
+        ----------
+        keep_tour_combinations : bool (optional)
+            Whether persons keep their tour combinations
+            when tours are added again in later iterations
+        sampling_rate : float (optional)
+            Share of residents included in population
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
         """
         self.cm.calc_basic_prob()
-        self.population = []
-        zones = self.zone_data.zone_numbers[:self.zone_data.first_peripheral_zone]
-        for idx in zones:
-            weights = [1]
-            for age_group in self.age_groups:
-                key = "share_age_" + str(age_group[0]) + "-" + str(age_group[1])
-                share = self.zone_data[key][idx]
-                weights.append(share)
-                weights[0] -= share
-            for _ in range(0, int(self.zone_data["population"][idx])):
-                a = numpy.arange(-1, len(self.age_groups))
-                group = numpy.random.choice(a=a, p=weights)
-                if group != -1:
-                    # Group -1 is under-7-year-olds and they have weights[0]
-                    age_group = self.age_groups[group]
-                    person = Person(idx, age_group, self.gm, self.cm)
-                    self.population.append(person)
+        self.cm.calc_prob_table()
+        self.population = Population(
+            self.zone_data, self.age_groups, self.gm, self.cm,
+            keep_tour_combinations, sampling_rate, random_state)
+
+    def update_population(self):
+        """Update car users of existing population.
+
+        Car use probabilities depend on car density, which is
+        predicted again in every iteration.
+        """
+        self.cm.calc_basic_prob()
+        self.cm.calc_prob_table()
+        self.population.update_car_users()
+
+    def calc_tour_prob_table(self):
+        """Precompute tour combination probabilities for agents.
+
+        Must be called after logsums (accessibilities) are calculated.
+        """
+        ages = ["age_{}-{}".format(*age_group) for age_group in self.age_groups]
+        bounds = slice(0, self.zone_data.first_peripheral_zone)
+        self.gm.calc_prob_table(ages, bounds)
 
     def generate_tours(self):
         """Generate vector of tours for each tour purpose.
@@ -116,20 +146,27 @@ class DemandModel:
             if purpose.area == "peripheral" or purpose.dest == "source":
                 purpose.gen_model.add_tours()
         bounds = slice(0, self.zone_data.first_peripheral_zone)
-        result_data = pandas.DataFrame()  # For printing of results
+        ages = []
+        segments = []
+        segment_pop = []
         for age_group in self.age_groups:
             age = "age_" + str(age_group[0]) + "-" + str(age_group[1])
-            segment = self.segments[age]
-            prob_c = self.gm.calc_prob(age, is_car_user=True, zones=bounds)
-            prob_n = self.gm.calc_prob(age, is_car_user=False, zones=bounds)
-            nr_tours_sums = pandas.Series()
-            for combination in prob_c:
-                # Each combination is a tuple of tours performed during a day
-                nr_tours = ( prob_c[combination] * segment["car_users"]
-                           + prob_n[combination] * segment["no_car"])
-                for purpose in combination:
-                    self.purpose_dict[purpose].gen_model.tours += nr_tours
-                nr_tours_sums["-".join(combination)] = nr_tours.sum()
-            result_data[age] = nr_tours_sums.sort_index()
+            ages.append(age)
+            segments += [(age, True), (age, False)]
+            segment_pop += [self.segments[age]["car_users"],
+                            self.segments[age]["no_car"]]
+        # Zone x segment x combination tensors
+        prob = self.gm.calc_segment_prob(segments, bounds)
+        nr_tours = prob * numpy.array(segment_pop, float).T[:, :, numpy.newaxis]
+        # Each combination is a tuple of tours performed during a day,
+        # tours are accumulated to purposes as a matrix product
+        tours = numpy.dot(nr_tours.sum(1), self._purpose_counts)
+        for j, purpose in enumerate(self._combination_purposes):
+            self.purpose_dict[purpose].gen_model.tours += tours[:, j]
+        # Car users and others are summed for each age group
+        nr_tours_sums = nr_tours.sum(0).reshape(len(ages), 2, -1).sum(1)
+        combinations = ["-".join(c) for c in self.gm.combinations]
+        result_data = pandas.DataFrame(nr_tours_sums.T, combinations, ages)
+        result_data = result_data.sort_index()
         self.resultdata.print_matrix(result_data, "generation", "tour_combinations")
 
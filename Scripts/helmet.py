@@ -61,7 +61,9 @@ def main(args):
     # and providing demand calculations as Python modules)
     model = ModelSystem(
         forecast_zonedata_path, base_zonedata_path, base_matrices_path,
-        results_path, ass_model, name)
+        results_path, ass_model, name, args.use_single_precision,
+        args.incremental_tolerance, args.zone_data_snapshot_path,
+        args.use_factorized_demand)
     log_extra["status"]["results"] = model.mode_share
 
     # Run traffic assignment simulation for N iterations, on last iteration model-system will save the results
@@ -194,6 +196,30 @@ if __name__ == "__main__":
         action="store_true",
         default=config.USE_FIXED_TRANSIT_COST,
         help="Using this flag activates use of pre-calculated (fixed) transit costs."),
+    parser.add_argument(
+        "--use-single-precision",
+        dest="use_single_precision",
+        action="store_true",
+        default=config.USE_SINGLE_PRECISION,
+        help="Using this flag runs demand calculation in single precision (float32) to save memory."),
+    parser.add_argument(
+        "--incremental-tolerance",
+        dest="incremental_tolerance",
+        type=float,
+        default=config.INCREMENTAL_TOLERANCE,
+        help="Relative impedance change below which destination utilities of an origin are not recomputed between iterations."),
+    parser.add_argument(
+        "--zone-data-snapshot-path",
+        dest="zone_data_snapshot_path",
+        type=str,
+        default=config.ZONE_DATA_SNAPSHOT_PATH,
+        help="Path to folder where snapshots of parsed zone data are stored and reused."),
+    parser.add_argument(
+        "--use-factorized-demand",
+        dest="use_factorized_demand",
+        action="store_true",
+        default=config.USE_FACTORIZED_DEMAND,
+        help="Using this flag splits daily demand into time periods only when it is assigned."),
     args = parser.parse_args()
 
     config.LOG_LEVEL = args.log_level
@@ -208,6 +234,10 @@ if __name__ == "__main__":
     log.debug('forecast_data_path=' + args.forecast_data_path)
     log.debug('iterations=' + str(args.iterations))
     log.debug('use_fixed_transit_cost=' + str(args.use_fixed_transit_cost))
+    log.debug('use_single_precision=' + str(args.use_single_precision))
+    log.debug('incremental_tolerance=' + str(args.incremental_tolerance))
+    log.debug('zone_data_snapshot_path=' + str(args.zone_data_snapshot_path))
+    log.debug('use_factorized_demand=' + str(args.use_factorized_demand))
     log.debug('save_matrices=' + str(args.save_matrices))
     log.debug('del_strat_files=' + str(args.del_strat_files))
     log.debug('first_scenario_id=' + str(args.first_scenario_id))
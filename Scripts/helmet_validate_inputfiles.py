@@ -6,6 +6,7 @@ import utils.log as log
 from assignment.emme_assignment import EmmeAssignmentModel
 from datahandling.matrixdata import MatrixData
 from datahandling.zonedata import ZoneData
+from utils.validation import ValidationReport
 from assignment.emme_bindings.emme_project import EmmeProject
 import parameters.assignment as param
 
@@ -59,16 +60,23 @@ def main(args):
             emme_paths[0])
         log.error(msg)
         raise ValueError(msg)
+    # Violations in all data files are collected in one report,
+    # so that they can be fixed in one pass
+    report = ValidationReport()
     # Check base zonedata
     assignment_model = EmmeAssignmentModel(
         EmmeProject(emme_paths[0]), first_scenario_id=first_scenario_ids[0])
-    base_zonedata = ZoneData(base_zonedata_path, assignment_model.zone_numbers)
+    base_zonedata = ZoneData(
+        base_zonedata_path, assignment_model.zone_system,
+        args.zone_data_snapshot_path, report)
     # Check base matrices
     matrixdata = MatrixData(base_matrices_path)
     for tp in assignment_model.emme_scenarios:
-        with matrixdata.open("demand", tp, assignment_model.zone_numbers) as mtx:
+        with matrixdata.open("demand", tp, assignment_model.zone_system,
+                             report=report) as mtx:
             for ass_class in param.transport_classes:
-                a = mtx[ass_class]
+                if ass_class in mtx.matrix_list:
+                    a = mtx[ass_class]
 
     # Check scenario based input data
     log.info("Checking base zonedata & scenario-based input data...")
@@ -89,8 +97,11 @@ def main(args):
 
         # Check forecasted zonedata
         forecast_zonedata = ZoneData(
-            forecast_zonedata_paths[i], assignment_model.zone_numbers)
+            forecast_zonedata_paths[i], assignment_model.zone_system,
+            args.zone_data_snapshot_path, report)
 
+    report.write(os.path.splitext(log.filename)[0] + ".json")
+    report.raise_errors()
     log.info("Successfully validated all input files")
 
 
@@ -141,6 +152,12 @@ if __name__ == "__main__":
         nargs="+",
         required=True,
         help="List of paths to folder containing forecast zonedata"),
+    parser.add_argument(
+        "--zone-data-snapshot-path",
+        dest="zone_data_snapshot_path",
+        type=str,
+        default=config.ZONE_DATA_SNAPSHOT_PATH,
+        help="Path to folder where snapshots of parsed zone data are stored and reused."),
     args = parser.parse_args()
 
     config.LOG_LEVEL = args.log_level
@@ -1,6 +1,8 @@
+import numpy
 import pandas
 
 import parameters.tour_generation as param
+from datatypes.sparse import SparseMatrix
 
 
 class GenerationModel:
@@ -110,7 +112,17 @@ class SecDestGeneration(GenerationModel):
             bounds = self.purpose.bounds
             metropolitan = next(iter(self.purpose.sources)).bounds
             b = self.param
-            self.tours[mode] += b[purpose.name][mode] * demand[metropolitan, bounds]
+            if isinstance(demand, SparseMatrix):
+                if not isinstance(self.tours[mode], numpy.ndarray):
+                    rows = range(*metropolitan.indices(demand.shape[0]))
+                    cols = range(*bounds.indices(demand.shape[1]))
+                    self.tours[mode] = numpy.zeros(
+                        (len(rows), len(cols)), demand.dtype)
+                demand.add_to(
+                    self.tours[mode], b[purpose.name][mode],
+                    metropolitan, bounds)
+            else:
+                self.tours[mode] += b[purpose.name][mode] * demand[metropolitan, bounds]
     
     def get_tours(self, mode):
         """Get vector of tour numbers per od pair.
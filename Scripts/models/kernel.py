@@ -0,0 +1,443 @@
+import numpy
+
+
+# Number of matrix elements evaluated at a time. One block of this size,
+# together with the few temporaries needed for it, fits in CPU cache.
+BLOCK_SIZE = 2**16
+
+
+class ZoneTerm:
+    """Zone-data-only part of utility, in compact form.
+
+    Value of element (row, col) is the sum of a row term, a column term
+    that depends on the region (capital region/surrounding area) of the
+    row, and a full matrix term (from compound data). Missing terms
+    are None.
+
+    Compound data is kept in compact form if possible: for elements
+    where row and column are in same group (zone or municipality) of
+    `compound`, column term is taken from `own_colvecs` instead of
+    `colvecs`.
+
+    Parameters
+    ----------
+    region : numpy.ndarray
+        Region index (0/1) for each purpose zone (row)
+    rowvec : numpy.ndarray (optional)
+        Values for each row
+    colvecs : numpy.ndarray (optional)
+        Values for each column, one vector per region
+    matrix : numpy.ndarray (optional)
+        Values for each element
+    compound : datahandling.zonedata.CompoundData (optional)
+        Compound data defining own-group elements
+    own_colvecs : numpy.ndarray (optional)
+        Values for each column for own-group elements, one vector
+        per region (must be given with `compound` and `colvecs`)
+    """
+
+    def __init__(self, region, rowvec=None, colvecs=None, matrix=None,
+                 compound=None, own_colvecs=None):
+        self.region = region
+        self.rowvec = rowvec
+        self.colvecs = colvecs
+        self.matrix = matrix
+        self.compound = compound
+        self.own_colvecs = own_colvecs
+
+    def fill(self, out, rows, cols=None):
+        """Write values of block rows (or elements) into array."""
+        if self.matrix is not None:
+            out[...] = _take(self.matrix, rows, cols)
+        else:
+            out.fill(0)
+        if self.compound is not None:
+            is_own = self.compound.is_own(rows, cols)
+            region = self.region[rows]
+            if cols is None:
+                out += numpy.where(
+                    is_own, self.own_colvecs[region], self.colvecs[region])
+            else:
+                out += numpy.where(
+                    is_own, self.own_colvecs[region, cols],
+                    self.colvecs[region, cols])
+        elif self.colvecs is not None:
+            if cols is None:
+                out += self.colvecs[self.region[rows]]
+            else:
+                out += self.colvecs[self.region[rows], cols]
+        if self.rowvec is not None:
+            if cols is None and out.ndim == 2:
+                out += self.rowvec[rows, numpy.newaxis]
+            else:
+                out += self.rowvec[rows]
+        return out
+
+    def log1p(self):
+        """Get new term with log(1+x) transformation of values."""
+        if self.matrix is None and self.rowvec is None:
+            if self.compound is not None:
+                return ZoneTerm(
+                    self.region, colvecs=numpy.log1p(self.colvecs),
+                    compound=self.compound,
+                    own_colvecs=numpy.log1p(self.own_colvecs))
+            return ZoneTerm(self.region, colvecs=numpy.log1p(self.colvecs))
+        if self.matrix is None and self.colvecs is None:
+            return ZoneTerm(self.region, rowvec=numpy.log1p(self.rowvec))
+        if self.matrix is not None:
+            shape = self.matrix.shape
+        else:
+            shape = (self.region.size, self.colvecs.shape[1])
+        values = self.fill(numpy.empty(shape), slice(None))
+        return ZoneTerm(self.region, matrix=numpy.log1p(values, out=values))
+
+
+class ZoneTermCache:
+    """Cache of zone-data-only utility components for one purpose.
+
+    Zone data does not change between model iterations (except for
+    a few variables, like car density and impedance ratios), so these
+    components are evaluated only once. A cached component is
+    re-evaluated if any of the zone data it depends on has been set
+    after it was evaluated. Identical parameter blocks (e.g., the size
+    variable for different modes) share the same cached component.
+
+    Parameters
+    ----------
+    zone_data : ZoneData
+        Data used for all demand calculations
+    bounds : slice
+        Zone bounds of the purpose (rows of the utility matrix)
+    """
+
+    def __init__(self, zone_data, bounds):
+        self.zone_data = zone_data
+        self.bounds = bounds
+        nr_rows = len(range(*bounds.indices(len(zone_data.zone_numbers))))
+        self.region = (numpy.arange(nr_rows) >= zone_data.first_surrounding_zone
+                       ).astype(numpy.intp)
+        self._terms = {}
+
+    def get(self, ndim, constant=0, generation=(), attraction=(), log=False):
+        """Get cached zone term, evaluating it if necessary.
+
+        Parameters
+        ----------
+        ndim : int
+            Dimension of utility (1 for zone vector, 2 for o-d matrix)
+        constant : float or tuple (optional)
+            Constant term
+        generation : list (optional)
+            tuple
+                str
+                    Zone data key (data for purpose zones)
+                float or tuple
+                    Parameter
+        attraction : list (optional)
+            tuple
+                str
+                    Zone data key (data for all zones)
+                float or tuple
+                    Parameter
+        log : bool (optional)
+            Whether log(1+x) transformation is applied to the sum
+
+        Returns
+        -------
+        ZoneTerm
+        """
+        key = (ndim, constant, tuple(sorted(generation)),
+               tuple(sorted(attraction)), log)
+        versions = tuple(self.zone_data.get_version(i)
+                         for i, _ in list(generation) + list(attraction))
+        try:
+            cached_versions, term = self._terms[key]
+            if cached_versions == versions:
+                return term
+        except KeyError:
+            pass
+        term = self._evaluate(ndim, constant, generation, attraction)
+        if log:
+            term = term.log1p()
+        self._terms[key] = (versions, term)
+        return term
+
+    def _evaluate(self, ndim, constant, generation, attraction):
+        rowvec = numpy.zeros(self.region.size)
+        rowvec += self._coef(constant)
+        colvecs = None
+        matrix = None
+        compound = None
+        terms = ([(i, b, True) for i, b in generation]
+                 + [(i, b, False) for i, b in attraction])
+        for i, b, is_generation in terms:
+            data = self.zone_data.get_data(i, self.bounds, is_generation)
+            if (data.ndim == 2 and ndim == 2
+                    and (compound is None
+                         or compound.division == data.division)):
+                # Compound kept as column vectors for own-group
+                # and other-group elements
+                if compound is None:
+                    compound = data
+                    own_colvecs = numpy.zeros((2, data.shape[1]))
+                    other_colvecs = numpy.zeros((2, data.shape[1]))
+                coef = self._region_coef(b)
+                own_colvecs += coef * data.own
+                other_colvecs += coef * data.other
+            elif data.ndim == 2:  # Compound (purpose zones -> all zones)
+                coef = self._coef(b)
+                if ndim == 2 and numpy.ndim(coef) == 1:
+                    coef = coef[:, numpy.newaxis]
+                if matrix is None:
+                    matrix = numpy.zeros(data.shape)
+                data.add_to(matrix, coef)
+            elif is_generation or ndim == 1:
+                rowvec += self._coef(b) * data[:rowvec.size]
+            else:
+                if colvecs is None:
+                    colvecs = numpy.zeros((2, data.size))
+                try:
+                    len(b)
+                except TypeError:  # If only one parameter
+                    colvecs += b * data
+                else:  # Separate params for cap region and surrounding
+                    colvecs[0] += b[0] * data
+                    colvecs[1] += b[1] * data
+        if compound is not None:
+            if colvecs is None:
+                colvecs = other_colvecs
+            else:
+                own_colvecs += colvecs
+                colvecs += other_colvecs
+        else:
+            own_colvecs = None
+        if not rowvec.any() and (colvecs is not None or matrix is not None):
+            rowvec = None
+        return ZoneTerm(
+            self.region, rowvec, colvecs, matrix, compound, own_colvecs)
+
+    def _region_coef(self, b):
+        """Get parameter value for each region, as column vector."""
+        try:
+            len(b)
+        except TypeError:  # If only one parameter
+            return b
+        return numpy.array(b, float)[:, numpy.newaxis]
+
+    def _coef(self, b):
+        """Get parameter value for each row.
+
+        If parameter b is a tuple of two terms, they are used for
+        capital region and surrounding region respectively.
+        """
+        try:
+            len(b)
+        except TypeError:  # If only one parameter
+            return b
+        return numpy.where(self.region == 0, b[0], b[1])
+
+
+class UtilityKernel:
+    """Fused evaluator of exponentiated logit utilities.
+
+    The terms of one purpose/mode parameter block are collected once
+    at construction. Linear terms, log terms (as b*log(1+x)),
+    the distance boundary and the exponentiation are then evaluated
+    in a single pass over each block of rows, instead of sweeping
+    the whole matrix once per term. Terms depending only on zone data
+    are taken from a cache, so only the impedance-dependent part is
+    evaluated in each model iteration.
+
+    Parameters
+    ----------
+    zone_data : ZoneData
+        Data used for all demand calculations
+    bounds : slice
+        Zone bounds of the purpose (rows of the utility matrix)
+    param : dict
+        Mode-specific parameters (constant/generation/attraction/
+        impedance/log/size/transform)
+    threshold : float (optional)
+        Distance boundary, exps are set to zero for longer distances
+    cache : ZoneTermCache (optional)
+        Cache of zone-data-only terms, can be shared between kernels
+        of same purpose
+    """
+
+    def __init__(self, zone_data, bounds, param, threshold=None, cache=None):
+        self.zone_data = zone_data
+        self.bounds = bounds
+        self.threshold = threshold
+        if cache is None:
+            cache = ZoneTermCache(zone_data, bounds)
+        self.cache = cache
+        self._used_terms = {}
+        self.constant = param.get("constant", 0)
+        self.generation = list(param.get("generation", {}).items())
+        self.attraction = list(param["attraction"].items())
+        self.impedance = list(param["impedance"].items())
+        self.log = list(param["log"].items())
+        self.size = list(param.get("size", {}).items())
+        if "transform" in param:
+            self.transform = (
+                list(param["transform"]["attraction"].items()),
+                list(param["transform"]["impedance"].items()))
+        else:
+            self.transform = None
+
+    def calc_exps(self, impedance, out, rows=None):
+        """Evaluate exponentiated utilities into given array.
+
+        Parameters
+        ----------
+        impedance : dict
+            Type (time/cost/dist/logsum) : numpy 1-d or 2-d array
+                Impedances, with one row for each purpose zone
+        out : numpy.ndarray
+            Array of same shape as impedance, where exps are written
+        rows : numpy.ndarray (optional)
+            Indices of rows to evaluate, other rows of `out` are
+            left as they are (default is all rows)
+
+        Returns
+        -------
+        numpy.ndarray
+            The `out` array
+        """
+        if out.ndim == 1:
+            step = BLOCK_SIZE
+        else:
+            step = max(BLOCK_SIZE // max(out.shape[1], 1), 1)
+        terms = self._zone_terms(out.ndim)
+        self._used_terms[out.ndim] = terms
+        if rows is None:
+            for start in range(0, out.shape[0], step):
+                block = slice(start, min(start + step, out.shape[0]))
+                self._calc_block(out[block], impedance, terms, block)
+        else:
+            for start in range(0, rows.size, step):
+                block = rows[start:start+step]
+                utility = out[block]
+                self._calc_block(utility, impedance, terms, block)
+                out[block] = utility
+        return out
+
+    def zone_terms_changed(self, ndim):
+        """Check if zone data has changed since last evaluation.
+
+        Parameters
+        ----------
+        ndim : int
+            Dimension of utility (1 for zone vector, 2 for o-d matrix)
+
+        Returns
+        -------
+        bool
+            True if zone-data-only terms differ from those used in
+            previous `calc_exps` call (or if there is no such call)
+        """
+        if ndim not in self._used_terms:
+            return True
+        terms = self._zone_terms(ndim)
+        used_terms = self._used_terms[ndim]
+        return any(terms[i] is not used_terms[i] for i in terms)
+
+    def calc_sparse_exps(self, impedance, out):
+        """Evaluate exponentiated utilities for stored elements only.
+
+        Parameters
+        ----------
+        impedance : dict
+            Type (time/cost/dist) : numpy 2-d array
+                Impedances, with one row for each purpose zone
+        out : datatypes.sparse.SparseMatrix
+            Matrix with feasible origin-destination pairs,
+            where exps are written
+
+        Returns
+        -------
+        datatypes.sparse.SparseMatrix
+            The `out` matrix
+        """
+        terms = self._zone_terms(2)
+        for start in range(0, out.nnz, BLOCK_SIZE):
+            elements = slice(start, min(start + BLOCK_SIZE, out.nnz))
+            self._calc_block(
+                out.data[elements], impedance, terms, out.rows[elements],
+                out.indices[elements])
+        return out
+
+    def _zone_terms(self, ndim):
+        """Get zone-data-only terms (utility, size, transform) from cache."""
+        terms = {
+            "utility": self.cache.get(
+                ndim, self.constant, self.generation, self.attraction),
+        }
+        for i, _ in self.log:
+            if i == "size":
+                terms[i] = self.cache.get(ndim, attraction=self.size, log=True)
+            elif i == "transform":
+                terms[i] = self.cache.get(
+                    ndim, attraction=self.transform[0])
+        return terms
+
+    def _calc_block(self, utility, impedance, terms, rows, cols=None):
+        """Evaluate exps in place for a block of rows or elements.
+
+        If `cols` is given, `rows` and `cols` are index arrays of
+        individual origin-destination pairs, otherwise `rows` is
+        a slice of full rows.
+        """
+        terms["utility"].fill(utility, rows, cols)
+        self._add_impedance(utility, impedance, rows, cols, self.impedance)
+        for i, b in self.log:
+            if i == "size":
+                imp = terms[i].fill(numpy.empty_like(utility), rows, cols)
+                utility += self._coef(b, rows, utility.ndim) * imp
+                continue
+            if i == "transform":
+                imp = terms[i].fill(
+                    numpy.empty(utility.shape), rows, cols)
+                self._add_impedance(
+                    imp, impedance, rows, cols, self.transform[1])
+            else:
+                imp = _take(impedance[i], rows, cols)
+            utility += self._coef(b, rows, utility.ndim) * numpy.log1p(imp)
+        numpy.exp(utility, out=utility)
+        if self.threshold is not None:
+            dist = _take(impedance["dist"], rows, cols)
+            utility[dist > self.threshold] = 0
+
+    def _add_impedance(self, utility, impedance, rows, cols, imp_terms):
+        """Add linear impedance terms."""
+        for i, b in imp_terms:
+            utility += (self._coef(b, rows, utility.ndim)
+                        * _take(impedance[i], rows, cols))
+        return utility
+
+    def _coef(self, b, rows, ndim):
+        """Get parameter value for block rows.
+
+        If parameter b is a tuple of two terms, they are used for
+        capital region and surrounding region respectively.
+        """
+        try:
+            len(b)
+        except TypeError:  # If only one parameter
+            return b
+        k = self.zone_data.first_surrounding_zone
+        try:
+            idx = numpy.arange(rows.start, rows.stop)
+        except AttributeError:  # Index array of individual elements
+            idx = rows
+        coef = numpy.where(idx < k, b[0], b[1])
+        if ndim == 2:
+            coef = coef[:, numpy.newaxis]
+        return coef
+
+
+def _take(mtx, rows, cols):
+    if cols is None:
+        return mtx[rows]
+    else:
+        return mtx[rows, cols]
@@ -90,8 +90,8 @@ class CarDensityModel(LinearModel):
         share_detached_new = numpy.divide(
             detached_houses_diff, pop_growth,
             out=numpy.array(forecast_sh_detached), where=pop_growth!=0)
-        self.zone_data._values["share_detached_houses_new"] = pandas.Series(
-            share_detached_new, self.zone_data.zone_numbers[self.bounds])
+        self.zone_data.set_data("share_detached_houses_new", pandas.Series(
+            share_detached_new, self.zone_data.zone_numbers[self.bounds]))
     
     def predict(self):
         """Get car ownership prediction for zones.
@@ -108,14 +108,11 @@ class CarDensityModel(LinearModel):
         self._add_log_zone_terms(prediction, b["log"], True)
         # Car density cannot be negative
         prediction = prediction.clip(0.0, None)
-        try:
+        parking_norm = self.zone_data.parking_norm
+        if parking_norm is not None:
             # Take parking norms as given and replace model results
             # for these zones
-            parking_norm = self.zone_data["parking_norm"]
             prediction[parking_norm.index] = parking_norm
-        except AttributeError:
-            # If no parking norms are given
-            pass
         base_car_density = self.zone_data_base["car_density"]
         prediction = (self.pop_growth_share * prediction
                       + (1-self.pop_growth_share) * base_car_density)
@@ -127,7 +124,8 @@ class CarDensityModel(LinearModel):
 
         # In validation data, car density is calculated for the whole
         # population from ages 0 to 999.
-        population = self.zone_data["population"][:self.zone_data.first_peripheral_zone]
+        population = self.zone_data.get_series("population")[
+            :self.zone_data.first_peripheral_zone]
         car_density = prediction
                 
         # Print car density by zone
@@ -3,10 +3,15 @@ import pandas
 import math
 
 from parameters.destination_choice import destination_choice, distance_boundary
+from parameters.destination_choice import sparse_destination_modes
 from parameters.mode_choice import mode_choice
 from parameters.car import car_usage
 import parameters.tour_generation as generation_params
 from utils.zone_interval import ZoneIntervals
+from utils.alias_table import AliasTable
+from models.kernel import UtilityKernel, ZoneTermCache
+from datatypes.sparse import SparseMatrix
+from datahandling.zonedata import CompoundData
 
 
 class LogitModel:
@@ -22,61 +27,134 @@ class LogitModel:
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of utility and probability matrices,
+        agent-based simulation always uses double precision
+
+    Attributes
+    ----------
+    incremental_tolerance : float or None
+        If set, destination utilities are recomputed only for origins
+        where some impedance has changed more than this (relative to
+        previous value) since previous calculation
+    recomputed_rows : dict
+        Mode : int
+            Number of origins for which destination utilities were
+            evaluated in latest calculation
     """
 
-    def __init__(self, zone_data, purpose, resultdata, is_agent_model):
+    def __init__(self, zone_data, purpose, resultdata, is_agent_model,
+                 dtype=numpy.float64):
         self.resultdata = resultdata
         self.purpose = purpose
         self.bounds = purpose.bounds
         self.zone_data = zone_data
         self.dest_exps = {}
+        self.dest_prob = {}
         self.mode_exps = {}
+        self.incremental_tolerance = None
+        self.recomputed_rows = {}
+        self._changed_rows = {}
+        self._prev_dest_imp = {}
+        self._dest_expsums = {}
+        self._samplers = {}
         self.dest_choice_param = destination_choice[purpose.name]
         self.mode_choice_param = mode_choice[purpose.name]
         if is_agent_model:
             self.dtype = float
+            self.sparse_modes = ()
         else:
-            self.dtype = None
+            self.dtype = dtype
+            self.sparse_modes = sparse_destination_modes
+        self._init_kernels()
+
+    def _init_kernels(self):
+        """Compile parameter blocks into utility kernels.
+
+        Kernels share one cache of zone-data-only utility components.
+        """
+        self.zone_terms = ZoneTermCache(self.zone_data, self.bounds)
+        self.mode_kernels = {}
+        for mode in self.mode_choice_param:
+            self.mode_kernels[mode] = UtilityKernel(
+                self.zone_data, self.bounds, self.mode_choice_param[mode],
+                cache=self.zone_terms)
+        self.dest_kernels = {}
+        for mode in self.dest_choice_param:
+            self.dest_kernels[mode] = UtilityKernel(
+                self.zone_data, self.bounds, self.dest_choice_param[mode],
+                distance_boundary.get(mode), self.zone_terms)
 
     def _calc_mode_util(self, impedance):
         expsum = numpy.zeros_like(next(iter(impedance["car"].values())), self.dtype)
         for mode in self.mode_choice_param:
-            b = self.mode_choice_param[mode]
-            utility = numpy.zeros_like(expsum)
-            self._add_constant(utility, b["constant"])
-            utility = self._add_zone_util(
-                utility.T, b["generation"], generation=True).T
-            self._add_zone_util(utility, b["attraction"])
-            self._add_impedance(utility, impedance[mode], b["impedance"])
-            exps = numpy.exp(utility)
-            self._add_log_impedance(exps, impedance[mode], b["log"])
+            exps = numpy.empty_like(expsum)
+            self.mode_kernels[mode].calc_exps(impedance[mode], exps)
             self.mode_exps[mode] = exps
             expsum += exps
         return expsum
     
     def _calc_dest_util(self, mode, impedance):
-        b = self.dest_choice_param[mode]
-        utility = numpy.zeros_like(next(iter(impedance.values())), self.dtype)
-        self._add_zone_util(utility, b["attraction"])
-        self._add_impedance(utility, impedance, b["impedance"])
-        self.dest_exps[mode] = numpy.exp(utility)
-        size = numpy.zeros_like(utility)
-        self._add_zone_util(size, b["size"])
-        impedance["size"] = size
-        if "transform" in b:
-            b_transf = b["transform"]
-            transimp = numpy.zeros_like(utility)
-            self._add_zone_util(transimp, b_transf["attraction"])
-            self._add_impedance(transimp, impedance, b_transf["impedance"])
-            impedance["transform"] = transimp
-        self._add_log_impedance(self.dest_exps[mode], impedance, b["log"])
-        if mode != "logsum":
-            threshold = distance_boundary[mode]
-            self.dest_exps[mode][impedance["dist"] > threshold] = 0
-        try:
+        if mode in self.sparse_modes:
+            # Feasible destination set, with origins as rows
+            feasible = ~(impedance["dist"] > distance_boundary[mode])
+            self.dest_exps[mode] = SparseMatrix.from_mask(feasible, self.dtype)
+            self.dest_kernels[mode].calc_sparse_exps(
+                impedance, self.dest_exps[mode])
+            self.recomputed_rows[mode] = feasible.shape[0]
             return self.dest_exps[mode].sum(1)
+        rows = self._find_changed_rows(mode, impedance)
+        self._changed_rows[mode] = rows
+        if rows is not None:
+            exps = self.dest_exps[mode]
+            self.dest_kernels[mode].calc_exps(impedance, exps, rows)
+            self.recomputed_rows[mode] = rows.size
+            expsum = self._dest_expsums[mode].copy()
+            expsum[rows] = exps[rows].sum(1, dtype=numpy.float64)
+            self._dest_expsums[mode] = expsum
+            return expsum
+        exps = numpy.empty_like(next(iter(impedance.values())), self.dtype)
+        self.dest_exps[mode] = exps
+        self.dest_kernels[mode].calc_exps(impedance, exps)
+        self.recomputed_rows[mode] = exps.shape[0]
+        # Logsums are accumulated in double precision
+        try:
+            expsum = exps.sum(1, dtype=numpy.float64)
         except ValueError:
-            return self.dest_exps[mode].sum()
+            return exps.sum(dtype=numpy.float64)
+        self._dest_expsums[mode] = expsum
+        return expsum
+
+    def _find_changed_rows(self, mode, impedance):
+        """Find origins where impedance has changed over tolerance.
+
+        Impedance is compared to a single-precision copy kept from
+        previous call, so that caller may reuse its arrays and memory
+        use is half of that of keeping the impedance itself.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            Indices of changed rows, None if all rows must be evaluated
+        """
+        tol = self.incremental_tolerance
+        if tol is None:
+            return None
+        prev_imp = self._prev_dest_imp.get(mode)
+        self._prev_dest_imp[mode] = {
+            i: impedance[i].astype(numpy.float32) for i in impedance}
+        if (prev_imp is None
+                or mode not in self._dest_expsums
+                or set(prev_imp) != set(impedance)
+                or self.dest_kernels[mode].zone_terms_changed(2)):
+            return None
+        changed = numpy.zeros(self.dest_exps[mode].shape[0], bool)
+        for i in impedance:
+            if impedance[i].shape != self.dest_exps[mode].shape:
+                return None
+            diff = numpy.abs(impedance[i] - prev_imp[i])
+            changed |= (diff > tol * numpy.abs(prev_imp[i])).any(1)
+        return changed.nonzero()[0]
     
     def _calc_sec_dest_util(self, mode, impedance, orig, dest):
         b = self.dest_choice_param[mode]
@@ -192,7 +270,8 @@ class LogitModel:
         zdata = self.zone_data
         for i in b:
             try: # If only one parameter
-                utility += b[i] * zdata.get_data(i, self.bounds, generation)
+                _add_data(utility, b[i],
+                          zdata.get_data(i, self.bounds, generation))
             except ValueError: # Separate params for cap region and surrounding
                 k = self.zone_data.first_surrounding_zone
                 data_capital_region = zdata.get_data(
@@ -203,8 +282,8 @@ class LogitModel:
                     utility[:k] += b[i][0] * data_capital_region
                     utility[k:] += b[i][1] * data_surrounding
                 else: # 2-d matrix calculation
-                    utility[:k, :] += b[i][0] * data_capital_region
-                    utility[k:, :] += b[i][1] * data_surrounding
+                    _add_data(utility[:k, :], b[i][0], data_capital_region)
+                    _add_data(utility[k:, :], b[i][1], data_surrounding)
         return utility
     
     def _add_sec_zone_util(self, utility, b, orig=None, dest=None):
@@ -212,7 +291,7 @@ class LogitModel:
         for i in b:
             data = zdata.get_data(i, self.bounds, generation=True)
             try: # If only one parameter
-                utility += b[i] * data
+                _add_data(utility, b[i], data)
             except ValueError: # Separate params for orig and dest
                 u = self.zone_data.first_peripheral_zone
                 utility += b[i][0] * data[orig, :u]
@@ -270,6 +349,8 @@ class ModeDestModel(LogitModel):
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of utility and probability matrices
     """
 
     def calc_prob(self, impedance):
@@ -288,8 +369,9 @@ class ModeDestModel(LogitModel):
         Returns
         -------
         dict
-            Mode (car/transit/bike/walk) : numpy 2-d matrix
-                Choice probabilities
+            Mode (car/transit/bike/walk) : numpy 2-d matrix or SparseMatrix
+                Choice probabilities (destinations x origins if dense,
+                origins x destinations if sparse)
         """
         prob = self.calc_basic_prob(impedance)
         for mod_mode in self.mode_choice_param:
@@ -298,9 +380,14 @@ class ModeDestModel(LogitModel):
                     i, self.bounds, generation=True)
                 ind_prob = self.calc_individual_prob(mod_mode, i)
                 for mode in prob:
-                    no_dummy = (1 - dummy_share) * prob[mode]
-                    dummy = dummy_share * ind_prob[mode]
-                    prob[mode] = no_dummy + dummy
+                    if isinstance(prob[mode], SparseMatrix):
+                        prob[mode] = ( prob[mode].multiply(1 - dummy_share)
+                                     + ind_prob[mode].multiply(dummy_share))
+                    else:
+                        prob[mode] *= 1 - dummy_share
+                        prob[mode] += numpy.multiply(
+                            dummy_share, ind_prob[mode],
+                            dtype=prob[mode].dtype)
         return prob
     
     def calc_basic_prob(self, impedance):
@@ -397,7 +484,63 @@ class ModeDestModel(LogitModel):
             probs.append(mode_exps[mode] / mode_expsum)
         return probs
 
+    def get_dest_sampler(self, mode, origin):
+        """Get sampler for destination choice of agents.
+
+        Sampler is built on first use and cached until probabilities
+        are calculated again.
+
+        Parameters
+        ----------
+        mode : str
+            Mode (car/transit/bike/walk)
+        origin : int
+            Index of origin zone (in purpose zones)
+
+        Returns
+        -------
+        utils.alias_table.AliasTable
+            Sampler of destination zone indices
+        """
+        key = ("dest", mode, origin)
+        if key not in self._samplers:
+            prob = self.dest_prob[mode]
+            if mode in self.sparse_modes:
+                # Sparse probabilities are stored origins x destinations
+                row = slice(prob.indptr[origin], prob.indptr[origin+1])
+                dense = numpy.zeros(prob.shape[1])
+                dense[prob.indices[row]] = prob.data[row]
+                self._samplers[key] = AliasTable(dense)
+            else:
+                self._samplers[key] = AliasTable(prob[:, origin])
+        return self._samplers[key]
+
+    def get_mode_sampler(self, is_car_user, zone):
+        """Get sampler for mode choice of agents.
+
+        Sampler is built on first use and cached until probabilities
+        are calculated again.
+
+        Parameters
+        ----------
+        is_car_user : bool
+            Whether the agent is car user or not
+        zone : int
+            Index of zone where the agent lives
+
+        Returns
+        -------
+        utils.alias_table.AliasTable
+            Sampler of mode indices (in order of purpose modes)
+        """
+        key = ("mode", bool(is_car_user), zone)
+        if key not in self._samplers:
+            self._samplers[key] = AliasTable(
+                self.calc_individual_mode_prob(is_car_user, zone))
+        return self._samplers[key]
+
     def _calc_utils(self, impedance):
+        self._samplers = {}
         self.dest_expsums = {}
         for mode in self.dest_choice_param:
             expsum = self._calc_dest_util(mode, impedance[mode])
@@ -405,7 +548,7 @@ class ModeDestModel(LogitModel):
             self.dest_expsums[mode]["logsum"] = expsum
             logsum = pandas.Series(numpy.log(expsum), self.purpose.zone_numbers)
             label = self.purpose.name + "_" + mode[0]
-            self.zone_data._values[label] = logsum
+            self.zone_data.set_data(label, logsum)
             self.resultdata.print_data(
                 logsum, "accessibility.txt",
                 self.zone_data.zone_numbers, label)
@@ -414,12 +557,26 @@ class ModeDestModel(LogitModel):
     def _calc_prob(self, mode_expsum):
         prob = {}
         self.mode_prob = {}
-        self.dest_prob = {}
         for mode in self.mode_choice_param:
             self.mode_prob[mode] = self.mode_exps[mode] / mode_expsum
             dest_expsum = self.dest_expsums[mode]["logsum"]
-            self.dest_prob[mode] = self.dest_exps[mode].T / dest_expsum
-            prob[mode] = self.mode_prob[mode] * self.dest_prob[mode]
+            dest_exps = self.dest_exps[mode]
+            if isinstance(dest_exps, SparseMatrix):
+                self.dest_prob[mode] = dest_exps.divide(dest_expsum)
+                prob[mode] = self.dest_prob[mode].multiply(self.mode_prob[mode])
+                continue
+            rows = self._changed_rows.get(mode)
+            if rows is not None and mode in self.dest_prob:
+                # Only origins with changed impedance are updated
+                self.dest_prob[mode][:, rows] = numpy.divide(
+                    dest_exps[rows].T, dest_expsum[rows],
+                    dtype=dest_exps.dtype)
+            else:
+                self.dest_prob[mode] = numpy.divide(
+                    dest_exps.T, dest_expsum, dtype=dest_exps.dtype)
+            prob[mode] = numpy.multiply(
+                self.mode_prob[mode], self.dest_prob[mode],
+                dtype=dest_exps.dtype)
         return prob
 
 
@@ -446,6 +603,8 @@ class DestModeModel(LogitModel):
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of utility and probability matrices
     """
 
     def calc_prob(self, impedance):
@@ -468,10 +627,13 @@ class DestModeModel(LogitModel):
         logsum = {"logsum": mode_expsum}
         dest_expsum = self._calc_dest_util("logsum", logsum)
         prob = {}
-        dest_prob = self.dest_exps["logsum"].T / dest_expsum
+        dest_exps = self.dest_exps["logsum"]
+        dest_prob = numpy.divide(
+            dest_exps.T, dest_expsum, dtype=dest_exps.dtype)
         for mode in self.mode_choice_param:
             mode_prob = (self.mode_exps[mode] / mode_expsum).T
-            prob[mode] = mode_prob * dest_prob
+            prob[mode] = numpy.multiply(
+                mode_prob, dest_prob, dtype=dest_exps.dtype)
         return prob
 
 
@@ -491,8 +653,15 @@ class SecDestModel(LogitModel):
         Writer object to result directory
     is_agent_model : bool (optional)
         Whether the model is used for agent-based simulation
+    dtype : numpy.dtype (optional)
+        Float type of utility and probability matrices
     """
 
+    def _init_kernels(self):
+        # Secondary destination utilities depend on both origin and
+        # primary destination, so they are not evaluated with kernels
+        pass
+
     def calc_prob(self, mode, impedance, origin, destination=None):
         """Calculate matrix of choice probabilities.
         
@@ -516,10 +685,10 @@ class SecDestModel(LogitModel):
         """
         dest_exps = self._calc_sec_dest_util(mode, impedance, origin, destination)
         try:
-            expsum = dest_exps.sum(1)
+            expsum = dest_exps.sum(1, dtype=numpy.float64)
         except ValueError:
-            expsum = dest_exps.sum()
-        prob = dest_exps.T / expsum
+            expsum = dest_exps.sum(dtype=numpy.float64)
+        prob = numpy.divide(dest_exps.T, expsum, dtype=dest_exps.dtype)
         return prob
 
 
@@ -535,6 +704,10 @@ class TourCombinationModel:
     (e.g., a two-tour combination can be hw-ho, hw-hs or ho-ho, etc.).
     Base for tour generation.
 
+    The parameter tables are compiled into arrays at construction,
+    so that probabilities for all zones and population segments
+    (age group + is car user or not) are evaluated at once.
+
     Parameters
     ----------
     zone_data : ZoneData
@@ -546,7 +719,54 @@ class TourCombinationModel:
         self.param = generation_params.tour_combinations
         self.conditions = generation_params.tour_conditions
         self.increases = generation_params.tour_number_increase
-    
+        self.combinations = []
+        nests = []
+        for nr_tours in sorted(self.param):
+            for tour_combination in sorted(self.param[nr_tours]):
+                self.combinations.append(tour_combination)
+                nests.append(nr_tours)
+        self.nr_tours = numpy.array(nests)
+        self.nests = sorted(self.param)
+        # Combination x nest indicator matrix, for nest sums
+        self._nest_matrix = (self.nr_tours[:, numpy.newaxis]
+                             == numpy.array(self.nests)).astype(float)
+        params = [self.param[n][c]
+                  for n, c in zip(self.nr_tours, self.combinations)]
+        self.constants = numpy.array([b["constant"] for b in params])
+        self.zone_variables = sorted(set(
+            i for b in params for i in b["zone"]))
+        # Zone variable x combination coefficient matrix
+        self.zone_coefficients = numpy.array(
+            [[b["zone"].get(i, 0) for b in params]
+             for i in self.zone_variables]).reshape(
+                len(self.zone_variables), len(params))
+        self.car_user_dummies = numpy.array(
+            [b["individual_dummy"].get("car_users", 0) for b in params])
+        self._dummies = [b["individual_dummy"] for b in params]
+        self._age_dummies = {}
+        self._allowed = {}
+        self.increase = numpy.array(
+            [self.increases.get(n, 1) for n in self.nests])
+        self.increase[numpy.array(self.nests) == 0] = 0
+
+    def purpose_counts(self, purposes):
+        """Get number of tours of each purpose in each combination.
+
+        Parameters
+        ----------
+        purposes : list
+            str
+                Tour purpose names (hw/hc/...)
+
+        Returns
+        -------
+        numpy.ndarray
+            Combination x purpose matrix, used for accumulating tours
+            from combination to purposes as a matrix product
+        """
+        return numpy.array([[c.count(p) for p in purposes]
+                            for c in self.combinations], float)
+
     def calc_prob(self, age_group, is_car_user, zones):
         """Calculate choice probabilities for each tour combination.
 
@@ -568,74 +788,137 @@ class TourCombinationModel:
         dict
             key : tuple of str
                 Tour combination (-/hw/hw-ho/...)
-            value : float or numpy 1-d array
+            value : float or pandas Series
                 Choice probability
         """
-        prob = {}
-        nr_tours_exps = {}
-        nr_tours_expsum = 0
-        for nr_tours in self.param:
-            # Upper level of nested logit model
-            combination_exps = {}
-            combination_expsum = 0
-            for tour_combination in self.param[nr_tours]:
-                # Lower level of nested logit model
+        prob = self.calc_segment_prob([(age_group, is_car_user)], zones)
+        if isinstance(zones, slice):
+            zone_numbers = self.zone_data.zone_numbers[zones]
+            return {c: pandas.Series(prob[:, 0, j], zone_numbers)
+                    for j, c in enumerate(self.combinations)}
+        else:
+            return {c: prob[0, 0, j]
+                    for j, c in enumerate(self.combinations)}
+
+    def calc_prob_table(self, age_groups, zones):
+        """Precompute probabilities for agent-based simulation.
+
+        Must be called again if logsums (accessibilities) change.
+
+        Parameters
+        ----------
+        age_groups : list
+            str
+                Age groups (age_7-17/age_18-29/...)
+        zones : slice
+            Zone data slice, where the agents reside
+        """
+        segments = [(age, is_car_user)
+                    for age in age_groups for is_car_user in (False, True)]
+        prob = self.calc_segment_prob(segments, zones)
+        self.prob_table = {segment: prob[:, i, :]
+                           for i, segment in enumerate(segments)}
+
+    def get_table_prob(self, age_group, is_car_user, zone_index):
+        """Get precomputed probabilities from table.
+
+        Parameters
+        ----------
+        age_group : str
+            Age group (age_7-17/age_18-29/...)
+        is_car_user : bool
+            True if is car user
+        zone_index : int
+            Index of zone where the agent lives
+
+        Returns
+        -------
+        numpy.ndarray
+            Choice probabilities in the order of `self.combinations`
+        """
+        return self.prob_table[(age_group, bool(is_car_user))][zone_index]
+
+    def calc_segment_prob(self, segments, zones):
+        """Calculate tour combination probabilities for several segments.
+
+        Parameters
+        ----------
+        segments : list
+            tuple
+                str
+                    Age group (age_7-17/age_18-29/...)
+                bool
+                    True if is car user
+        zones : int or slice
+            Zone number (for agent model) or zone data slice
+
+        Returns
+        -------
+        numpy.ndarray
+            Zone x segment x combination matrix of choice probabilities,
+            combinations are in the order of `self.combinations`
+        """
+        if isinstance(zones, slice):
+            zone_values = [numpy.asarray(self.zone_data[i][zones], float)
+                           for i in self.zone_variables]
+            nr_zones = len(self.zone_data.zone_numbers[zones])
+        else:
+            zone_index = self.zone_data.zone_index(zones)
+            zone_values = [[self.zone_data[i][zone_index]]
+                           for i in self.zone_variables]
+            nr_zones = 1
+        zone_util = self.constants + numpy.dot(
+            numpy.array(zone_values, float).reshape(-1, nr_zones).T,
+            self.zone_coefficients)
+        segment_util = numpy.array(
+            [self._age_dummy(age) + is_car_user*self.car_user_dummies
+             for age, is_car_user in segments])
+        allowed = numpy.array([self._is_allowed(age) for age, _ in segments])
+        # Lower level of nested logit model
+        exps = numpy.exp(zone_util[:, numpy.newaxis, :] + segment_util)
+        exps *= allowed
+        nest_expsums = numpy.dot(exps, self._nest_matrix)
+        combination_expsums = nest_expsums[:, :, self.nr_tours]
+        # Specifically, no 4-tour patterns are allowed for 7-17-year-olds,
+        # so sum will be zero in this case and probabilities are zero
+        prob = numpy.divide(
+            exps, combination_expsums, out=numpy.zeros_like(exps),
+            where=combination_expsums > 0)
+        # Upper level of nested logit model
+        scale_param = generation_params.tour_number_scale
+        nr_tours_exps = numpy.power(nest_expsums, scale_param)
+        nr_tours_prob = nr_tours_exps / nr_tours_exps.sum(2)[:, :, numpy.newaxis]
+        # Tour number probability is calibrated
+        nr_tours_prob *= self.increase
+        # Probability of no tours at all (empty tuple) is deduced from
+        # other combinations (after calibration)
+        nr_tours_prob[:, :, self.nests.index(0)] = 1 - nr_tours_prob.sum(2)
+        # Upper and lower level probabilities are combined
+        no_tours = self.nr_tours == 0
+        prob[:, :, no_tours] = 1
+        prob *= nr_tours_prob[:, :, self.nr_tours]
+        return prob
+
+    def _age_dummy(self, age_group):
+        if age_group not in self._age_dummies:
+            self._age_dummies[age_group] = numpy.array(
+                [b.get(age_group, 0) for b in self._dummies])
+        return self._age_dummies[age_group]
+
+    def _is_allowed(self, age_group):
+        if age_group not in self._allowed:
+            allowed = numpy.ones(len(self.combinations))
+            for j, tour_combination in enumerate(self.combinations):
                 if tour_combination in self.conditions:
-                    if self.conditions[tour_combination][0]:
+                    is_exclusive, group = self.conditions[tour_combination]
+                    if is_exclusive:
                         # If this tour pattern is exclusively for one age group
-                        if age_group == self.conditions[tour_combination][1]:
-                            is_allowed = True
-                        else:
-                            is_allowed = False
+                        allowed[j] = age_group == group
                     else:
                         # If one age group is excluded from this tour pattern
-                        if age_group == self.conditions[tour_combination][1]:
-                            is_allowed = False
-                        else:
-                            is_allowed = True
-                else:
-                    is_allowed = True
-                if is_allowed:
-                    param = self.param[nr_tours][tour_combination]
-                    util = 0
-                    util += param["constant"]
-                    for i in param["zone"]:
-                        util += param["zone"][i] * self.zone_data[i][zones]
-                    dummies = param["individual_dummy"]
-                    if age_group in dummies:
-                        util += dummies[age_group]
-                    if is_car_user and "car_users" in dummies:
-                        util += dummies["car_users"]
-                    combination_exps[tour_combination] = numpy.exp(util)
-                else:
-                    combination_exps[tour_combination] = 0
-                combination_expsum += combination_exps[tour_combination]
-            for tour_combination in self.param[nr_tours]:
-                try:
-                    prob[tour_combination] = ( combination_exps[tour_combination]
-                                             / combination_expsum)
-                except ZeroDivisionError:
-                    # Specifically, no 4-tour patterns are allowed for
-                    # 7-17-year-olds, so sum will be zero in this case
-                    prob[tour_combination] = 0
-            util = 0
-            nr_tours_exps[nr_tours] = numpy.exp(util)
-            scale_param = generation_params.tour_number_scale
-            nr_tours_exps[nr_tours] *= numpy.power(combination_expsum, scale_param)
-            nr_tours_expsum += nr_tours_exps[nr_tours]
-        # Probability of no tours at all (empty tuple) is deduced from
-        # other combinations (after calibration)
-        prob[()] = 1
-        for nr_tours in self.param:
-            if nr_tours != 0:
-                nr_tours_prob = nr_tours_exps[nr_tours] / nr_tours_expsum
-                # Tour number probability is calibrated
-                nr_tours_prob *= self.increases[nr_tours]
-                prob[()] -= nr_tours_prob
-                for tour_combination in self.param[nr_tours]:
-                    # Upper and lower level probabilities are combined
-                    prob[tour_combination] *= nr_tours_prob
-        return prob
+                        allowed[j] = age_group != group
+            self._allowed[age_group] = allowed
+        return self._allowed[age_group]
 
 
 class CarUseModel(LogitModel):
@@ -761,11 +1044,44 @@ class CarUseModel(LogitModel):
         prob = exp / (exp+1)
         return prob
 
+    def calc_prob_table(self):
+        """Precompute individual probabilities for all segments.
+
+        Uses results from previously run `calc_basic_prob()`.
+        """
+        self.prob_table = {}
+        for age_group in self.age_groups:
+            age = "age_{}-{}".format(*age_group)
+            for gender in self.genders:
+                self.prob_table[(age, gender)] = self.calc_individual_prob(
+                    age, gender)
+
+    def get_table_prob(self, age_group, gender, zone_index):
+        """Get precomputed car user probability from table.
+
+        Parameters
+        ----------
+        age_group : str
+            Agent age group
+        gender : str
+            Agent gender (female/male)
+        zone_index : int
+            Index of zone where the agent lives
+
+        Returns
+        -------
+        float
+            Choice probability
+        """
+        return self.prob_table[(age_group, gender)][zone_index]
+
     def print_results(self, prob):
         """ Print results, mainly for calibration purposes"""
         population = self.zone_data["population"]
-        population_7_99 = ( population[:self.zone_data.first_peripheral_zone]
-                          * self.zone_data["share_age_7-99"] )
+        population_7_99 = pandas.Series(
+            population[:self.zone_data.first_peripheral_zone]
+                * self.zone_data["share_age_7-99"],
+            self.zone_data.zone_numbers[:self.zone_data.first_peripheral_zone])
         car_users = prob * population_7_99
                 
         # Print car user share by zone
@@ -789,3 +1105,14 @@ class CarUseModel(LogitModel):
             self.resultdata.print_data(
                 prob_area, "car_use_per_{}.txt".format(area_type),
                 intervals.keys(), "car_use")
+
+
+def _add_data(utility, b, data):
+    """Add zone data multiplied by parameter to utility (in place).
+
+    Compound data is added without creating the full matrix.
+    """
+    if isinstance(data, CompoundData):
+        data.add_to(utility, b)
+    else:
+        utility += b * data
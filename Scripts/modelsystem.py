@@ -1,6 +1,11 @@
+import array
+import Queue
 import threading
 import multiprocessing
 import os
+import shutil
+import sys
+import tempfile
 import numpy
 import pandas
 
@@ -13,9 +18,12 @@ from demand.freight import FreightModel
 from demand.trips import DemandModel
 from demand.external import ExternalModel
 from datatypes.purpose import SecDestPurpose
+from datatypes.tour import Tour
 from transform.impedance_transformer import ImpedanceTransformer
 from models.linear import CarDensityModel
+from utils.running_stats import RunningStats
 import parameters.assignment as param
+import parameters.zone as zone_param
 
 
 class ModelSystem:
@@ -36,20 +44,42 @@ class ModelSystem:
         can be EmmeAssignmentModel or MockAssignmentModel
     name : str
         Name of scenario, used for results subfolder
+    use_single_precision : bool (optional)
+        Whether demand is calculated and accumulated in float32,
+        logsums are accumulated in float64 in any case
+    incremental_tolerance : float (optional)
+        If set, destination utilities are recomputed only for origins
+        where some transformed impedance has changed (relatively) more
+        than this since previous iteration
+    zone_data_snapshot_path : str (optional)
+        Directory path where snapshots of parsed zone data are stored,
+        if not given, zone data input files are always parsed
+    use_factorized_demand : bool (optional)
+        Whether daily demand is split into time periods only
+        when demand is assigned
     """
 
     def __init__(self, zone_data_path, base_zone_data_path, base_matrices_path,
-                 results_path, assignment_model, name):
+                 results_path, assignment_model, name,
+                 use_single_precision=False, incremental_tolerance=None,
+                 zone_data_snapshot_path=None, use_factorized_demand=False):
+        if use_single_precision:
+            self.dtype = numpy.float32
+        else:
+            self.dtype = numpy.float64
+        self.incremental_tolerance = incremental_tolerance
         self.ass_model = assignment_model
-        self.zone_numbers = self.ass_model.zone_numbers
+        # Zone system is shared by all sub-models
+        self.zone_system = self.ass_model.zone_system
+        self.zone_numbers = self.zone_system.zone_numbers
         self.emme_scenarios = self.ass_model.emme_scenarios
 
         # Input data
         self.zdata_base = BaseZoneData(
-            base_zone_data_path, self.zone_numbers)
+            base_zone_data_path, self.zone_system, zone_data_snapshot_path)
         self.basematrices = MatrixData(base_matrices_path)
         self.zdata_forecast = ZoneData(
-            zone_data_path, self.zone_numbers)
+            zone_data_path, self.zone_system, zone_data_snapshot_path)
 
         # Set dist unit cost from zonedata
         self.ass_model.dist_unit_cost = self.zdata_forecast.car_dist_cost
@@ -65,8 +95,9 @@ class ModelSystem:
         self.em = ExternalModel(
             self.basematrices, self.zdata_forecast, self.zone_numbers)
         self.dtm = dt.DepartureTimeModel(
-            self.ass_model.nr_zones, self.emme_scenarios)
-        self.imptrans = ImpedanceTransformer()
+            self.ass_model.nr_zones, self.emme_scenarios, self.dtype,
+            factorized=use_factorized_demand)
+        self.imptrans = ImpedanceTransformer(self.dtype)
         bounds = slice(0, self.zdata_forecast.nr_zones)
         self.cdm = CarDensityModel(
             self.zdata_base, self.zdata_forecast, bounds, self.resultdata)
@@ -75,7 +106,9 @@ class ModelSystem:
         self.trailer_trucks = self.fm.calc_freight_traffic("trailer_truck")
 
     def _init_demand_model(self):
-        return DemandModel(self.zdata_forecast, self.resultdata, is_agent_model=False)
+        return DemandModel(
+            self.zdata_forecast, self.resultdata, is_agent_model=False,
+            dtype=self.dtype, incremental_tolerance=self.incremental_tolerance)
 
     def _add_internal_demand(self, previous_iter_impedance, is_last_iteration):
         """Produce mode-specific demand matrices.
@@ -107,6 +140,8 @@ class ModelSystem:
             else:
                 purpose.calc_prob(
                     self.imptrans.transform(purpose, previous_iter_impedance))
+                if self.incremental_tolerance is not None:
+                    self._log_recomputed_rows(purpose)
         
         # Tour generation
         self.dm.generate_tours()
@@ -133,6 +168,13 @@ class ModelSystem:
                         self.travel_modes.add(mode)
         log.info("Demand calculation completed")
 
+    def _log_recomputed_rows(self, purpose):
+        rows = purpose.model.recomputed_rows
+        log.info("Destination utilities recomputed for {} origins: {}".format(
+            purpose.name, ", ".join(
+                "{} {}/{}".format(mode, rows[mode], len(purpose.zone_numbers))
+                for mode in sorted(rows))))
+
     # possibly merge with init
     def assign_base_demand(self, use_fixed_transit_cost=False, is_end_assignment=False):
         """Assign base demand to network (before first iteration).
@@ -162,7 +204,7 @@ class ModelSystem:
         self.ass_model.prepare_network()
 
         # Calculate transit cost matrix, and save it to emmebank
-        with self.basematrices.open("demand", "aht", self.ass_model.zone_numbers) as mtx:
+        with self.basematrices.open("demand", "aht", self.zone_system) as mtx:
             base_demand = {ass_class: mtx[ass_class] for ass_class in param.transport_classes}
         self.ass_model.assign("aht", base_demand, iteration="init")
         if use_fixed_transit_cost:
@@ -182,7 +224,7 @@ class ModelSystem:
         demand = self.resultmatrices if is_end_assignment else self.basematrices
         for tp in self.emme_scenarios:
             log.info("Assigning period " + tp)
-            with demand.open("demand", tp, self.ass_model.zone_numbers) as mtx:
+            with demand.open("demand", tp, self.zone_system) as mtx:
                 for ass_class in param.transport_classes:
                     self.dtm.demand[tp][ass_class] = mtx[ass_class]
             impedance[tp] = self.ass_model.assign(
@@ -235,9 +277,7 @@ class ModelSystem:
         self.dtm.add_demand(self.trailer_trucks)
 
         # Update car density
-        prediction = self.cdm.predict()
-        self.zdata_forecast["car_density"] = prediction
-        self.zdata_forecast["cars_per_1000"] = 1000 * prediction
+        self._update_car_density()
 
         # Calculate internal demand
         self._add_internal_demand(previous_iter_impedance, iteration=="last")
@@ -286,16 +326,21 @@ class ModelSystem:
         return impedance
 
     def _save_to_omx(self, impedance, tp):
-        zone_numbers = self.ass_model.zone_numbers
-        with self.resultmatrices.open("demand", tp, zone_numbers, 'w') as mtx:
+        zone_system = self.zone_system
+        with self.resultmatrices.open("demand", tp, zone_system, 'w') as mtx:
             for ass_class in self.dtm.demand[tp]:
                 mtx[ass_class] = self.dtm.demand[tp][ass_class]
             log.info("Saved demand matrices for " + str(tp))
         for mtx_type in impedance:
-            with self.resultmatrices.open(mtx_type, tp, zone_numbers, 'w') as mtx:
+            with self.resultmatrices.open(mtx_type, tp, zone_system, 'w') as mtx:
                 for ass_class in impedance[mtx_type]:
                     mtx[ass_class] = impedance[mtx_type][ass_class]
 
+    def _update_car_density(self):
+        prediction = self.cdm.predict()
+        self.zdata_forecast["car_density"] = prediction
+        self.zdata_forecast["cars_per_1000"] = 1000 * prediction
+
     def _sum_trips_per_zone(self, mode):
         int_demand = numpy.zeros(self.zdata_base.nr_zones)
         for purpose in self.dm.tour_purposes:
@@ -309,42 +354,112 @@ class ModelSystem:
         return int_demand
 
     def _distribute_sec_dests(self, purpose, mode, impedance):
-        threads = []
-        demand = []
-        nr_threads = param.performance_settings["number_of_processors"]
-        if nr_threads == "max":
-            nr_threads = multiprocessing.cpu_count()
-        elif nr_threads <= 0:
-            nr_threads = 1
+        """Distribute secondary destinations of tours from all origins.
+
+        Origins are split into chunks, which are handled in a pool of
+        worker processes, if several processors are available.
+        Generated tours and impedance are passed to workers as
+        memory-mapped .npy files, and zone data is pickled, so workers
+        can be spawned (as on Windows) as well as forked. Workers
+        rebuild the purpose once, when they are started, and return
+        demand only for destinations with some demand. Results are
+        added in chunk order as they arrive. With one processor,
+        origins are handled in threads, which pass demand and
+        attracted tours of each block of origins to this thread, the
+        only one writing to the accumulated demand and attracted
+        tours. Thus memory use does not depend on the number of
+        processes or threads. As all tours have same purpose and mode,
+        demand is summed over origins first and split into time
+        periods once.
+        """
+        nr_processes = _get_nr_processes()
         bounds = next(iter(purpose.sources)).bounds
-        split = (bounds.stop-bounds.start) // nr_threads
-        for i in range(0, nr_threads):
-            # Take a chunk of destinations, for which this thread
-            # will calculate secondary destinations
-            start = bounds.start + i*split
-            if i+1 < nr_threads:
-                dests = range(start, start + split)
-            else:
-                dests = range(start, bounds.stop)
-            # Results will be saved in a temp dtm, to avoid memory clashes
-            dtm = dt.DepartureTimeModel(self.ass_model.nr_zones, self.emme_scenarios)
-            demand.append(dtm)
-            thread = threading.Thread(
-                target=self._distribute_tours,
-                args=(dtm, purpose, mode, impedance, dests))
-            threads.append(thread)
-            thread.start()
-        for thread in threads:
-            thread.join()
-        for dtm in demand:
-            for tp in dtm.demand:
-                for ass_class in dtm.demand[tp]:
-                    self.dtm.demand[tp][ass_class] += dtm.demand[tp][ass_class]
-
-    def _distribute_tours(self, container, purpose, mode, impedance, dests):
-        for i in dests:
-            demand = purpose.distribute_tours(mode, impedance[mode], i)
-            container.add_demand(demand)
+        origins = numpy.arange(bounds.start, bounds.stop)
+        sec_dest_demand, return_demand = _init_sec_dest_demand(
+            impedance[mode], bounds.stop - bounds.start)
+        if nr_processes > 1:
+            # Several chunks per process, to keep results small
+            chunks = numpy.array_split(
+                origins, max(min(SEC_DEST_CHUNKS_PER_PROCESS*nr_processes,
+                                 origins.size), 1))
+            tmp_dir = tempfile.mkdtemp(prefix="sec_dest_")
+            try:
+                paths = {}
+                arrays = dict(impedance[mode], tours=purpose.tours[mode])
+                for key in arrays:
+                    paths[key] = os.path.join(tmp_dir, key + ".npy")
+                    numpy.save(paths[key], arrays[key])
+                pool = multiprocessing.Pool(
+                    nr_processes, _init_sec_dest_worker,
+                    (purpose.name, mode, purpose.model.dtype,
+                     purpose.zone_data, paths))
+                try:
+                    # Chunk results are reduced in fixed order
+                    for block in pool.imap(
+                            _distribute_sec_dest_chunk, chunks):
+                        if block is not None:
+                            _add_sec_dest_block(
+                                purpose, mode, sec_dest_demand,
+                                return_demand, bounds.start, block)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            # Queue size limits the number of blocks in memory
+            results = Queue.Queue(maxsize=2*nr_processes)
+            cancel = threading.Event()
+            threads = []
+            try:
+                for chunk in numpy.array_split(origins, nr_processes):
+                    thread = threading.Thread(
+                        target=self._distribute_tours,
+                        args=(results, cancel, purpose, mode, impedance,
+                              chunk))
+                    thread.daemon = True
+                    threads.append(thread)
+                    thread.start()
+                nr_finished = 0
+                while nr_finished < len(threads):
+                    block = results.get()
+                    if block is None:
+                        nr_finished += 1
+                    elif isinstance(block, _ThreadError):
+                        exc_type, exc_value, traceback = block.exc_info
+                        raise exc_type, exc_value, traceback
+                    else:
+                        _add_sec_dest_block(
+                            purpose, mode, sec_dest_demand, return_demand,
+                            bounds.start, block)
+            finally:
+                # If loop was interrupted, threads still running are
+                # stopped, and queue drained so that no thread is left
+                # blocking on a full queue
+                cancel.set()
+                while any(thread.is_alive() for thread in threads):
+                    try:
+                        results.get(timeout=0.1)
+                    except Queue.Empty:
+                        pass
+                for thread in threads:
+                    thread.join()
+        self.dtm.add_sec_dest_demand(
+            purpose, mode, sec_dest_demand, return_demand, bounds.start)
+
+    def _distribute_tours(self, results, cancel, purpose, mode, impedance,
+                          origins):
+        try:
+            for block in purpose.distribute_tours(
+                    mode, impedance[mode], origins):
+                if cancel.is_set():
+                    break
+                results.put(block)
+        except Exception:
+            # Exception is re-raised in main thread
+            results.put(_ThreadError(sys.exc_info()))
+        finally:
+            results.put(None)
 
     def _update_ratios(self, impedance, tp):
         """Calculate time and cost ratios.
@@ -386,7 +501,7 @@ class ModelSystem:
 class AgentModelSystem(ModelSystem):
     """Object keeping track of all sub-models and tasks in agent model system.
 
-    Agents are added one-by-one to departure time model,
+    Agent tours are added in one batch to departure time model,
     where they are (so far) split in deterministic fractions.
     
     Parameters
@@ -404,10 +519,56 @@ class AgentModelSystem(ModelSystem):
         can be EmmeAssignmentModel or MockAssignmentModel
     name : str
         Name of scenario, used for results subfolder
+    use_single_precision : bool (optional)
+        Whether aggregate demand is calculated and accumulated in float32,
+        agent choice probabilities are always in float64
+    incremental_tolerance : float (optional)
+        If set, destination utilities are recomputed only for origins
+        where some transformed impedance has changed (relatively) more
+        than this since previous iteration
+    keep_tour_combinations : bool (optional)
+        Whether agents keep their tour combinations between iterations,
+        so that only mode and destination choices are drawn again
+    seed : int (optional)
+        Seed for population creation and for random number streams
+        of agent simulation
+    sampling_rate : float (optional)
+        Share of residents included as agents, agent tours are
+        expanded with inverse of sampling rate
+    zone_data_snapshot_path : str (optional)
+        Directory path where snapshots of parsed zone data are stored,
+        if not given, zone data input files are always parsed
+    use_factorized_demand : bool (optional)
+        Whether daily demand is split into time periods only
+        when demand is assigned
+
+    The synthetic population is created in first iteration and kept
+    for the rest of the run. Set `regenerate_population` to True
+    to create a new population in next iteration.
     """
 
+    def __init__(self, zone_data_path, base_zone_data_path, base_matrices_path,
+                 results_path, assignment_model, name,
+                 use_single_precision=False, incremental_tolerance=None,
+                 keep_tour_combinations=False, seed=None, sampling_rate=1,
+                 zone_data_snapshot_path=None, use_factorized_demand=False):
+        self.keep_tour_combinations = keep_tour_combinations
+        self.seed = seed
+        self.sampling_rate = sampling_rate
+        self.sampling_error = []
+        self._nr_simulations = 0
+        self._nr_agent_processes = None
+        self.regenerate_population = False
+        ModelSystem.__init__(
+            self, zone_data_path, base_zone_data_path, base_matrices_path,
+            results_path, assignment_model, name, use_single_precision,
+            incremental_tolerance, zone_data_snapshot_path,
+            use_factorized_demand)
+
     def _init_demand_model(self):
-        return DemandModel(self.zdata_forecast, self.resultdata, is_agent_model=True)
+        return DemandModel(
+            self.zdata_forecast, self.resultdata, is_agent_model=True,
+            incremental_tolerance=self.incremental_tolerance)
 
     def _add_internal_demand(self, previous_iter_impedance, is_last_iteration):
         """Produce tours and add fractions of them
@@ -427,9 +588,19 @@ class AgentModelSystem(ModelSystem):
             If this is the last iteration, 
             secondary destinations are calculated for all modes
         """
-        log.info("Creating synthetic population")
-        # TODO Split agent creation and car usership
-        self.dm.create_population()
+        if self.dm.population is None or self.regenerate_population:
+            log.info("Creating synthetic population")
+            if self.seed is None:
+                random_state = numpy.random
+            else:
+                random_state = numpy.random.RandomState(self.seed)
+            self.dm.create_population(
+                self.keep_tour_combinations, self.sampling_rate,
+                random_state)
+            self.regenerate_population = False
+        else:
+            log.info("Updating car users of synthetic population")
+            self.dm.update_population()
         log.info("Demand calculation started...")
         self.travel_modes = set()
         for purpose in self.dm.tour_purposes:
@@ -450,16 +621,504 @@ class AgentModelSystem(ModelSystem):
                 else:
                     purpose.init_sums()
                     purpose.model.calc_basic_prob(purpose_impedance)
+                if self.incremental_tolerance is not None:
+                    self._log_recomputed_rows(purpose)
+        self.dm.calc_tour_prob_table()
         purpose_impedance = self.imptrans.transform(
             self.dm.purpose_dict["hoo"], previous_iter_impedance)
         log.info("Assigning mode and destination for {} agents".format(
             len(self.dm.population)))
-        for person in self.dm.population:
-            person.add_tours(self.dm.purpose_dict)
+        self._simulate_agents(purpose_impedance)
+        log.info("Demand calculation completed")
+
+    def run_replications(self, previous_iter_impedance, nr_replications,
+                         z=1.96):
+        """Run independently seeded replications of agent simulation.
+
+        Internal demand is calculated `nr_replications` times with
+        same zone data and impedance, each time with a new population
+        and new random number streams. Replications are run in a pool
+        of forked processes (if available, not on Windows), and
+        their results are aggregated as they arrive, so only mean
+        and variance are kept in memory. Demand of each replication
+        is aggregated as one array (`DepartureTimeModel.tensor`). Per-zone confidence intervals of tours by mode
+        are written to "replication_demand.txt" in results.
+
+        Parameters
+        ----------
+        previous_iter_impedance : dict
+            key : str
+                Assignment class (car/transit/bike/walk)
+            value : dict
+                key : str
+                    Impedance type (time/cost/dist)
+                value : numpy.ndarray
+                    Impedance (float 2-d matrix)
+        nr_replications : int
+            Number of replications
+        z : float (optional)
+            Standard normal quantile for confidence intervals
+            (default is 1.96, for 95 % confidence)
+
+        Returns
+        -------
+        dict
+            Time period (aht/pt/iht) : dict
+                Assignment class (car_work/...) : RunningStats
+                    Mean and variance of demand matrix
+        dict
+            Mode (car/transit/bike/walk) : RunningStats
+                Mean and variance of tours per zone
+        """
+        global _replication
+        if self.seed is None:
+            base_seed = numpy.random.randint(2**31 - 1)
+        else:
+            base_seed = self.seed
+        seeds = [numpy.random.RandomState([base_seed, i]).randint(2**31 - 1)
+                 for i in range(nr_replications)]
+        nr_processes = max(min(_get_nr_processes(), nr_replications), 1)
+        self._update_car_density()
+        state = (self.seed, self.dm.population, self._nr_simulations)
+        _replication = (self, previous_iter_impedance)
+        tensor_stats = RunningStats()
+        trip_stats = {}
+        if nr_processes > 1 and _can_fork("Replications"):
+            pool = multiprocessing.Pool(nr_processes)
+            # Results are aggregated in replication order
+            results = pool.imap(_run_replication, seeds)
+        else:
+            pool = None
+            results = (_run_replication(seed) for seed in seeds)
+        try:
+            for i, (demand, trip_sum) in enumerate(results):
+                log.info("Replication {} of {} completed".format(
+                    i + 1, nr_replications))
+                tensor_stats.add(demand)
+                for mode in trip_sum:
+                    trip_stats.setdefault(mode, RunningStats()).add(
+                        trip_sum[mode])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _replication = None
+            self.seed, self.dm.population, self._nr_simulations = state
+            self._nr_agent_processes = None
+            self.dtm.init_demand()
+        demand_stats = {}
+        for i, tp in enumerate(self.dtm.time_periods):
+            demand_stats[tp] = {
+                ass_class: tensor_stats[i, j]
+                for j, ass_class in enumerate(param.transport_classes)}
+        for mode in sorted(trip_stats):
+            stats = trip_stats[mode]
+            lower, upper = stats.confidence_interval(z)
+            filename = "replication_demand.txt"
+            zone_numbers = self.zdata_base.zone_numbers
+            self.resultdata.print_data(
+                stats.mean, filename, zone_numbers, mode + "_mean")
+            self.resultdata.print_data(
+                lower, filename, zone_numbers, mode + "_lower")
+            self.resultdata.print_data(
+                upper, filename, zone_numbers, mode + "_upper")
+        return demand_stats, trip_stats
+
+    def _run_replication(self, seed, impedance):
+        """Calculate internal demand with new population and seed.
+
+        Returns
+        -------
+        numpy.ndarray
+            Demand of all time periods and assignment classes,
+            from `DepartureTimeModel.tensor`
+        dict
+            Mode (car/transit/bike/walk) : numpy.ndarray
+                Tours per zone
+        """
+        self.seed = seed
+        self.regenerate_population = True
+        # Each replication is simulated in one process, with
+        # random number streams that depend only on seed
+        self._nr_agent_processes = 1
+        self._nr_simulations = 0
+        self.dtm.init_demand()
+        self._add_internal_demand(impedance, False)
+        modes = set()
+        for purpose in self.dm.tour_purposes:
+            modes.update(purpose.modes)
+        trip_sum = {mode: self._sum_trips_per_zone(mode) for mode in modes}
+        # Factorized demand is added to tensor in place
+        self.dtm.materialize()
+        return self.dtm.tensor, trip_sum
+
+    def _simulate_agents(self, impedance):
+        """Choose tours, modes and destinations for all agents.
+
+        Population is split into shards of whole home zones. Each shard
+        has its own random number stream, derived from `self.seed`
+        (or from global numpy random state, if seed is not set), so
+        results are identical for same seed and number of processes.
+        Shards are simulated in a pool of forked processes, if several
+        processors are available and the platform supports forking
+        (not Windows, where shards are simulated one after another).
+
+        Parameters
+        ----------
+        impedance : dict
+            Mode (car/transit/bike/walk) : dict
+                Type (time/cost/dist) : numpy 2d matrix
+        """
+        global _agent_simulation
+        population = self.dm.population
+        if self._nr_agent_processes is None:
+            nr_processes = _get_nr_processes()
+        else:
+            nr_processes = self._nr_agent_processes
+        nr_processes = max(min(nr_processes, len(population)), 1)
+        if self.seed is None:
+            base_seed = numpy.random.randint(2**31 - 1)
+        else:
+            base_seed = self.seed
+        # Shard bounds are moved to start of zone
+        cuts = numpy.linspace(0, len(population), nr_processes + 1)
+        cuts = numpy.searchsorted(
+            population.zone_index,
+            population.zone_index[numpy.minimum(
+                cuts[1:-1].astype(int), len(population) - 1)])
+        bounds = numpy.r_[0, cuts, len(population)]
+        shards = []
+        for i in range(nr_processes):
+            seed = numpy.random.RandomState(
+                [base_seed, self._nr_simulations, i]).randint(2**31 - 1)
+            shards.append((bounds[i], bounds[i+1], seed))
+        self._nr_simulations += 1
+        _agent_simulation = (self, impedance)
+        if nr_processes > 1 and _can_fork("Agent simulation"):
+            pool = multiprocessing.Pool(nr_processes)
+            try:
+                results = pool.map(_simulate_agent_shard, shards)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_simulate_agent_shard, shards)
+        _agent_simulation = None
+        # Shard results are reduced in fixed order
+        sampling_sums = {}
+        for (start, stop, _), result in zip(shards, results):
+            tour_demand, tour_counts, tour_combinations, sums = result
+            self.dtm.add_tour_demand(tour_demand)
+            for key in sums:
+                sampling_sums[key] = sampling_sums.get(key, 0) + sums[key]
+            for purpose in self.dm.tour_purposes:
+                generated, attracted = tour_counts[purpose.name]
+                for mode in generated:
+                    purpose.generated_tours[mode] += generated[mode]
+                for mode in attracted:
+                    purpose.attracted_tours[mode] += attracted[mode]
+            population.tour_combination[start:stop] = tour_combinations
+        self._log_sampling_error(sampling_sums)
+
+    def _log_sampling_error(self, sums):
+        """Estimate sampling error of agent tour mode shares.
+
+        Mode share is a ratio estimator with persons as sampling units,
+        its variance is estimated with linearization (including
+        finite population correction). Result is appended to
+        `self.sampling_error` and logged if population is sampled.
+
+        Parameters
+        ----------
+        sums : dict
+            Sums over sampled persons, from `_calc_sampling_sums()`
+        """
+        n = sums.get("n", 0)
+        rate = self.dm.population.sampling_rate
+        errors = {}
+        for key in sums:
+            if key[0] != "y":
+                continue
+            mode = key[1]
+            share = sums[key] / sums["x"]
+            if n > 1:
+                residuals = (sums[("yy", mode)] - 2*share*sums[("xy", mode)]
+                             + share**2*sums["xx"])
+                variance = ((1-rate) * n / (n-1) * max(residuals, 0)
+                            / sums["x"]**2)
+            else:
+                variance = 0
+            errors[mode] = (share, numpy.sqrt(variance))
+        self.sampling_error.append(errors)
+        if rate < 1:
+            for mode in sorted(errors):
+                log.info("Agent {} share {:.4f} (standard error {:.4f})".format(
+                    mode, *errors[mode]))
+
+    def _calc_sampling_sums(self, persons, modes, weights):
+        """Calculate sums needed for sampling error of mode shares.
+
+        Parameters
+        ----------
+        persons : numpy.ndarray
+            Index of person making each tour (within shard)
+        modes : numpy.ndarray
+            Mode of each tour
+        weights : numpy.ndarray
+            Expansion weight of each person
+
+        Returns
+        -------
+        dict
+            "n" : Number of persons
+            "x"/"xx" : Sum of expanded tours (squared) per person
+            ("y"/"xy"/"yy", mode) : Sums of expanded tours with mode,
+                squared and multiplied with all tours
+        """
+        x = weights * numpy.bincount(persons, minlength=weights.size)
+        sums = {
+            "n": weights.size,
+            "x": x.sum(),
+            "xx": (x**2).sum(),
+        }
+        for mode in numpy.unique(modes):
+            y = weights * numpy.bincount(
+                persons[modes == mode], minlength=weights.size)
+            sums[("y", mode)] = y.sum()
+            sums[("xy", mode)] = (x*y).sum()
+            sums[("yy", mode)] = (y**2).sum()
+        return sums
+
+    def _simulate_shard(self, start, stop, seed, impedance):
+        """Choose tours, modes and destinations for a range of agents.
+
+        Returns
+        -------
+        dict
+            Demand of shard tours, from `DepartureTimeModel.calc_tour_demand`
+        dict
+            Purpose name : tuple
+                dict
+                    Mode : Generated tours in shard
+                dict
+                    Mode : Attracted tours in shard
+        numpy.ndarray
+            Tour combination indices of shard persons
+        dict
+            Sums for sampling error, from `_calc_sampling_sums()`
+        """
+        # Shard has its own random number stream, global state
+        # of this process is not changed
+        random_state = numpy.random.RandomState(seed)
+        # Secondary destination draws depend on sampler cache,
+        # so each shard starts with empty cache, as in forked workers
+        for purpose in self.dm.tour_purposes:
+            if isinstance(purpose, SecDestPurpose):
+                purpose.reset_samplers()
+        tour_counts = self._swap_tour_counts()
+        purpose_names = [purpose.name for purpose in self.dm.tour_purposes]
+        purpose_codes = {name: i for i, name in enumerate(purpose_names)}
+        # Tours are stored compactly, as integer codes and zone indices
+        purposes = array.array("b")
+        modes = array.array("b")
+        persons = array.array("l")
+        origins = array.array("l")
+        dests = array.array("l")
+        sec_dests = array.array("l")
+        population = self.dm.population
+        for i in range(start, stop):
+            person = population[i]
+            person.add_tours(self.dm.purpose_dict, random_state)
             for tour in person.tours:
-                tour.choose_mode(person.is_car_user)
-                tour.choose_destination(purpose_impedance)
+                tour.choose_mode(person.is_car_user, random_state)
+                tour.choose_destination(impedance, random_state)
                 if tour.mode == "car":
-                    tour.choose_driver()
-                self.dtm.add_demand(tour)
-        log.info("Demand calculation completed")
+                    tour.choose_driver(random_state)
+                purposes.append(purpose_codes[tour.purpose.name])
+                modes.append(tour.mode_code)
+                persons.append(i - start)
+                origins.append(tour.orig_index)
+                dests.append(tour.dest_index)
+                sec_dests.append(tour.sec_dest_index)
+        sec_dest_purposes = {}
+        for purpose in self.dm.tour_purposes:
+            try:
+                sec_dest_purposes[purpose.name] = purpose.sec_dest_purpose.name
+            except AttributeError:
+                pass
+        purposes = numpy.array(purpose_names)[numpy.frombuffer(purposes, "i1")]
+        modes = numpy.array(Tour.MODES)[numpy.frombuffer(modes, "i1")]
+        persons = numpy.frombuffer(persons, numpy.int_)
+        weights = population.weight[start:stop]
+        tour_demand = self.dtm.calc_tour_demand(
+            purposes, modes, numpy.frombuffer(origins, numpy.int_),
+            numpy.frombuffer(dests, numpy.int_),
+            numpy.frombuffer(sec_dests, numpy.int_), sec_dest_purposes,
+            weights[persons])
+        sampling_sums = self._calc_sampling_sums(persons, modes, weights)
+        return (tour_demand, self._swap_tour_counts(tour_counts),
+                population.tour_combination[start:stop], sampling_sums)
+
+    def _swap_tour_counts(self, tour_counts=None):
+        """Swap generated and attracted tour counts of purposes.
+
+        If no counts are given, zero counts are swapped in.
+        Returns counts swapped out.
+        """
+        swapped = {}
+        for purpose in self.dm.tour_purposes:
+            swapped[purpose.name] = (
+                purpose.generated_tours, purpose.attracted_tours)
+            if tour_counts is None:
+                purpose.generated_tours = {
+                    mode: numpy.zeros_like(tours)
+                    for mode, tours in purpose.generated_tours.items()}
+                purpose.attracted_tours = {
+                    mode: numpy.zeros_like(tours)
+                    for mode, tours in purpose.attracted_tours.items()}
+            else:
+                (purpose.generated_tours,
+                 purpose.attracted_tours) = tour_counts[purpose.name]
+        return swapped
+
+
+# Agent model system and impedance used in agent simulation
+# and replications, set before worker processes are forked
+# so that they inherit them
+_agent_simulation = None
+_replication = None
+# Secondary destination purpose, mode and impedance,
+# set in worker process initialization
+_sec_dest_distribution = None
+# Number of origin chunks per worker process in secondary
+# destination distribution
+SEC_DEST_CHUNKS_PER_PROCESS = 4
+# Tasks for which a warning about missing fork has been logged
+_fork_warnings = set()
+
+
+def _init_sec_dest_worker(purpose_name, mode, dtype, zone_data, paths):
+    """Rebuild secondary destination purpose in worker process.
+
+    Parameters
+    ----------
+    purpose_name : str
+        Name of secondary destination purpose (hoo)
+    mode : str
+        Mode (car/transit/bike)
+    dtype : numpy.dtype
+        Float type of probability and demand matrices
+    zone_data : ZoneData
+        Data used for all demand calculations
+    paths : dict
+        "tours" : str
+            Path of .npy file with generated tours
+        Type (time/cost/dist) : str
+            Path of .npy file with impedance
+    """
+    global _sec_dest_distribution
+    for spec in zone_param.tour_purposes:
+        if spec["name"] == purpose_name:
+            break
+    purpose = SecDestPurpose(spec, zone_data, None, False, dtype)
+    # Copy-on-write, as distribution rescales tours in place
+    purpose.tours = {mode: numpy.load(paths["tours"], mmap_mode="c")}
+    impedance = {mode: {mtx_type: numpy.load(paths[mtx_type], mmap_mode="r")
+                        for mtx_type in paths if mtx_type != "tours"}}
+    _sec_dest_distribution = (purpose, mode, impedance)
+
+
+def _distribute_sec_dest_chunk(origins):
+    """Distribute secondary destinations of tours from chunk of origins.
+
+    Returns
+    -------
+    tuple
+        Block of demand as from `SecDestPurpose.distribute_tours`,
+        summed over all blocks of chunk (None if chunk has no demand)
+    """
+    purpose, mode, impedance = _sec_dest_distribution
+    blocks = list(purpose.distribute_tours(mode, impedance[mode], origins))
+    if not blocks:
+        return None
+    origins, dests, demand, return_demand, attracted = zip(*blocks)
+    dests = numpy.concatenate(dests)
+    demand = numpy.concatenate(demand)
+    # Rows of same destination are summed
+    order = numpy.argsort(dests, kind="mergesort")
+    dest_starts = numpy.r_[0, numpy.flatnonzero(numpy.diff(dests[order])) + 1]
+    return (numpy.concatenate(origins), dests[order][dest_starts],
+            numpy.add.reduceat(demand[order], dest_starts),
+            numpy.hstack(return_demand), sum(attracted))
+
+
+class _ThreadError:
+    """Exception info from failed secondary destination thread.
+
+    Parameters
+    ----------
+    exc_info : tuple
+        Exception type, value and traceback, as from `sys.exc_info`
+    """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _init_sec_dest_demand(impedance, nr_origins):
+    """Allocate secondary destination and return demand matrices."""
+    shape = impedance["time"].shape
+    dtype = impedance["time"].dtype
+    return (numpy.zeros(shape, dtype),
+            numpy.zeros((shape[1], nr_origins), dtype))
+
+
+def _add_sec_dest_block(purpose, mode, sec_dest_demand, return_demand,
+                        first_origin, block):
+    """Add demand of block from `SecDestPurpose.distribute_tours`.
+
+    Only called from one thread, which is the only one writing
+    to demand matrices and attracted tours.
+    """
+    origins, dests, demand, block_return_demand, attracted = block
+    sec_dest_demand[dests] += demand
+    return_demand[:, origins-first_origin] = block_return_demand
+    purpose.attracted_tours[mode][purpose.bounds] += attracted
+
+
+def _run_replication(seed):
+    model_system, impedance = _replication
+    return model_system._run_replication(seed, impedance)
+
+
+def _simulate_agent_shard(shard):
+    model_system, impedance = _agent_simulation
+    start, stop, seed = shard
+    return model_system._simulate_shard(start, stop, seed, impedance)
+
+
+def _can_fork(task):
+    """Check if worker processes can be forked, log warning if not.
+
+    Workers inherit model state from the forking process, so parallel
+    tasks are only run in several processes on platforms with fork
+    (e.g., Linux). On Windows they are run in one process,
+    and a warning is logged once per task.
+    """
+    if hasattr(os, "fork"):
+        return True
+    if task not in _fork_warnings:
+        log.warn("{} runs in one process, as forking worker processes "
+                 "is not supported on this platform".format(task))
+        _fork_warnings.add(task)
+    return False
+
+
+def _get_nr_processes():
+    """Get number of processes from performance settings."""
+    nr_processes = param.performance_settings["number_of_processors"]
+    if nr_processes == "max":
+        nr_processes = multiprocessing.cpu_count()
+    elif nr_processes <= 0:
+        nr_processes = 1
+    return nr_processes
@@ -742,5 +742,14 @@ distance_boundary = {
     "bike": 60,
     "walk": 15,
 }
+# Modes for which destinations are evaluated only within distance boundary,
+# using sparse matrices (e.g., ("bike", "walk")), not used in agent model
+sparse_destination_modes = ()
 # O-D pairs with demand below threshold are neglected in sec dest calculation
 secondary_destination_threshold = 0.1
+# Memory budget [bytes] for evaluating a block of origins
+# in secondary destination choice
+secondary_destination_block_memory = 2**27
+# Max number of (origin, destination) pairs in agent secondary destination
+# sampler cache, alias tables are only built for pairs drawn repeatedly
+secondary_destination_sampler_cache_size = 10000
@@ -46,8 +46,8 @@ class EmmeAssignmentTest:
             "..", "Matrices", "2016_test"))
         for time_period in travel_cost:
             for mtx_type in travel_cost[time_period]:
-                zone_numbers = self.ass_model.zone_numbers
-                with costs_files.open(mtx_type, time_period, zone_numbers, 'w') as mtx:
+                zone_system = self.ass_model.zone_system
+                with costs_files.open(mtx_type, time_period, zone_system, 'w') as mtx:
                     for ass_class in travel_cost[time_period][mtx_type]:
                         cost_data = travel_cost[time_period][mtx_type][ass_class]
                         mtx[ass_class] = cost_data
@@ -1,10 +1,12 @@
 import unittest
 import pandas
 import os
+import shutil
+import tempfile
 import numpy
 
 import utils.log as log
-from datahandling.zonedata import ZoneData
+from datahandling.zonedata import ZoneData, BaseZoneData
 from datahandling.matrixdata import MatrixData
 import parameters.assignment as param
 
@@ -68,8 +70,8 @@ class ZoneDataTest(unittest.TestCase):
         self.assertEquals(len(zdata2016["population"]), len(zdata2030["population"]))
         self.assertEquals(len(zdata2016["workplaces"]), len(zdata2030["workplaces"]))
         # Assert that data content is a bit different so we know we're not reading the same file all over again
-        self.assertFalse(zdata2016["population"].equals(zdata2030["population"]))
-        self.assertFalse(zdata2016["workplaces"].equals(zdata2030["workplaces"]))
+        self.assertFalse(numpy.array_equal(zdata2016["population"], zdata2030["population"]))
+        self.assertFalse(numpy.array_equal(zdata2016["workplaces"], zdata2030["workplaces"]))
 
     def test_all_cols_have_values_2016(self):
         df = self._get_freight_data_2016()
@@ -85,3 +87,91 @@ class ZoneDataTest(unittest.TestCase):
         industry = df["industry"] # Let's pick a column and validate it
         expected_industry = pandas.Series([0.7, 0.0, 0.0, 0.9, 0.0, 0.0], index=self.FREIGHT_DATA_INDEXES, name="industry")
         pandas.util.testing.assert_series_equal(industry, expected_industry)
+
+    def test_compound_data(self):
+        zdata = ZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), ZONE_INDEXES)
+        pop = zdata["population"]
+        area = zdata["zone_area"]
+        # Municipalities: Helsinki (3 zones), Espoo, Salo, Raasepori
+        same = numpy.zeros((6, 6))
+        same[:3, :3] = 1
+        same[[3, 4, 5], [3, 4, 5]] = 1
+        numpy.testing.assert_array_equal(zdata["own_zone"][:, :], numpy.eye(6))
+        numpy.testing.assert_array_equal(
+            zdata["own_zone_area"][:, :], numpy.diag(area))
+        numpy.testing.assert_array_equal(
+            zdata["population_own"][:, :], same * pop)
+        numpy.testing.assert_array_equal(
+            zdata["population_other"][:, :], (1-same) * pop)
+        data = zdata.get_data("population_own", slice(1, 4))
+        self.assertEquals(data.shape, (3, 6))
+        numpy.testing.assert_array_equal(data[:, :], same[1:4] * pop)
+        numpy.testing.assert_array_equal(
+            data[[0, 2], [1, 3]], [pop[1], pop[3]])
+        utility = numpy.ones((3, 6))
+        data.add_to(utility, 2)
+        numpy.testing.assert_array_equal(utility, 1 + 2*same[1:4]*pop)
+
+    def test_zone_data_views(self):
+        zdata = ZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), ZONE_INDEXES)
+        pop = zdata["population"]
+        with self.assertRaises(ValueError):
+            pop[0] = 0
+        version = zdata.get_version("population")
+        # Views stay valid when many variables are added
+        for i in range(100):
+            zdata.set_data("logsum_{}".format(i), numpy.zeros(4))
+        zdata.set_data("population", pop + 1)
+        self.assertEquals(zdata.get_version("population"), version + 1)
+        numpy.testing.assert_array_equal(pop, zdata["population"])
+
+    def test_snapshot(self):
+        data_dir = tempfile.mkdtemp()
+        snapshot_dir = os.path.join(data_dir, "snapshots")
+        input_dir = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        try:
+            for file_name in os.listdir(input_dir):
+                shutil.copy(os.path.join(input_dir, file_name), data_dir)
+            zdata = BaseZoneData(data_dir, ZONE_INDEXES, snapshot_dir)
+            self.assertEquals(len(os.listdir(snapshot_dir)), 2)
+            # Second instance is loaded from snapshot
+            loaded = BaseZoneData(data_dir, ZONE_INDEXES, snapshot_dir)
+            self.assertIsInstance(
+                loaded._columns["population"][0], numpy.memmap)
+            for key in ("population", "share_age_7-17", "car_density", "cbd"):
+                numpy.testing.assert_array_equal(loaded[key], zdata[key])
+            numpy.testing.assert_array_equal(
+                loaded["population_own"][:, :], zdata["population_own"][:, :])
+            self.assertEquals(loaded.transit_zone, zdata.transit_zone)
+            self.assertEquals(loaded.nr_zones, zdata.nr_zones)
+            loaded["car_density"] = loaded["car_density"] + 1
+            loaded.set_data("hw_c", numpy.zeros(4))
+            numpy.testing.assert_array_equal(
+                loaded["car_density"], zdata["car_density"] + 1)
+            # Changed input file leads to new snapshot
+            with open(os.path.join(data_dir, "2016.cco"), "a") as f:
+                f.write("\n")
+            BaseZoneData(data_dir, ZONE_INDEXES, snapshot_dir)
+            self.assertEquals(len(os.listdir(snapshot_dir)), 4)
+            # Invalid values in snapshot lead to reading input files
+            for file_name in os.listdir(snapshot_dir):
+                if file_name.endswith(".npy"):
+                    store = numpy.load(
+                        os.path.join(snapshot_dir, file_name), mmap_mode="r+")
+                    store[:] = -1
+                    store.flush()
+                    del store
+            loaded = BaseZoneData(data_dir, ZONE_INDEXES, snapshot_dir)
+            numpy.testing.assert_array_equal(
+                loaded["population"], zdata["population"])
+            # Invalid input file is not hidden by snapshot
+            pop_path = os.path.join(data_dir, "2016.pop")
+            with open(pop_path) as f:
+                lines = f.read().replace("\n5\t15\t", "\n5\t-15\t")
+            with open(pop_path, "w") as f:
+                f.write(lines)
+            self.assertRaises(
+                ValueError, BaseZoneData, data_dir, ZONE_INDEXES, snapshot_dir)
+            self.assertEquals(len(os.listdir(snapshot_dir)), 4)
+        finally:
+            shutil.rmtree(data_dir)
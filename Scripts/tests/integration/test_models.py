@@ -2,10 +2,12 @@ import unittest
 import numpy
 
 import utils.log as log
+import modelsystem
 from modelsystem import ModelSystem, AgentModelSystem
 from assignment.mock_assignment import MockAssignmentModel
 from datahandling.matrixdata import MatrixData
 from datatypes.demand import Demand
+import datatypes.purpose
 import parameters
 import os
 
@@ -48,6 +50,55 @@ class ModelTest(unittest.TestCase):
         
         print("Model system test done")
     
+    def test_single_precision(self):
+        log.initialize(Config())
+        ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        models = []
+        for use_single_precision in (False, True):
+            model = ModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test", use_single_precision)
+            impedance = model.assign_base_demand()
+            model.run_iteration(impedance)
+            models.append(model)
+        double, single = models
+        self.assertIs(single.dtm.demand["aht"]["car_work"].dtype, numpy.dtype(numpy.float32))
+        for mode in double.mode_share[0]:
+            self.assertAlmostEquals(
+                double.mode_share[0][mode], single.mode_share[0][mode], 6)
+            numpy.testing.assert_allclose(
+                double._sum_trips_per_zone(mode),
+                single._sum_trips_per_zone(mode), rtol=1e-5)
+
+    def test_incremental_iteration(self):
+        log.initialize(Config())
+        ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        models = []
+        for tolerance in (None, 1e-6):
+            model = ModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test", incremental_tolerance=tolerance)
+            impedance = model.assign_base_demand()
+            impedance = model.run_iteration(impedance, 1)
+            # Change impedance of one o-d pair
+            impedance["aht"]["time"]["car_work"][0, 1] *= 1.5
+            model.run_iteration(impedance, 2)
+            models.append(model)
+        full, incremental = models
+        hw = incremental.dm.purpose_dict["hw"].model
+        self.assertEquals(hw.recomputed_rows["car"], 2)
+        self.assertEquals(hw.recomputed_rows["bike"], 0)
+        for mode in full.mode_share[1]:
+            self.assertAlmostEquals(
+                full.mode_share[1][mode], incremental.mode_share[1][mode], 12)
+            numpy.testing.assert_allclose(
+                full._sum_trips_per_zone(mode),
+                incremental._sum_trips_per_zone(mode), rtol=1e-10)
+
     def test_agent_model(self):
         log.initialize(Config())
         ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
@@ -55,9 +106,184 @@ class ModelTest(unittest.TestCase):
         base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
         base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
         results_path = os.path.join(TEST_DATA_PATH, "Results")
-        model = AgentModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test")
+        model = AgentModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test",
+                                 keep_tour_combinations=True)
         impedance = model.assign_base_demand()
         impedance = model.run_iteration(impedance)
+        population = model.dm.population
+        combinations = population.tour_combination.copy()
+        self.assertTrue((combinations >= 0).all())
+        impedance = model.run_iteration(impedance)
+        self.assertIs(model.dm.population, population)
+        numpy.testing.assert_array_equal(population.tour_combination, combinations)
+        model.regenerate_population = True
+        impedance = model.run_iteration(impedance)
+        self.assertIsNot(model.dm.population, population)
+
+    def test_sec_dest_processes(self):
+        log.initialize(Config())
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        settings = parameters.assignment.performance_settings
+        nr_processors = settings["number_of_processors"]
+        block_memory = datatypes.purpose.secondary_destination_block_memory
+        models = []
+        try:
+            # Last run evaluates one origin per block
+            for nr, memory in ((1, block_memory), (2, block_memory), (1, 1)):
+                settings["number_of_processors"] = nr
+                datatypes.purpose.secondary_destination_block_memory = memory
+                ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+                model = ModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test")
+                impedance = model.assign_base_demand()
+                model._update_car_density()
+                # Secondary destinations are distributed for all modes
+                model._add_internal_demand(impedance, True)
+                models.append(model)
+        finally:
+            settings["number_of_processors"] = nr_processors
+            datatypes.purpose.secondary_destination_block_memory = block_memory
+        hoo = models[0].dm.purpose_dict["hoo"]
+        for model in models[1:]:
+            for mode in hoo.attracted_tours:
+                numpy.testing.assert_allclose(
+                    hoo.attracted_tours[mode],
+                    model.dm.purpose_dict["hoo"].attracted_tours[mode])
+            numpy.testing.assert_allclose(
+                models[0].dtm.tensor, model.dtm.tensor, rtol=1e-12)
+
+    def test_sec_dest_thread_errors(self):
+        log.initialize(Config())
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        settings = parameters.assignment.performance_settings
+        nr_processors = settings["number_of_processors"]
+        add_block = modelsystem._add_sec_dest_block
+        ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+        model = ModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test")
+        impedance = model.assign_base_demand()
+        hoo = model.dm.purpose_dict["hoo"]
+        purpose_impedance = model.imptrans.transform(hoo, impedance)
+
+        def failing_distribution(mode, impedance, origins):
+            raise ValueError("distribution failed")
+            yield
+
+        def endless_distribution(mode, impedance, origins):
+            while True:
+                yield (origins[:1], numpy.array([], int), None, None, 0)
+
+        def failing_add(*args):
+            raise ValueError("adding failed")
+        try:
+            settings["number_of_processors"] = 1
+            # Error in worker thread is raised in main thread
+            hoo.distribute_tours = failing_distribution
+            with self.assertRaisesRegexp(ValueError, "distribution failed"):
+                model._distribute_sec_dests(hoo, "car", purpose_impedance)
+            # Worker thread is stopped if main thread fails
+            hoo.distribute_tours = endless_distribution
+            modelsystem._add_sec_dest_block = failing_add
+            with self.assertRaisesRegexp(ValueError, "adding failed"):
+                model._distribute_sec_dests(hoo, "car", purpose_impedance)
+        finally:
+            settings["number_of_processors"] = nr_processors
+            modelsystem._add_sec_dest_block = add_block
+
+    def test_agent_model_reproducible(self):
+        log.initialize(Config())
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        settings = parameters.assignment.performance_settings
+        nr_processors = settings["number_of_processors"]
+        settings["number_of_processors"] = 2
+        try:
+            models = []
+            for _ in range(2):
+                ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+                model = AgentModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test",
+                                         seed=42)
+                impedance = model.assign_base_demand()
+                model.run_iteration(impedance)
+                models.append(model)
+        finally:
+            settings["number_of_processors"] = nr_processors
+        self.assertEqual(models[0].mode_share, models[1].mode_share)
+        for purpose in models[0].dm.tour_purposes:
+            other = models[1].dm.purpose_dict[purpose.name]
+            for mode in purpose.attracted_tours:
+                numpy.testing.assert_array_equal(
+                    purpose.attracted_tours[mode], other.attracted_tours[mode])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Forking not supported")
+    def test_agent_model_fork_and_sequential(self):
+        log.initialize(Config())
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        settings = parameters.assignment.performance_settings
+        nr_processors = settings["number_of_processors"]
+        settings["number_of_processors"] = 4
+        can_fork = modelsystem._can_fork
+        models = []
+        try:
+            # Second run simulates shards in turn, as on Windows
+            for fork in (can_fork, lambda task: False):
+                modelsystem._can_fork = fork
+                ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+                model = AgentModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test",
+                                         seed=42)
+                impedance = model.assign_base_demand()
+                state = numpy.random.get_state()
+                model.run_iteration(impedance)
+                # Global random state is not changed by seeded simulation
+                numpy.testing.assert_array_equal(
+                    state[1], numpy.random.get_state()[1])
+                models.append(model)
+        finally:
+            settings["number_of_processors"] = nr_processors
+            modelsystem._can_fork = can_fork
+        self.assertEqual(models[0].mode_share, models[1].mode_share)
+        for purpose in models[0].dm.tour_purposes:
+            other = models[1].dm.purpose_dict[purpose.name]
+            for mode in purpose.attracted_tours:
+                numpy.testing.assert_array_equal(
+                    purpose.attracted_tours[mode], other.attracted_tours[mode])
+
+    def test_agent_model_replications(self):
+        log.initialize(Config())
+        ass_model = MockAssignmentModel(MatrixData(os.path.join(TEST_DATA_PATH, "Results", "test", "Matrices")))
+        zone_data_path = os.path.join(TEST_DATA_PATH, "Scenario_input_data", "2030_test")
+        base_zone_data_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test")
+        base_matrices_path = os.path.join(TEST_DATA_PATH, "Base_input_data", "base_matrices_test")
+        results_path = os.path.join(TEST_DATA_PATH, "Results")
+        model = AgentModelSystem(zone_data_path, base_zone_data_path, base_matrices_path, results_path, ass_model, "test",
+                                 seed=1)
+        impedance = model.assign_base_demand()
+        settings = parameters.assignment.performance_settings
+        nr_processors = settings["number_of_processors"]
+        settings["number_of_processors"] = 2
+        try:
+            demand_stats, trip_stats = model.run_replications(impedance, 3)
+        finally:
+            settings["number_of_processors"] = nr_processors
+        self.assertEquals(demand_stats["aht"]["car_work"].count, 3)
+        self.assertEquals(demand_stats["aht"]["car_work"].mean.shape, (8, 8))
+        for mode in trip_stats:
+            lower, upper = trip_stats[mode].confidence_interval()
+            self.assertTrue((lower <= upper).all())
+        single_process_stats = model.run_replications(impedance, 3)[1]
+        for mode in trip_stats:
+            numpy.testing.assert_allclose(
+                single_process_stats[mode].mean, trip_stats[mode].mean)
+        model.run_iteration(impedance)
 
     def _validate_impedances(self, impedances):
         self.assertIsNotNone(impedances)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import numpy
+import unittest
+from utils.alias_table import AliasTable
+
+
+class AliasTableTest(unittest.TestCase):
+    def test_alias_table(self):
+        rs = numpy.random.RandomState(0)
+        for n in (1, 2, 7, 100):
+            prob = rs.random_sample(n)
+            prob[rs.random_sample(n) < 0.3] = 0
+            prob[0] += 0.1
+            prob /= prob.sum()
+            table = AliasTable(prob)
+            # Probability implied by the table
+            implied = numpy.bincount(
+                numpy.arange(n), table.prob, minlength=n)
+            implied += numpy.bincount(
+                table.alias, 1 - table.prob, minlength=n)
+            numpy.testing.assert_allclose(implied / n, prob, atol=1e-12)
+        table = AliasTable([0.2, 0.0, 0.5, 0.3])
+        draws = table.draw(100000, rs)
+        freq = numpy.bincount(draws, minlength=4) / 100000.0
+        numpy.testing.assert_allclose(freq, [0.2, 0.0, 0.5, 0.3], atol=0.01)
+        self.assertIsInstance(table.draw(random_state=rs), int)
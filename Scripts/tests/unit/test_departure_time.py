@@ -3,6 +3,7 @@
 import numpy
 import unittest
 from assignment.departure_time import DepartureTimeModel
+from datatypes.sparse import SparseMatrix
 
 
 class DepartureTimeTest(unittest.TestCase):
@@ -45,3 +46,141 @@ class DepartureTimeTest(unittest.TestCase):
         self.assertEquals(dtm.demand["pt"]["car_leisure"].ndim, 2)
         self.assertEquals(dtm.demand["aht"]["bike_work"].shape[1], 8)
         self.assertNotEquals(dtm.demand["iht"]["car_work"][0, 1], 0)
+
+
+    def test_sparse_mtx_add(self):
+        emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        dense_dtm = DepartureTimeModel(8, emme_scenarios)
+        sparse_dtm = DepartureTimeModel(8, emme_scenarios)
+        mtx = numpy.arange(18, dtype=float)
+        mtx.shape = (3, 6)
+        mtx[mtx % 4 == 1] = 0
+        class Demand:
+            pass
+        class Purpose:
+            pass
+        dem = Demand()
+        dem.purpose = Purpose()
+        dem.purpose.name = "hw"
+        dem.mode = "bike"
+        dem.position = (2, 0)
+        dem.matrix = mtx
+        dense_dtm.add_demand(dem)
+        sparse = SparseMatrix.from_mask(mtx != 0)
+        sparse.data[:] = mtx[mtx != 0]
+        dem.matrix = sparse
+        sparse_dtm.add_demand(dem)
+        for tp in emme_scenarios:
+            numpy.testing.assert_allclose(
+                sparse_dtm.demand[tp]["bike_work"],
+                dense_dtm.demand[tp]["bike_work"])
+
+    def test_add_tours(self):
+        emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        single_dtm = DepartureTimeModel(8, emme_scenarios)
+        bulk_dtm = DepartureTimeModel(8, emme_scenarios)
+        class Tour:
+            pass
+        class Purpose:
+            pass
+        hoo = Purpose()
+        hoo.name = "hoo"
+        purposes = {}
+        for name in ("hw", "ho", "wo"):
+            purposes[name] = Purpose()
+            purposes[name].name = name
+            purposes[name].sec_dest_purpose = hoo
+        tours = (
+            ("hw", "car", (1, 2)),
+            ("hw", "car", (1, 2)),
+            ("hw", "transit", (3, 2, 5)),
+            ("ho", "car", (1, 2, 1)),
+            ("ho", "walk", (1, 4)),
+            ("ho", "car_passenger", (2, 4)),
+            ("wo", "bike", (7, 0)),
+            ("ho", "car", (0, 6, 7)),
+        )
+        weights = [1, 1, 2, 1, 1, 1, 0.5, 10]
+        for (name, mode, position), weight in zip(tours, weights):
+            tour = Tour()
+            tour.purpose = purposes[name]
+            tour.mode = mode
+            tour.matrix = weight
+            tour.position = position
+            single_dtm.add_demand(tour)
+        positions = numpy.array(
+            [pos + (-1,)*(3-len(pos)) for _, _, pos in tours])
+        bulk_dtm.add_tours(
+            [t[0] for t in tours], [t[1] for t in tours],
+            positions[:, 0], positions[:, 1], positions[:, 2],
+            {"hw": "hoo", "ho": "hoo", "wo": "hoo"}, weights)
+        for tp in emme_scenarios:
+            for ass_class in single_dtm.demand[tp]:
+                numpy.testing.assert_allclose(
+                    bulk_dtm.demand[tp][ass_class],
+                    single_dtm.demand[tp][ass_class])
+
+    def test_tensor_views(self):
+        emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        dtm = DepartureTimeModel(4, emme_scenarios, numpy.float32)
+        self.assertEqual(dtm.tensor.shape, (3, 9, 4, 4))
+        tensor = dtm.tensor
+        dtm.demand["pt"]["van"][1, 2] = 5
+        self.assertEqual(tensor.sum(), 5)
+        dtm.demand["aht"]["truck"] = numpy.ones((4, 4))
+        dtm.init_demand()
+        self.assertIs(dtm.tensor, tensor)
+        self.assertEqual(tensor.sum(), 0)
+        self.assertIs(dtm.demand["aht"]["truck"].base, tensor)
+
+    def test_factorized(self):
+        emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        dtm = DepartureTimeModel(8, emme_scenarios)
+        factorized_dtm = DepartureTimeModel(8, emme_scenarios, factorized=True)
+        class Demand:
+            pass
+        class Purpose:
+            pass
+        rs = numpy.random.RandomState(0)
+        for name, mode, start in (("hw", "car", 0), ("hs", "car", 0),
+                                  ("hw", "transit", 2), ("wo", "bike", 0)):
+            dem = Demand()
+            dem.purpose = Purpose()
+            dem.purpose.name = name
+            dem.mode = mode
+            dem.position = (start, 0)
+            dem.matrix = rs.random_sample((6, 8))
+            dtm.add_demand(dem)
+            factorized_dtm.add_demand(dem)
+        self.assertFalse(factorized_dtm.tensor.any())
+        for tp in emme_scenarios:
+            for ass_class in dtm.demand[tp]:
+                numpy.testing.assert_allclose(
+                    factorized_dtm.demand[tp][ass_class],
+                    dtm.demand[tp][ass_class])
+        factorized_dtm.init_demand()
+        self.assertFalse(factorized_dtm.demand["aht"]["car_work"].any())
+
+    def test_sec_dest_demand(self):
+        emme_scenarios = {"aht": 21, "pt": 22, "iht": 23}
+        dtm = DepartureTimeModel(8, emme_scenarios)
+        summed_dtm = DepartureTimeModel(8, emme_scenarios)
+        class Demand:
+            pass
+        class Purpose:
+            pass
+        purpose = Purpose()
+        purpose.name = "hoo"
+        rs = numpy.random.RandomState(0)
+        matrices = [rs.random_sample((8, 8)) for _ in range(3)]
+        for origin, mtx in zip((2, 3, 4), matrices):
+            dem = Demand()
+            dem.purpose = purpose
+            dem.mode = "transit"
+            dem.matrix = mtx
+            dem.position = (origin, 0, 0)
+            dtm.add_demand(dem)
+        summed_dtm.add_sec_dest_demand(
+            purpose, "transit", sum(matrices),
+            numpy.array([mtx.sum(0) for mtx in matrices]).T, 2)
+        numpy.testing.assert_allclose(summed_dtm.tensor, dtm.tensor)
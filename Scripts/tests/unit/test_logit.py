@@ -3,6 +3,7 @@
 import numpy
 import pandas
 import unittest
+import parameters.destination_choice
 from datahandling.zonedata import BaseZoneData
 from models.logit import ModeDestModel
 from datahandling.resultdata import ResultsData
@@ -67,6 +68,109 @@ class LogitModelTest(unittest.TestCase):
             for mode in ("car", "transit"):
                 self._validate(prob[mode])
 
+    def test_kernel_equivalence(self):
+        resultdata = ResultsData(os.path.join(TEST_DATA_PATH, "Results", "test"))
+        class Purpose:
+            pass
+        pur = Purpose()
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = BaseZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        mtx = numpy.arange(24, dtype=float)
+        mtx.shape = (4, 6)
+        pur.bounds = slice(0, 4)
+        pur.zone_numbers = (5, 6, 7, 2792)
+        for name in ("hw", "hs", "oo"):
+            pur.name = name
+            model = ModeDestModel(zd, pur, resultdata, is_agent_model=False)
+            for mode in model.dest_choice_param:
+                impedance = {"time": mtx, "cost": mtx, "dist": mtx}
+                model._calc_dest_util(mode, impedance)
+                # Reference calculation with separate passes for each term
+                b = model.dest_choice_param[mode]
+                utility = numpy.zeros_like(mtx)
+                model._add_zone_util(utility, b["attraction"])
+                model._add_impedance(utility, impedance, b["impedance"])
+                exps = numpy.exp(utility)
+                size = numpy.zeros_like(mtx)
+                model._add_zone_util(size, b["size"])
+                impedance["size"] = size
+                if "transform" in b:
+                    transimp = numpy.zeros_like(mtx)
+                    model._add_zone_util(transimp, b["transform"]["attraction"])
+                    model._add_impedance(
+                        transimp, impedance, b["transform"]["impedance"])
+                    impedance["transform"] = transimp
+                model._add_log_impedance(exps, impedance, b["log"])
+                exps[mtx > parameters.destination_choice.distance_boundary[mode]] = 0
+                numpy.testing.assert_allclose(
+                    model.dest_exps[mode], exps, rtol=1e-12)
+
+    def test_zone_term_cache(self):
+        resultdata = ResultsData(os.path.join(TEST_DATA_PATH, "Results", "test"))
+        class Purpose:
+            pass
+        pur = Purpose()
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = BaseZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        mtx = numpy.arange(24, dtype=float)
+        mtx.shape = (4, 6)
+        impedance = {"time": mtx, "cost": mtx, "dist": mtx}
+        pur.bounds = slice(0, 4)
+        pur.zone_numbers = (5, 6, 7, 2792)
+        pur.name = "hw"
+        model = ModeDestModel(zd, pur, resultdata, is_agent_model=False)
+        model._calc_dest_util("car", impedance)
+        exps = model.dest_exps["car"].copy()
+        model._calc_dest_util("car", impedance)
+        numpy.testing.assert_array_equal(model.dest_exps["car"], exps)
+        # Size variable is shared between modes
+        self.assertIs(
+            model.dest_kernels["car"]._zone_terms(2)["size"],
+            model.dest_kernels["transit"]._zone_terms(2)["size"])
+        # Cached terms are updated when zone data changes
+        zd["cbd"] = 1 - zd["cbd"]
+        model._calc_dest_util("car", impedance)
+        new_model = ModeDestModel(zd, pur, resultdata, is_agent_model=False)
+        new_model._calc_dest_util("car", impedance)
+        self.assertFalse(numpy.allclose(model.dest_exps["car"], exps))
+        numpy.testing.assert_array_equal(
+            model.dest_exps["car"], new_model.dest_exps["car"])
+
+    def test_sparse_destinations(self):
+        resultdata = ResultsData(os.path.join(TEST_DATA_PATH, "Results", "test"))
+        class Purpose:
+            pass
+        pur = Purpose()
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = BaseZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        zd["car_users"] = pandas.Series([0.5, 0.5, 0.5, 0.5, 0.5, 0.5], zd.zone_numbers)
+        mtx = numpy.arange(24, dtype=numpy.float32)
+        mtx.shape = (4, 6)
+        impedance = {
+            "car": {"time": mtx, "cost": mtx, "dist": mtx},
+            "transit": {"time": mtx, "cost": mtx, "dist": mtx},
+            "bike": {"dist": mtx},
+            "walk": {"dist": mtx},
+        }
+        pur.bounds = slice(0, 4)
+        pur.zone_numbers = (5, 6, 7, 2792)
+        for name in ("hw", "ho"):
+            pur.name = name
+            model = ModeDestModel(zd, pur, resultdata, is_agent_model=False)
+            dense_prob = model.calc_prob(impedance)
+            model.sparse_modes = ("bike", "walk")
+            sparse_prob = model.calc_prob(impedance)
+            for mode in ("car", "transit"):
+                numpy.testing.assert_allclose(
+                    sparse_prob[mode], dense_prob[mode], rtol=1e-12)
+            self.assertLess(sparse_prob["walk"].nnz, mtx.size)
+            for mode in model.sparse_modes:
+                # Origins without feasible destinations get zero
+                # probabilities instead of nans
+                numpy.testing.assert_allclose(
+                    sparse_prob[mode].toarray().T,
+                    numpy.nan_to_num(dense_prob[mode]), rtol=1e-12)
+
     def _validate(self, prob):
         self.assertIs(type(prob), numpy.ndarray)
         self.assertEquals(prob.ndim, 2)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import numpy
+import unittest
+from datahandling.zonedata import BaseZoneData
+from datahandling.resultdata import ResultsData
+from datatypes.population import Population
+from models.logit import CarUseModel, TourCombinationModel
+import os
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "test_data")
+
+
+class PopulationTest(unittest.TestCase):
+    def test_population(self):
+        resultdata = ResultsData(os.path.join(TEST_DATA_PATH, "Results", "test"))
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = BaseZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        age_groups = ((7, 17), (18, 29), (30, 49), (50, 64), (65, 99))
+        bounds = slice(0, zd.first_peripheral_zone)
+        cm = CarUseModel(zd, bounds, age_groups, resultdata)
+        cm.calc_basic_prob()
+        cm.calc_prob_table()
+        numpy.random.seed(0)
+        population = Population(zd, age_groups, TourCombinationModel(zd), cm)
+        nr_persons = len(population)
+        self.assertGreater(nr_persons, 0)
+        self.assertLessEqual(nr_persons, zd["population"][:zd.first_peripheral_zone].sum())
+        self.assertTrue((numpy.diff(population.zone_index) >= 0).all())
+        lower = numpy.array([g[0] for g in age_groups])[population.age_group]
+        upper = numpy.array([g[1] for g in age_groups])[population.age_group]
+        self.assertTrue((population.age >= lower).all())
+        self.assertTrue((population.age <= upper).all())
+        person = population[nr_persons - 1]
+        self.assertEquals(person.zone, population.zone[-1])
+        self.assertIn(person.gender, ("female", "male"))
+        self.assertEquals(
+            person.age_group, "age_{}-{}".format(*age_groups[population.age_group[-1]]))
+        self.assertEquals(len(list(population)), nr_persons)
+        car_users = population.is_car_user.copy()
+        population.update_car_users()
+        numpy.testing.assert_array_equal(population.is_car_user, car_users)
+        for key in cm.prob_table:
+            cm.prob_table[key] = numpy.zeros_like(cm.prob_table[key])
+        population.update_car_users()
+        self.assertFalse(population.is_car_user.any())
+        numpy.random.seed(0)
+        sample = Population(zd, age_groups, TourCombinationModel(zd), cm,
+                            sampling_rate=0.5)
+        self.assertLess(len(sample), nr_persons)
+        self.assertTrue((sample.weight == 2).all())
@@ -0,0 +1,23 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import numpy
+import unittest
+from utils.running_stats import RunningStats
+
+
+class RunningStatsTest(unittest.TestCase):
+    def test_running_stats(self):
+        samples = numpy.random.RandomState(0).random_sample((5, 3, 4))
+        stats = RunningStats()
+        for sample in samples:
+            stats.add(sample)
+        self.assertEquals(stats.count, 5)
+        numpy.testing.assert_allclose(stats.mean, samples.mean(0))
+        numpy.testing.assert_allclose(stats.variance, samples.var(0, ddof=1))
+        lower, upper = stats.confidence_interval()
+        self.assertTrue((lower <= stats.mean).all())
+        self.assertTrue((upper >= stats.mean).all())
+        part = stats[1]
+        self.assertEquals(part.count, 5)
+        numpy.testing.assert_allclose(
+            part.variance, samples[:, 1].var(0, ddof=1))
@@ -14,8 +14,8 @@ class TourCombinationModelTest(unittest.TestCase):
     def test_generation(self):
         zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
         zd = ZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
-        zd._values["hu_t"] = pandas.Series([0, 0, 0, 0], [5, 6, 7, 2792])
-        zd._values["ho_w"] = pandas.Series([0, 0, 0, 0], [5, 6, 7, 2792])
+        zd.set_data("hu_t", pandas.Series([0, 0, 0, 0], [5, 6, 7, 2792]))
+        zd.set_data("ho_w", pandas.Series([0, 0, 0, 0], [5, 6, 7, 2792]))
         model = TourCombinationModel(zd)
         prob = model.calc_prob("age_50-64", False, 6)
         self.assertIs(type(prob[("hw",)]), numpy.float64)
@@ -24,3 +24,35 @@ class TourCombinationModelTest(unittest.TestCase):
         self.assertIs(type(prob[()]), pandas.core.series.Series)
         self.assertEquals(prob[("hw", "ho")].values.ndim, 1)
         self.assertEquals(prob[("hw", "hs")].values.shape[0], 4)
+
+    def test_segment_prob(self):
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = ZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        zd.set_data("hu_t", pandas.Series([0.3, 1, 2, 0], [5, 6, 7, 2792]))
+        zd.set_data("ho_w", pandas.Series([0.1, 0, 4, 0], [5, 6, 7, 2792]))
+        model = TourCombinationModel(zd)
+        segments = [("age_7-17", True), ("age_50-64", False)]
+        prob = model.calc_segment_prob(segments, slice(0, 4))
+        self.assertEquals(prob.shape, (4, 2, len(model.combinations)))
+        numpy.testing.assert_allclose(prob.sum(2), 1)
+        for i, (age, is_car_user) in enumerate(segments):
+            segment_prob = model.calc_prob(age, is_car_user, slice(0, 4))
+            for j, combination in enumerate(model.combinations):
+                numpy.testing.assert_allclose(
+                    prob[:, i, j], segment_prob[combination])
+        # No 4-tour patterns are allowed for 7-17-year-olds
+        self.assertFalse(prob[:, 0, model.nr_tours == 4].any())
+        counts = model.purpose_counts(["hw", "ho"])
+        self.assertEquals(counts[model.combinations.index(("hw", "hw")), 0], 2)
+
+    def test_prob_table(self):
+        zi = numpy.array([5, 6, 7, 2792, 16001, 17000, 31000, 31501])
+        zd = ZoneData(os.path.join(TEST_DATA_PATH, "Base_input_data", "2016_zonedata_test"), zi)
+        zd.set_data("hu_t", pandas.Series([0.3, 1, 2, 0], [5, 6, 7, 2792]))
+        zd.set_data("ho_w", pandas.Series([0.1, 0, 4, 0], [5, 6, 7, 2792]))
+        model = TourCombinationModel(zd)
+        model.calc_prob_table(["age_18-29", "age_65-99"], slice(0, 4))
+        prob = model.calc_prob("age_65-99", True, 7)
+        table_prob = model.get_table_prob("age_65-99", True, 2)
+        for j, combination in enumerate(model.combinations):
+            self.assertAlmostEquals(table_prob[j], prob[combination])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from utils.read_csv_file import read_csv_file
+from utils.validation import ValidationReport
+
+
+class ValidationReportTest(unittest.TestCase):
+    def test_check_values(self):
+        report = ValidationReport()
+        zones = numpy.array([5, 6, 7, 8])
+        self.assertTrue(report.check_values("share", zones, [0, 0.5, 1, 1]))
+        self.assertFalse(report.check_values(
+            "share", zones, [numpy.nan, -1, 2, -3], is_share=True))
+        checks = [v["check"] for v in report.violations]
+        self.assertEqual(checks, ["not_finite", "negative", "too_large"])
+        self.assertEqual(report.violations[1]["zones"], [6, 8])
+        self.assertRaises(ValueError, report.raise_errors)
+        report.check_values("population", zones[:2], ["1", "a"])
+        self.assertEqual(report.violations[3]["check"], "not_number")
+        self.assertRaises(TypeError, report.raise_errors, 3)
+        report.raise_errors(len(report))
+
+    def test_check_zones_and_matrix(self):
+        report = ValidationReport()
+        self.assertFalse(report.check_zones(
+            "test.pop", numpy.array([1, 2, 4]), numpy.array([1, 2, 3])))
+        self.assertEqual(report.violations[0]["zones"], [4])
+        self.assertEqual(report.violations[1]["zones"], [3])
+        self.assertRaises(IndexError, report.raise_errors)
+        mtx = numpy.ones((3, 3))
+        mtx[1, 2] = -1
+        mtx[2, 0] = numpy.nan
+        self.assertFalse(report.check_matrix("car", [1, 2, 3], mtx))
+        self.assertEqual(report.violations[2]["zones"], [3])
+        self.assertEqual(report.violations[3]["zones"], [2])
+
+    def test_read_csv_file(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(data_dir, "test.pop"), "w") as f:
+                f.write("total\n1 10\n2 a\n4 5\n")
+            zone_numbers = numpy.array([1, 2, 3])
+            self.assertRaises(
+                IndexError, read_csv_file, data_dir, ".pop", zone_numbers, float)
+            report = ValidationReport()
+            data = read_csv_file(
+                data_dir, ".pop", zone_numbers, float, report=report)
+            numpy.testing.assert_array_equal(data.index, zone_numbers)
+            self.assertEqual(
+                [v["check"] for v in report.violations],
+                ["unknown_zone", "missing_zone", "not_number"])
+            self.assertEqual(report.violations[2]["zones"], [2])
+            path = os.path.join(data_dir, "report.json")
+            report.write(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)["errors"], 3)
+        finally:
+            shutil.rmtree(data_dir)
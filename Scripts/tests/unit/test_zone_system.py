@@ -0,0 +1,35 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import numpy
+import unittest
+from datahandling.zone_system import ZoneSystem
+
+
+class ZoneSystemTest(unittest.TestCase):
+    def test_zone_system(self):
+        zone_numbers = numpy.array([5, 1000, 6001, 16001, 31501, 35000])
+        zs = ZoneSystem(zone_numbers)
+        self.assertEqual(zs.nr_zones, 6)
+        self.assertEqual(zs.index(6001), 2)
+        self.assertIsInstance(zs.index(6001), int)
+        numpy.testing.assert_array_equal(
+            zs.index(numpy.array([35000, 5, 16001])), [5, 0, 3])
+        numpy.testing.assert_array_equal(
+            zs.contains([5, 6, -1, 40000, 31501]),
+            [True, False, False, False, True])
+        self.assertRaises(IndexError, zs.index, 6)
+        self.assertRaises(IndexError, zs.index, numpy.array([5, 40000]))
+        self.assertEqual(zs.mapping[16001], 3)
+        self.assertEqual(zs.first_surrounding_zone, 2)
+        self.assertEqual(zs.first_peripheral_zone, 3)
+        self.assertEqual(zs.first_external_zone, 4)
+        cbd = zs.area_names.index("helsinki_cbd")
+        self.assertEqual(zs.area[0], cbd)
+        helsinki = zs.municipality_names.index("Helsinki")
+        numpy.testing.assert_array_equal(
+            zs.municipality[:2], [helsinki, helsinki])
+        external = zs.area_names.index("external")
+        numpy.testing.assert_array_equal(zs.area[4:], [external, external])
+
+    def test_not_ascending(self):
+        self.assertRaises(IndexError, ZoneSystem, [1, 3, 2])
@@ -1,9 +1,19 @@
+import numpy
+
 from parameters.impedance_transformation import impedance_share
 
 
 class ImpedanceTransformer:
-    def __init__(self):
-        pass
+    """Transformer of assignment impedance to purpose impedance.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype (optional)
+        Float type of transformed impedance matrices
+    """
+
+    def __init__(self, dtype=numpy.float64):
+        self.dtype = dtype
 
     def transform(self, purpose, impedance):
         """Perform transformation from time period dependent matrices 
@@ -43,7 +53,8 @@ class ImpedanceTransformer:
                         share = impedance_share[purpose.name][mode][time_period]
                         imp = impedance[time_period][mtx_type][ass_class][rows, cols]
                         if idx == 0:
-                            day_imp[mode][mtx_type] = share[0] * imp
+                            day_imp[mode][mtx_type] = numpy.multiply(
+                                share[0], imp, dtype=self.dtype)
                         else:
                             day_imp[mode][mtx_type] += share[0] * imp
                         imp = impedance[time_period][mtx_type][ass_class][cols, rows]
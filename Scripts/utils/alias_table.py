@@ -0,0 +1,67 @@
+import numpy
+
+
+class AliasTable:
+    """Walker alias table for sampling from a discrete distribution.
+
+    Table is built in O(n) and each draw takes constant time,
+    independent of the number of alternatives.
+
+    Parameters
+    ----------
+    prob : numpy.ndarray
+        Choice probabilities (or weights) of alternatives
+    """
+
+    def __init__(self, prob):
+        q = numpy.array(prob, float)
+        n = q.size
+        q *= n / q.sum()
+        self.prob = numpy.ones(n)
+        self.alias = numpy.arange(n)
+        small = numpy.flatnonzero(q < 1)
+        large = numpy.flatnonzero(q >= 1)
+        # In each round, the deficits of all small columns are filled
+        # from large columns, laid out consecutively. A large column
+        # whose surplus is exhausted becomes small for the next round.
+        while small.size and large.size:
+            deficit = 1 - q[small]
+            start = numpy.cumsum(deficit) - deficit
+            surplus_end = numpy.cumsum(q[large] - 1)
+            donor = numpy.searchsorted(surplus_end, start, side="right")
+            # Rounding errors may leave last columns without donor,
+            # they are kept with probability 1
+            has_donor = donor < large.size
+            small = small[has_donor]
+            donor = donor[has_donor]
+            self.prob[small] = q[small]
+            self.alias[small] = large[donor]
+            q[large] -= numpy.bincount(
+                donor, deficit[has_donor], minlength=large.size)
+            is_small = q[large] < 1
+            small = large[is_small]
+            large = large[~is_small]
+
+    def draw(self, size=None, random_state=numpy.random):
+        """Draw alternative indices.
+
+        Parameters
+        ----------
+        size : int (optional)
+            Number of draws, if not given, one index is returned
+        random_state : numpy.random.RandomState (optional)
+            Random number generator (default is the global one)
+
+        Returns
+        -------
+        int or numpy.ndarray
+            Index (or indices) of drawn alternatives
+        """
+        n = self.prob.size
+        column = numpy.minimum(
+            numpy.int_(random_state.random_sample(size) * n), n - 1)
+        is_own = random_state.random_sample(size) < self.prob[column]
+        index = numpy.where(is_own, column, self.alias[column])
+        if size is None:
+            return int(index)
+        return index
@@ -113,3 +113,27 @@ class Config:
 
     @FIRST_MATRIX_ID.setter
     def FIRST_MATRIX_ID(self, value): self.__set_value("FIRST_MATRIX_ID", value)
+
+    @property
+    def USE_SINGLE_PRECISION(self): return self.__get_value("USE_SINGLE_PRECISION")
+
+    @USE_SINGLE_PRECISION.setter
+    def USE_SINGLE_PRECISION(self, value): self.__set_value("USE_SINGLE_PRECISION", value)
+
+    @property
+    def INCREMENTAL_TOLERANCE(self): return self.__get_value("INCREMENTAL_TOLERANCE")
+
+    @INCREMENTAL_TOLERANCE.setter
+    def INCREMENTAL_TOLERANCE(self, value): self.__set_value("INCREMENTAL_TOLERANCE", value)
+
+    @property
+    def ZONE_DATA_SNAPSHOT_PATH(self): return self.__get_value("ZONE_DATA_SNAPSHOT_PATH")
+
+    @ZONE_DATA_SNAPSHOT_PATH.setter
+    def ZONE_DATA_SNAPSHOT_PATH(self, value): self.__set_value("ZONE_DATA_SNAPSHOT_PATH", value)
+
+    @property
+    def USE_FACTORIZED_DEMAND(self): return self.__get_value("USE_FACTORIZED_DEMAND")
+
+    @USE_FACTORIZED_DEMAND.setter
+    def USE_FACTORIZED_DEMAND(self, value): self.__set_value("USE_FACTORIZED_DEMAND", value)
@@ -3,9 +3,11 @@ import pandas
 import numpy
 
 import utils.log as log
+from utils.validation import ValidationReport, format_zones
 
 
-def read_csv_file(data_dir, file_end, zone_numbers=None, dtype=None, squeeze=False):
+def read_csv_file(data_dir, file_end, zone_numbers=None, dtype=None,
+                  squeeze=False, report=None):
     """Read (zone) data from space-separated file.
     
     Parameters
@@ -20,6 +22,11 @@ def read_csv_file(data_dir, file_end, zone_numbers=None, dtype=None, squeeze=Fal
         Data type to cast data to
     squeeze : bool (optional)
         If the parsed data only contains one column and no header
+    report : utils.validation.ValidationReport (optional)
+        Report where found violations are collected, if not given,
+        exception is raised after all checks of the file.
+        If given, invalid rows are dropped and missing zones
+        are left as NA, so that reading can continue.
 
     Returns
     -------
@@ -47,47 +54,51 @@ def read_csv_file(data_dir, file_end, zone_numbers=None, dtype=None, squeeze=Fal
     data = pandas.read_csv(
         path, delim_whitespace=True, squeeze=squeeze, keep_default_na=False,
         na_values="", comment='#', header=header)
-    if data.index.is_numeric() and data.index.hasnans:
-        msg = "Row with only spaces or tabs in file {}".format(path)
-        log.error(msg)
-        raise IndexError(msg)
+    if report is None:
+        checks = ValidationReport()
     else:
-        for i in data.index:
-            try:
-                if numpy.isnan(i):
-                    msg = "Row with only spaces or tabs in file {}".format(path)
-                    log.error(msg)
-                    raise IndexError(msg)
-            except TypeError:
-                # Text indices are ok and should not raise an exception
-                pass
-    if data.index.has_duplicates:
-        raise IndexError("Index in file {} has duplicates".format(path))
+        checks = report
+    nr_violations = len(checks)
+    is_blank = numpy.asarray(pandas.isnull(data.index))
+    if is_blank.any():
+        checks.add(
+            path, "blank_row",
+            "Row with only spaces or tabs in file {}".format(path),
+            exception=IndexError)
+        data = data[~is_blank]
+    is_duplicate = data.index.duplicated()
+    if is_duplicate.any():
+        checks.add(
+            path, "duplicate_zone",
+            "Index in file {} has duplicates {}".format(
+                path, format_zones(data.index[is_duplicate])),
+            data.index[is_duplicate], IndexError)
+        data = data[~is_duplicate]
     if zone_numbers is not None:
         if not data.index.is_monotonic:
             data.sort_index(inplace=True)
             log.warn("File {} is not sorted in ascending order".format(path))
         if data.index.size != zone_numbers.size or (data.index != zone_numbers).any():
-            for i in data.index:
-                if int(i) not in zone_numbers:
-                    msg = "Zone number {} from file {} not found in network".format(
-                        i, path)
-                    log.error(msg)
-                    raise IndexError(msg)
-            for i in zone_numbers:
-                if i not in data.index:
-                    msg = "Zone number {} not found in file {}".format(i, path)
-                    log.error(msg)
-                    raise IndexError(msg)
-            msg = "Zone numbers did not match for file {}".format(path)
-            log.error(msg)
-            raise IndexError(msg)
+            checks.check_zones(path, data.index.values, zone_numbers)
+            # Missing zones are left as NA, so that other checks
+            # can continue with the data
+            data = data.reindex(zone_numbers)
     if dtype is not None:
         try:
             data = data.astype(dtype=dtype, errors='raise')
         except ValueError:
-            msg = "Zone data file {} has values not convertible to floats.".format(
-                file_end)
-            log.error(msg)
-            raise ValueError(msg)
+            if isinstance(data, pandas.DataFrame):
+                converted = data.apply(pandas.to_numeric, errors="coerce")
+                is_invalid = (converted.isnull() & data.notnull()).any(axis=1)
+            else:
+                converted = pandas.to_numeric(data, errors="coerce")
+                is_invalid = converted.isnull() & data.notnull()
+            checks.add(
+                path, "not_number",
+                "Zone data file {} has values not convertible to floats.".format(
+                    file_end),
+                data.index[is_invalid.values])
+            data = converted.astype(dtype=dtype)
+    if report is None:
+        checks.raise_errors(nr_violations)
     return data
@@ -0,0 +1,79 @@
+import numpy
+
+
+class RunningStats:
+    """Streaming mean and variance of arrays (Welford's algorithm).
+
+    Samples are added one at a time, so only the mean and the sum of
+    squared deviations are kept in memory, regardless of sample count.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def add(self, sample):
+        """Add one sample.
+
+        Parameters
+        ----------
+        sample : numpy.ndarray
+            Sample array (same shape for all samples)
+        """
+        sample = numpy.asarray(sample, float)
+        self.count += 1
+        if self.mean is None:
+            self.mean = sample.copy()
+            self._m2 = numpy.zeros_like(self.mean)
+        else:
+            delta = sample - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (sample-self.mean)
+
+    def __getitem__(self, index):
+        """Get statistics of part of sample arrays.
+
+        Returned statistics share memory with these, and are not
+        updated with samples added later.
+
+        Parameters
+        ----------
+        index : int, slice or tuple
+            Index to sample arrays
+
+        Returns
+        -------
+        RunningStats
+            Mean and variance of indexed part
+        """
+        part = RunningStats()
+        part.count = self.count
+        part.mean = self.mean[index]
+        part._m2 = self._m2[index]
+        return part
+
+    @property
+    def variance(self):
+        """numpy.ndarray: Sample variance (zero if only one sample)."""
+        if self.count < 2:
+            return numpy.zeros_like(self.mean)
+        return self._m2 / (self.count-1)
+
+    def confidence_interval(self, z=1.96):
+        """Get confidence interval of mean (normal approximation).
+
+        Parameters
+        ----------
+        z : float (optional)
+            Standard normal quantile (1.96 for 95 % confidence)
+
+        Returns
+        -------
+        numpy.ndarray
+            Lower bound
+        numpy.ndarray
+            Upper bound
+        """
+        half_width = z * numpy.sqrt(self.variance / self.count)
+        return self.mean - half_width, self.mean + half_width
@@ -0,0 +1,225 @@
+import json
+import numpy
+import pandas
+
+import utils.log as log
+
+
+# Number of zone numbers written out in one log message
+MAX_LISTED_ZONES = 10
+# Largest accepted share, allowing for rounding in input files
+MAX_SHARE = 1.005
+
+
+class ValidationReport:
+    """Collection of input data violations.
+
+    Checks are done with array operations over whole zone vectors
+    and matrices, and each check reports all offending zones at once.
+    Every violation is logged when found and kept in the report,
+    so that input files can be fixed in one pass. Checking code
+    calls `raise_errors` when it cannot (or should not) continue.
+    """
+
+    def __init__(self):
+        self.violations = []
+        self._exceptions = []
+
+    def __len__(self):
+        return len(self.violations)
+
+    def add(self, source, check, message, zones=(), exception=ValueError):
+        """Log violation and add it to report.
+
+        Parameters
+        ----------
+        source : str
+            File path or data key where violation was found
+        check : str
+            Name of failed check (e.g., "negative")
+        message : str
+            Description of violation
+        zones : array_like (optional)
+            Zone numbers where violation was found
+        exception : type (optional)
+            Exception class to raise for violation
+        """
+        log.error(message)
+        self.violations.append({
+            "source": source,
+            "check": check,
+            "message": message,
+            "zones": numpy.asarray(zones).tolist(),
+        })
+        self._exceptions.append(exception)
+
+    def check_zones(self, source, zone_numbers, expected):
+        """Check that given zone numbers match expected zone numbers.
+
+        Parameters
+        ----------
+        source : str
+            File path of data
+        zone_numbers : numpy.ndarray
+            Zone numbers found in data
+        expected : numpy.ndarray
+            Zone numbers of model system
+
+        Returns
+        -------
+        bool
+            True if zone numbers match
+        """
+        zone_numbers = numpy.asarray(zone_numbers)
+        expected = numpy.asarray(expected)
+        unknown = zone_numbers[~numpy.in1d(zone_numbers, expected)]
+        missing = expected[~numpy.in1d(expected, zone_numbers)]
+        if unknown.size:
+            self.add(
+                source, "unknown_zone",
+                "Zone number(s) {} from file {} not found in network".format(
+                    format_zones(unknown), source),
+                unknown, IndexError)
+        if missing.size:
+            self.add(
+                source, "missing_zone",
+                "Zone number(s) {} not found in file {}".format(
+                    format_zones(missing), source),
+                missing, IndexError)
+        return not (unknown.size or missing.size)
+
+    def check_values(self, key, zone_numbers, data, is_share=False):
+        """Check that zone vector is numeric, finite and non-negative.
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "population")
+        zone_numbers : numpy.ndarray
+            Zone numbers corresponding to values
+        data : array_like
+            Zone vector
+        is_share : bool (optional)
+            Whether values should also be at most one
+
+        Returns
+        -------
+        bool
+            True if all values are valid
+        """
+        zone_numbers = numpy.asarray(zone_numbers)
+        nr_violations = len(self)
+        try:
+            values = numpy.asarray(data, float)
+        except (TypeError, ValueError):
+            values = pandas.to_numeric(
+                pandas.Series(numpy.asarray(data, object)),
+                errors="coerce").values
+            self._add_mask(
+                key, "not_number", "{} is not a number for zone(s) {}",
+                zone_numbers, numpy.isnan(values), TypeError)
+            values = numpy.where(numpy.isnan(values), 0, values)
+        self._add_mask(
+            key, "not_finite", "{} is not a finite number for zone(s) {}",
+            zone_numbers, ~numpy.isfinite(values))
+        with numpy.errstate(invalid="ignore"):
+            self._add_mask(
+                key, "negative", "{} is negative for zone(s) {}",
+                zone_numbers, values < 0)
+            if is_share:
+                self._add_mask(
+                    key, "too_large", "{} is larger than one for zone(s) {}",
+                    zone_numbers, values > MAX_SHARE)
+        return len(self) == nr_violations
+
+    def check_matrix(self, source, zone_numbers, mtx):
+        """Check that matrix has no NA or negative values.
+
+        Parameters
+        ----------
+        source : str
+            Matrix name and file path
+        zone_numbers : numpy.ndarray
+            Zone numbers corresponding to matrix rows
+        mtx : numpy.ndarray
+            2-d matrix
+
+        Returns
+        -------
+        bool
+            True if all values are valid
+        """
+        nr_violations = len(self)
+        self._add_mask(
+            source, "not_finite", "{} contains NA values in row(s) {}",
+            zone_numbers, numpy.isnan(mtx).any(axis=1))
+        with numpy.errstate(invalid="ignore"):
+            self._add_mask(
+                source, "negative", "{} contains negative values in row(s) {}",
+                zone_numbers, (mtx < 0).any(axis=1))
+        return len(self) == nr_violations
+
+    def _add_mask(self, source, check, template, zone_numbers, mask,
+                  exception=ValueError):
+        mask = numpy.atleast_1d(mask)
+        if mask.any():
+            zones = numpy.atleast_1d(zone_numbers)[mask]
+            msg = template.format(source, format_zones(zones))
+            self.add(
+                source, check, msg[0].upper() + msg[1:], zones, exception)
+
+    def raise_errors(self, start=0):
+        """Raise exception if violations have been found.
+
+        Parameters
+        ----------
+        start : int (optional)
+            Number of violations already in report before checks
+            in question (those are not considered)
+
+        Raises
+        ------
+        IndexError, TypeError or ValueError
+            Exception of first violation, if any
+        """
+        nr_errors = len(self) - start
+        if nr_errors == 1:
+            raise self._exceptions[start](self.violations[start]["message"])
+        if nr_errors > 1:
+            msg = "{} input data errors found, first: {}".format(
+                nr_errors, self.violations[start]["message"])
+            raise self._exceptions[start](msg)
+
+    def write(self, path):
+        """Write report as JSON.
+
+        Parameters
+        ----------
+        path : str
+            Path of JSON file
+        """
+        with open(path, "w") as f:
+            json.dump(
+                {"errors": len(self), "violations": self.violations},
+                f, indent=2)
+        log.info("Validation report written to {}".format(path))
+
+
+def format_zones(zones):
+    """Format zone numbers for message, truncating long lists.
+
+    Parameters
+    ----------
+    zones : array_like
+        Zone numbers
+
+    Returns
+    -------
+    str
+        Comma-separated zone numbers
+    """
+    zones = list(zones)
+    if len(zones) > MAX_LISTED_ZONES:
+        return "{}... ({} zones)".format(
+            ", ".join(map(str, zones[:MAX_LISTED_ZONES])), len(zones))
+    return ", ".join(map(str, zones))